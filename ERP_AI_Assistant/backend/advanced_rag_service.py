@@ -22,6 +22,8 @@ from sentence_transformers import SentenceTransformer
 import chromadb
 from chromadb.config import Settings
 
+from app.services.embedding_store import get_embedding_store, cached_encode
+
 logger = logging.getLogger(__name__)
 
 # ============================================================================
@@ -69,6 +71,8 @@ class AdvancedRAGService:
         self.claude_client = ai_service.claude_client
         self.embeddings_model = ai_service.sentence_model
         self.collection = vector_service.collection
+        self.embedding_store = get_embedding_store(getattr(config, 'EMBEDDING_STORE_DIR', None),
+                                                   getattr(config, 'EMBEDDING_MODEL', ''))
         
         # Ustawienia zaawansowane
         self.max_context_length = getattr(config, 'MAX_CONTEXT_LENGTH', 2000)
@@ -427,7 +431,7 @@ Niestety, nie znalazłem odpowiednich informacji w bazie wiedzy dla tego zapytan
             logger.info(f"🚀 Initializing RAG with {len(documents)} documents")
             
             # Generate embeddings
-            embeddings = self.embeddings_model.encode(documents).tolist()
+            embeddings = cached_encode(documents, self.embeddings_model.encode, self.embedding_store).tolist()
             
             # Generate IDs
             ids = [f"doc_{i}_{hash(doc[:50])}" for i, doc in enumerate(documents)]
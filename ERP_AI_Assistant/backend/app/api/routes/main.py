@@ -165,7 +165,22 @@ class UnifiedAPIBackend:
             'LOADER_MAX_WORKERS': 6,
             'LOADER_BATCH_SIZE': 75,
             'LOADER_CACHE_ENABLED': True,
-            'LOADER_CACHE_TTL_HOURS': 24
+            'LOADER_CACHE_TTL_HOURS': 24,
+            # Persistent hybrid index / ANN / BM25 (puste = wyłączone)
+            'HYBRID_INDEX_DIR': os.getenv('HYBRID_INDEX_DIR', 'hybrid_index'),
+            'HYBRID_INDEX_DTYPE': os.getenv('HYBRID_INDEX_DTYPE', 'float16'),
+            'ANN_BACKEND': os.getenv('ANN_BACKEND', 'exact'),
+            'ANN_RECALL_TARGET': float(os.getenv('ANN_RECALL_TARGET', '0.95')),
+            'BM25_K1': float(os.getenv('BM25_K1', '1.2')),
+            'BM25_B': float(os.getenv('BM25_B', '0.75')),
+            'EMBEDDING_STORE_DIR': os.getenv('EMBEDDING_STORE_DIR'),
+            # SQL assistant: pula połączeń, limity wyników i cache
+            'SQL_POOL_SIZE': int(os.getenv('SQL_POOL_SIZE', '4')),
+            'SQL_MAX_ROWS': int(os.getenv('SQL_MAX_ROWS', '1000')),
+            'SQL_FETCH_SIZE': int(os.getenv('SQL_FETCH_SIZE', '200')),
+            'SQL_MMAP_SIZE': int(os.getenv('SQL_MMAP_SIZE', str(64 * 1024 * 1024))),
+            'SQL_RESULT_CACHE_SIZE': int(os.getenv('SQL_RESULT_CACHE_SIZE', '128')),
+            'SQL_EXPLANATION_CACHE_SIZE': int(os.getenv('SQL_EXPLANATION_CACHE_SIZE', '512'))
         }
 
     def _initialize_services(self):
@@ -0,0 +1,515 @@
+"""
+Indeksy najbliższych sąsiadów (ANN) dla HybridSearchEngine
+Backendy: exact (NumPy), hnsw / ivfpq (FAISS - opcjonalnie), ivf (czysty NumPy)
+"""
+
+import math
+import time
+import logging
+from abc import ABC, abstractmethod
+import numpy as np
+from typing import Dict, Any, Optional, List, Tuple
+
+# FAISS jest opcjonalny - bez niego używany jest indeks IVF w NumPy
+try:
+    import faiss
+    FAISS_AVAILABLE = True
+except ImportError:
+    FAISS_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+ANN_BACKENDS = ("exact", "hnsw", "ivfpq", "ivf", "auto")
+
+# Wiersze konwertowane naraz do float32 - macierz z dysku (mmap, float16) nie jest kopiowana w całości
+CHUNK_ROWS = 16384
+
+# ============================================================================
+# HELPERS
+# ============================================================================
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indeksy k najwyższych wyników (malejąco) - argpartition O(N) zamiast pełnego sortowania"""
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """Normalizacja L2 wierszy (kopia float32) - iloczyn skalarny staje się podobieństwem kosinusowym"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    if vectors.ndim == 1:
+        vectors = vectors.reshape(1, -1)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(vectors / norms)
+
+
+def dot_rows(vectors: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """vectors @ query (float32) liczone partiami po CHUNK_ROWS wierszy"""
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        scores[start:start + CHUNK_ROWS] = np.asarray(vectors[start:start + CHUNK_ROWS], dtype=np.float32) @ query
+    return scores
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Dokładne top-k (wiersze) dla wielu zapytań naraz - jeden przebieg partiami po macierzy"""
+    best_rows = np.empty((len(queries), 0), dtype=np.int64)
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk_scores = queries @ np.asarray(vectors[start:start + CHUNK_ROWS], dtype=np.float32).T
+        chunk_rows = np.broadcast_to(np.arange(start, start + chunk_scores.shape[1]), chunk_scores.shape)
+        scores = np.hstack([best_scores, chunk_scores])
+        rows = np.hstack([best_rows, chunk_rows])
+        if scores.shape[1] > k:
+            keep = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            scores = np.take_along_axis(scores, keep, axis=1)
+            rows = np.take_along_axis(rows, keep, axis=1)
+        best_scores, best_rows = scores, rows
+    order = np.argsort(-best_scores, axis=1, kind='stable')
+    return np.take_along_axis(best_rows, order, axis=1)
+
+# ============================================================================
+# INDEXES
+# ============================================================================
+
+class VectorIndex(ABC):
+    """Bazowy indeks wektorowy - wiersze numerowane tak jak macierz embeddingów
+
+    Backend musi zaimplementować search - bez niej klasy nie da się utworzyć.
+    """
+
+    backend = "base"
+    exact = False
+
+    def __init__(self, recall_target: float = 0.95):
+        self.recall_target = recall_target
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        # Wynik kalibracji - zapisywany razem z indeksem
+        self.width: Optional[int] = None
+        self.recall: Optional[float] = None
+
+    def __len__(self) -> int:
+        return len(self.vectors)
+
+    def build(self, embeddings: np.ndarray, normalized: bool = False):
+        """Buduje indeks od zera
+
+        normalized=True: wiersze mają już normę 1 - macierz (także mmap float16) jest używana
+        bez kopiowania, jako wspólna z HybridSearchEngine.
+        """
+        self.vectors = embeddings if normalized else normalize_rows(embeddings)
+        self._build_structure()
+
+    def add(self, embeddings: np.ndarray):
+        """Dopisuje wiersze na końcu indeksu (w typie danych macierzy)"""
+        new_vectors = normalize_rows(embeddings)
+        start_row = len(self.vectors)
+        if len(self.vectors):
+            self.vectors = np.vstack([self.vectors, new_vectors.astype(self.vectors.dtype)])
+        else:
+            self.vectors = new_vectors
+        self._add_to_structure(new_vectors, start_row)
+
+    def get_state(self) -> Tuple[Dict[str, Any], Dict[str, np.ndarray]]:
+        """(opis, tablice) struktury i kalibracji do zapisu obok manifestu - bez samych wektorów"""
+        meta = {'backend': self.backend, 'recall_target': self.recall_target,
+                'num_vectors': len(self.vectors), 'width': self.width, 'recall': self.recall}
+        return meta, self._structure_arrays()
+
+    def restore(self, vectors: np.ndarray, meta: Optional[Dict[str, Any]],
+                arrays: Dict[str, np.ndarray]) -> bool:
+        """Odtwarza zapisaną strukturę dla znormalizowanych wektorów - False gdy nie pasuje"""
+        if (not meta or meta.get('backend') != self.backend
+                or meta.get('recall_target') != self.recall_target
+                or meta.get('num_vectors') != len(vectors)):
+            return False
+        try:
+            self.vectors = vectors
+            self._restore_structure(arrays)
+        except Exception as e:
+            logger.warning(f"Nie można odtworzyć indeksu {self.backend} - przebudowa: {e}")
+            return False
+        self.width, self.recall = meta.get('width'), meta.get('recall')
+        if self.width is not None:
+            self._set_width(self.width)
+        return True
+
+    @abstractmethod
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """Zwraca (wiersze, podobieństwa kosinusowe) k najbliższych sąsiadów"""
+
+    def score_rows(self, query: np.ndarray, rows: np.ndarray) -> np.ndarray:
+        """Dokładne podobieństwo kosinusowe dla wybranych wierszy (rescoring kandydatów)"""
+        return np.asarray(self.vectors[rows], dtype=np.float32) @ normalize_rows(query)[0]
+
+    def calibrate(self, sample_size: int = 200, k: int = 10) -> float:
+        """Dobiera szerokość przeszukiwania tak, by osiągnąć docelowy recall@k"""
+        return 1.0
+
+    def _build_structure(self):
+        pass
+
+    def _add_to_structure(self, new_vectors: np.ndarray, start_row: int):
+        pass
+
+    def _structure_arrays(self) -> Dict[str, np.ndarray]:
+        return {}
+
+    def _restore_structure(self, arrays: Dict[str, np.ndarray]):
+        pass
+
+    def _calibrate_width(self, widths: List[int], sample_size: int, k: int) -> float:
+        """Zwiększa szerokość (nprobe/efSearch) aż recall@k na próbce osiągnie cel"""
+        n = len(self.vectors)
+        if n == 0:
+            return 1.0
+
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(n, size=min(sample_size, n), replace=False))
+        sample = np.asarray(self.vectors[sample_rows], dtype=np.float32)
+        k = min(k, n)
+        truth = [set(rows) for rows in exact_top_k(self.vectors, sample, k).tolist()]
+
+        recall = 0.0
+        for width in widths:
+            self._set_width(width)
+            hits = sum(len(truth[i] & set(self.search(query, k)[0])) for i, query in enumerate(sample))
+            recall = hits / (len(sample) * k)
+            if recall >= self.recall_target:
+                break
+
+        self.width, self.recall = width, recall
+        logger.info(f"🎯 Kalibracja indeksu {self.backend}: szerokość={width}, recall@{k}={recall:.3f}")
+        return recall
+
+    def _set_width(self, width: int):
+        pass
+
+
+class ExactIndex(VectorIndex):
+    """Dokładne wyszukiwanie - jeden iloczyn macierzowy + argpartition"""
+
+    backend = "exact"
+    exact = True
+
+    def score_all(self, query: np.ndarray) -> np.ndarray:
+        return dot_rows(self.vectors, normalize_rows(query)[0])
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = self.score_all(query)
+        rows = top_k_indices(scores, k)
+        return rows, scores[rows]
+
+
+class IVFIndex(VectorIndex):
+    """Indeks IVF (k-means + listy odwrócone) w czystym NumPy"""
+
+    backend = "ivf"
+
+    def __init__(self, recall_target: float = 0.95, nlist: Optional[int] = None,
+                 kmeans_iterations: int = 10):
+        super().__init__(recall_target)
+        self.nlist = nlist
+        self.nprobe = 1
+        self.kmeans_iterations = kmeans_iterations
+        self.centroids = None
+        self.inverted_lists: List[np.ndarray] = []
+
+    def _build_structure(self):
+        n = len(self.vectors)
+        nlist = self.nlist or max(1, int(4 * math.sqrt(n)))
+        nlist = min(nlist, n)
+
+        # K-means na próbce (sferyczny - centroidy normalizowane)
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(n, size=min(n, nlist * 64), replace=False))
+        sample = np.asarray(self.vectors[sample_rows], dtype=np.float32)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+
+        for _ in range(self.kmeans_iterations):
+            assignment = np.argmax(sample @ centroids.T, axis=1)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            empty = np.bincount(assignment, minlength=nlist) == 0
+            sums[empty] = centroids[empty]
+            centroids = normalize_rows(sums)
+
+        self.centroids = centroids
+        assignment = self._assign(self.vectors)
+        order = np.argsort(assignment, kind='stable')
+        bounds = np.searchsorted(assignment[order], np.arange(nlist + 1))
+        self.inverted_lists = [order[bounds[i]:bounds[i + 1]] for i in range(nlist)]
+        self.nprobe = max(1, math.ceil(nlist * 0.1))
+
+    def _add_to_structure(self, new_vectors: np.ndarray, start_row: int):
+        if self.centroids is None:
+            self._build_structure()
+            return
+        assignment = self._assign(new_vectors)
+        for list_id in np.unique(assignment):
+            rows = start_row + np.flatnonzero(assignment == list_id)
+            self.inverted_lists[list_id] = np.concatenate([self.inverted_lists[list_id], rows])
+
+    def _assign(self, vectors: np.ndarray) -> np.ndarray:
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for start in range(0, len(vectors), 4096):
+            chunk = np.asarray(vectors[start:start + 4096], dtype=np.float32)
+            assignment[start:start + 4096] = np.argmax(chunk @ self.centroids.T, axis=1)
+        return assignment
+
+    def _structure_arrays(self) -> Dict[str, np.ndarray]:
+        lengths = [len(rows) for rows in self.inverted_lists]
+        return {
+            'ann_centroids': self.centroids,
+            'ann_list_indptr': np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64),
+            'ann_list_rows': np.concatenate(self.inverted_lists).astype(np.int64)
+        }
+
+    def _restore_structure(self, arrays: Dict[str, np.ndarray]):
+        indptr = np.asarray(arrays['ann_list_indptr'])
+        rows = np.asarray(arrays['ann_list_rows'], dtype=np.int64)
+        self.centroids = np.asarray(arrays['ann_centroids'], dtype=np.float32)
+        self.inverted_lists = [rows[indptr[i]:indptr[i + 1]] for i in range(len(indptr) - 1)]
+
+    def _set_width(self, width: int):
+        self.nprobe = min(width, len(self.inverted_lists))
+
+    def calibrate(self, sample_size: int = 200, k: int = 10) -> float:
+        nlist = len(self.inverted_lists)
+        widths = sorted({min(nlist, 2 ** i) for i in range(int(math.log2(max(nlist, 1))) + 2)})
+        return self._calibrate_width(widths, sample_size, k)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        query = normalize_rows(query)[0]
+        probe = top_k_indices(self.centroids @ query, self.nprobe)
+        rows = np.concatenate([self.inverted_lists[list_id] for list_id in probe])
+        scores = np.asarray(self.vectors[rows], dtype=np.float32) @ query
+        best = top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+
+def _faiss_add(index, vectors: np.ndarray):
+    """Dodaje wektory do indeksu FAISS partiami float32"""
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        index.add(np.ascontiguousarray(vectors[start:start + CHUNK_ROWS], dtype=np.float32))
+
+
+class FaissHNSWIndex(VectorIndex):
+    """Graf HNSW z FAISS (iloczyn skalarny na znormalizowanych wektorach)"""
+
+    backend = "hnsw"
+
+    def __init__(self, recall_target: float = 0.95, m: int = 32, ef_construction: int = 200):
+        super().__init__(recall_target)
+        self.m = m
+        self.ef_construction = ef_construction
+        self.index = None
+
+    def _build_structure(self):
+        self.index = faiss.IndexHNSWFlat(self.vectors.shape[1], self.m, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efConstruction = self.ef_construction
+        _faiss_add(self.index, self.vectors)
+        self._set_width(64)
+
+    def _add_to_structure(self, new_vectors: np.ndarray, start_row: int):
+        if self.index is None:
+            self._build_structure()
+        else:
+            # HNSW numeruje wektory sekwencyjnie - zgodnie z wierszami macierzy
+            self.index.add(new_vectors)
+
+    def _set_width(self, width: int):
+        self.index.hnsw.efSearch = width
+
+    def _structure_arrays(self) -> Dict[str, np.ndarray]:
+        return {'ann_faiss': faiss.serialize_index(self.index)}
+
+    def _restore_structure(self, arrays: Dict[str, np.ndarray]):
+        self.index = faiss.deserialize_index(np.asarray(arrays['ann_faiss']))
+
+    def calibrate(self, sample_size: int = 200, k: int = 10) -> float:
+        return self._calibrate_width([16, 32, 64, 128, 256, 512], sample_size, k)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        if self.index.hnsw.efSearch < k:
+            self._set_width(k)
+        scores, rows = self.index.search(normalize_rows(query), min(k, len(self.vectors)))
+        valid = rows[0] >= 0
+        return rows[0][valid].astype(np.int64), scores[0][valid]
+
+
+class FaissIVFPQIndex(VectorIndex):
+    """IVF-PQ z FAISS - skompresowane kody, wyniki kandydatów przeliczane dokładnie"""
+
+    backend = "ivfpq"
+
+    def __init__(self, recall_target: float = 0.95, nlist: Optional[int] = None, pq_bits: int = 8,
+                 refine_factor: int = 10):
+        super().__init__(recall_target)
+        self.nlist = nlist
+        self.pq_bits = pq_bits
+        self.refine_factor = refine_factor
+        self.index = None
+
+    @staticmethod
+    def can_train(num_vectors: int, nbits: int = 8) -> bool:
+        """PQ potrzebuje co najmniej 2^nbits przykładów treningowych na podprzestrzeń"""
+        return num_vectors >= 2 ** nbits * 4
+
+    def _build_structure(self):
+        n, dim = self.vectors.shape
+        nlist = self.nlist or max(1, min(int(4 * math.sqrt(n)), n // 39))
+        # Liczba podprzestrzeni musi dzielić wymiar embeddingu
+        m = next(m for m in (dim // 8, dim // 4, dim // 2, dim, 1) if m >= 1 and dim % m == 0)
+
+        quantizer = faiss.IndexFlatIP(dim)
+        self.index = faiss.IndexIVFPQ(quantizer, dim, nlist, m, self.pq_bits, faiss.METRIC_INNER_PRODUCT)
+        # Trening na próbce (jak zaleca FAISS) - bez kopii float32 całej macierzy
+        rng = np.random.default_rng(0)
+        train_rows = np.sort(rng.choice(n, size=min(n, max(nlist * 64, 2 ** self.pq_bits * 64)), replace=False))
+        self.index.train(np.ascontiguousarray(self.vectors[train_rows], dtype=np.float32))
+        _faiss_add(self.index, self.vectors)
+        self._quantizer = quantizer
+        self._set_width(max(1, math.ceil(nlist * 0.1)))
+
+    def _add_to_structure(self, new_vectors: np.ndarray, start_row: int):
+        if self.index is None:
+            self._build_structure()
+        else:
+            self.index.add(new_vectors)
+
+    def _set_width(self, width: int):
+        self.index.nprobe = min(width, self.index.nlist)
+
+    def _structure_arrays(self) -> Dict[str, np.ndarray]:
+        return {'ann_faiss': faiss.serialize_index(self.index)}
+
+    def _restore_structure(self, arrays: Dict[str, np.ndarray]):
+        self.index = faiss.deserialize_index(np.asarray(arrays['ann_faiss']))
+
+    def calibrate(self, sample_size: int = 200, k: int = 10) -> float:
+        nlist = self.index.nlist
+        widths = sorted({min(nlist, 2 ** i) for i in range(int(math.log2(max(nlist, 1))) + 2)})
+        return self._calibrate_width(widths, sample_size, k)
+
+    def search(self, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Kody PQ są przybliżone - pobierz więcej kandydatów i przelicz dokładnie
+        fetch = min(len(self.vectors), max(k * self.refine_factor, 64))
+        _, rows = self.index.search(normalize_rows(query), fetch)
+        rows = rows[0][rows[0] >= 0].astype(np.int64)
+        scores = self.score_rows(query, rows)
+        best = top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+# ============================================================================
+# FACTORY
+# ============================================================================
+
+def create_ann_index(backend: str = "exact", recall_target: float = 0.95,
+                     num_documents: int = 0, min_documents: int = 20000) -> VectorIndex:
+    """Tworzy indeks wg konfiguracji (ANN_BACKEND) z fallbackiem gdy brak FAISS"""
+    backend = (backend or "exact").lower()
+    if backend not in ANN_BACKENDS:
+        raise ValueError(f"Nieznany backend ANN: {backend} (dostępne: {', '.join(ANN_BACKENDS)})")
+
+    if backend == "auto":
+        if num_documents < min_documents:
+            return ExactIndex(recall_target)
+        backend = "hnsw" if FAISS_AVAILABLE else "ivf"
+
+    if backend in ("hnsw", "ivfpq") and not FAISS_AVAILABLE:
+        logger.warning(f"FAISS nie jest dostępny - backend {backend} zastąpiony indeksem IVF (NumPy)")
+        backend = "ivf"
+
+    if backend == "ivfpq" and not FaissIVFPQIndex.can_train(num_documents):
+        logger.warning("Za mało dokumentów do wytrenowania IVF-PQ - używam HNSW")
+        backend = "hnsw"
+
+    if backend == "hnsw":
+        return FaissHNSWIndex(recall_target)
+    if backend == "ivfpq":
+        return FaissIVFPQIndex(recall_target)
+    if backend == "ivf":
+        return IVFIndex(recall_target)
+    return ExactIndex(recall_target)
+
+# ============================================================================
+# BENCHMARK
+# ============================================================================
+
+def benchmark_ann_backends(embeddings: np.ndarray, queries: np.ndarray, k: int = 10,
+                           backends: Tuple[str, ...] = ("exact", "ivf", "hnsw", "ivfpq"),
+                           recall_target: float = 0.95) -> Dict[str, Dict[str, Any]]:
+    """Recall@k i opóźnienie backendów ANN względem dotychczasowego brute-force (cosine + argsort)"""
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    results = {}
+
+    # Punkt odniesienia - dotychczasowa ścieżka HybridSearchEngine.search
+    truth = []
+    start = time.perf_counter()
+    for query in queries:
+        scores = cosine_similarity(query.reshape(1, -1), embeddings)[0]
+        truth.append(set(np.argsort(scores)[::-1][:k]))
+    results["brute_force"] = {
+        'recall_at_k': 1.0,
+        'avg_latency_ms': (time.perf_counter() - start) / len(queries) * 1000,
+        'build_seconds': 0.0
+    }
+
+    for backend in backends:
+        if backend in ("hnsw", "ivfpq") and not FAISS_AVAILABLE:
+            continue
+
+        index = create_ann_index(backend, recall_target, num_documents=len(embeddings))
+        start = time.perf_counter()
+        index.build(embeddings)
+        index.calibrate(k=k)
+        build_seconds = time.perf_counter() - start
+
+        hits = 0
+        start = time.perf_counter()
+        for i, query in enumerate(queries):
+            rows, _ = index.search(query, k)
+            hits += len(truth[i] & set(rows.tolist()))
+
+        results[index.backend] = {
+            'recall_at_k': hits / (len(queries) * k),
+            'avg_latency_ms': (time.perf_counter() - start) / len(queries) * 1000,
+            'build_seconds': build_seconds
+        }
+
+    return results
+
+
+def run_ann_benchmark(num_documents: int = 50000, dim: int = 384, num_queries: int = 200, k: int = 10):
+    """Benchmark na syntetycznych embeddingach (klastry jak w dokumentacji ERP)"""
+    print(f"🧪 Benchmark ANN: {num_documents} dokumentów, wymiar {dim}, {num_queries} zapytań, k={k}")
+
+    rng = np.random.default_rng(42)
+    centers = rng.standard_normal((256, dim)).astype(np.float32)
+    embeddings = centers[rng.integers(0, 256, num_documents)] + \
+        0.5 * rng.standard_normal((num_documents, dim)).astype(np.float32)
+    queries = embeddings[rng.choice(num_documents, num_queries, replace=False)] + \
+        0.1 * rng.standard_normal((num_queries, dim)).astype(np.float32)
+
+    results = benchmark_ann_backends(embeddings, queries, k=k)
+    baseline = results["brute_force"]["avg_latency_ms"]
+
+    for backend, stats in results.items():
+        print(f"📊 {backend:12s} recall@{k}={stats['recall_at_k']:.3f}  "
+              f"latency={stats['avg_latency_ms']:.2f} ms ({baseline / stats['avg_latency_ms']:.1f}x)  "
+              f"build={stats['build_seconds']:.1f} s")
+
+    return results
+
+
+if __name__ == "__main__":
+    run_ann_benchmark()
@@ -0,0 +1,258 @@
+"""
+Indeks odwrócony Okapi BM25 dla HybridSearchEngine
+Postings jako zwarte array('I') (id dokumentów + tf), MaxScore dla top-k
+"""
+
+import math
+import logging
+import numpy as np
+from array import array
+from collections import Counter
+from typing import Dict, Any, Optional, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# BM25 INDEX
+# ============================================================================
+
+class BM25Index:
+    """Indeks odwrócony z punktacją Okapi BM25 - koszt zależy od długości postings termów zapytania"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+
+        self.term_ids: Dict[str, int] = {}
+        self.terms: List[str] = []
+        self.postings_docs: List[array] = []
+        self.postings_tfs: List[array] = []
+        self.doc_lengths = array('I')
+        self.total_length = 0
+
+        # Górne ograniczenia wyniku termów (MaxScore) - unieważniane po dodaniu dokumentów
+        self._upper_bounds: Dict[int, float] = {}
+        self._doc_lengths_cache: Optional[np.ndarray] = None
+
+    @property
+    def num_documents(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def avg_doc_length(self) -> float:
+        return self.total_length / self.num_documents if self.num_documents else 0.0
+
+    def add(self, tokenized_docs: List[List[str]]) -> int:
+        """Dopisuje dokumenty (kolejne wiersze) - postings pozostają posortowane po id"""
+        start_row = self.num_documents
+        for offset, tokens in enumerate(tokenized_docs):
+            row = start_row + offset
+            for term, tf in Counter(tokens).items():
+                term_id = self.term_ids.get(term)
+                if term_id is None:
+                    term_id = len(self.terms)
+                    self.term_ids[term] = term_id
+                    self.terms.append(term)
+                    self.postings_docs.append(array('I'))
+                    self.postings_tfs.append(array('I'))
+                self.postings_docs[term_id].append(row)
+                self.postings_tfs[term_id].append(tf)
+            self.doc_lengths.append(len(tokens))
+            self.total_length += len(tokens)
+
+        self._upper_bounds.clear()
+        self._doc_lengths_cache = None
+        return start_row
+
+    def idf(self, term_id: int) -> float:
+        """IDF w wariancie nieujemnym (jak w Lucene)"""
+        df = len(self.postings_docs[term_id])
+        return math.log(1.0 + (self.num_documents - df + 0.5) / (df + 0.5))
+
+    def score(self, query_tokens: List[str],
+              exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Wyczerpujące BM25 po postings termów zapytania - (wiersze, wyniki) z wynikiem > 0"""
+        term_ids = self._query_term_ids(query_tokens)
+        if not term_ids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        doc_lengths = self._doc_lengths_view()
+        rows = []
+        scores = []
+        for term_id in term_ids:
+            docs, tfs = self._postings_view(term_id)
+            rows.append(docs)
+            scores.append(self._term_scores(term_id, tfs, doc_lengths[docs]))
+
+        return self._merge(rows, scores, exclude)
+
+    def score_rows(self, query_tokens: List[str], rows: np.ndarray) -> np.ndarray:
+        """BM25 dla wskazanych wierszy (wyszukiwanie binarne w posortowanych postings)"""
+        rows = np.asarray(rows, dtype=np.int64)
+        totals = np.zeros(len(rows), dtype=np.float64)
+        if len(rows) == 0:
+            return totals
+
+        doc_lengths = self._doc_lengths_view()
+        for term_id in self._query_term_ids(query_tokens):
+            docs, tfs = self._postings_view(term_id)
+            positions = np.minimum(np.searchsorted(docs, rows), len(docs) - 1)
+            hit = docs[positions] == rows
+            if hit.any():
+                totals[hit] += self._term_scores(term_id, tfs[positions[hit]], doc_lengths[rows[hit]])
+        return totals
+
+    def top_k(self, query_tokens: List[str], k: int,
+              exclude: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k z wczesnym zakończeniem MaxScore (term-at-a-time)
+
+        Termy przetwarzane są malejąco wg górnego ograniczenia. Gdy k-ty najlepszy wynik
+        przekroczy sumę ograniczeń pozostałych termów, żaden nowy dokument nie wejdzie
+        do top-k - pozostałe termy są liczone tylko dla już znalezionych kandydatów.
+        """
+        term_ids = sorted(self._query_term_ids(query_tokens), key=self._upper_bound, reverse=True)
+        if not term_ids or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float64)
+
+        remaining_bound = sum(self._upper_bound(term_id) for term_id in term_ids)
+        doc_lengths = self._doc_lengths_view()
+        essential_rows = []
+        essential_scores = []
+        candidates = None
+
+        for position, term_id in enumerate(term_ids):
+            remaining_bound -= self._upper_bound(term_id)
+            docs, tfs = self._postings_view(term_id)
+
+            if candidates is None:
+                # Termy "istotne" - każdy dokument z postings może wejść do top-k
+                essential_rows.append(docs)
+                essential_scores.append(self._term_scores(term_id, tfs, doc_lengths[docs]))
+                if position + 1 < len(term_ids):
+                    rows, totals = self._merge(essential_rows, essential_scores, exclude)
+                    if self._kth_score(totals, k) > remaining_bound:
+                        candidates = rows
+            else:
+                # Termy "nieistotne" - tylko uzupełnienie wyników kandydatów
+                totals += self.score_rows([self.terms[term_id]], candidates)
+
+        if candidates is None:
+            candidates, totals = self._merge(essential_rows, essential_scores, exclude)
+
+        k = min(k, len(totals))
+        best = np.argpartition(-totals, k - 1)[:k] if k < len(totals) else np.arange(len(totals))
+        best = best[np.argsort(-totals[best], kind='stable')]
+        return candidates[best], totals[best]
+
+    def compacted(self, keep: np.ndarray) -> "BM25Index":
+        """Nowy indeks bez usuniętych wierszy (przenumerowanie id dokumentów)"""
+        keep = np.asarray(keep, dtype=bool)
+        new_row = np.cumsum(keep) - 1
+        arrays = self.to_arrays()
+
+        doc_ids = arrays['bm25_doc_ids']
+        kept = keep[doc_ids]
+        term_of_posting = np.repeat(np.arange(len(self.terms)), np.diff(arrays['bm25_indptr']))[kept]
+        counts = np.bincount(term_of_posting, minlength=len(self.terms))
+
+        compacted_arrays = {
+            'bm25_indptr': np.concatenate([[0], np.cumsum(counts)]).astype(np.int64),
+            'bm25_doc_ids': new_row[doc_ids[kept]].astype(np.uint32),
+            'bm25_tfs': arrays['bm25_tfs'][kept],
+            'bm25_doc_lengths': arrays['bm25_doc_lengths'][keep]
+        }
+        index = BM25Index.from_arrays(compacted_arrays, self.terms, self.k1, self.b)
+
+        # Termy występujące wyłącznie w usuniętych dokumentach znikają ze słownika
+        if (counts == 0).any():
+            live_terms = np.flatnonzero(counts)
+            index.terms = [index.terms[term_id] for term_id in live_terms]
+            index.postings_docs = [index.postings_docs[term_id] for term_id in live_terms]
+            index.postings_tfs = [index.postings_tfs[term_id] for term_id in live_terms]
+            index.term_ids = {term: term_id for term_id, term in enumerate(index.terms)}
+        return index
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """Postings w układzie CSR (term -> dokumenty) do zapisu na dysku"""
+        lengths = [len(postings) for postings in self.postings_docs]
+        return {
+            'bm25_indptr': np.concatenate([[0], np.cumsum(lengths, dtype=np.int64)]).astype(np.int64),
+            'bm25_doc_ids': np.frombuffer(b''.join(p.tobytes() for p in self.postings_docs), dtype=np.uint32),
+            'bm25_tfs': np.frombuffer(b''.join(p.tobytes() for p in self.postings_tfs), dtype=np.uint32),
+            'bm25_doc_lengths': np.frombuffer(self.doc_lengths.tobytes(), dtype=np.uint32)
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray], terms: List[str],
+                    k1: float = 1.2, b: float = 0.75) -> "BM25Index":
+        """Odtwarza indeks z tablic CSR"""
+        index = cls(k1, b)
+        indptr = np.asarray(arrays['bm25_indptr'], dtype=np.int64)
+        doc_ids = np.ascontiguousarray(arrays['bm25_doc_ids'], dtype=np.uint32)
+        tfs = np.ascontiguousarray(arrays['bm25_tfs'], dtype=np.uint32)
+
+        index.terms = list(terms)
+        index.term_ids = {term: term_id for term_id, term in enumerate(index.terms)}
+        for term_id in range(len(index.terms)):
+            start, end = indptr[term_id], indptr[term_id + 1]
+            index.postings_docs.append(array('I', doc_ids[start:end].tobytes()))
+            index.postings_tfs.append(array('I', tfs[start:end].tobytes()))
+
+        index.doc_lengths = array('I', np.ascontiguousarray(arrays['bm25_doc_lengths'], dtype=np.uint32).tobytes())
+        index.total_length = int(sum(index.doc_lengths))
+        return index
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'documents': self.num_documents,
+            'terms': len(self.terms),
+            'postings': sum(len(postings) for postings in self.postings_docs),
+            'avg_doc_length': round(self.avg_doc_length, 2)
+        }
+
+    def _query_term_ids(self, query_tokens: List[str]) -> List[int]:
+        """Unikalne termy zapytania obecne w słowniku"""
+        return [self.term_ids[term] for term in dict.fromkeys(query_tokens) if term in self.term_ids]
+
+    def _postings_view(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        # Kopie (nie widoki bufora) - array('I') musi pozostać rozszerzalny przez add()
+        return (np.array(self.postings_docs[term_id], dtype=np.int64),
+                np.array(self.postings_tfs[term_id], dtype=np.float64))
+
+    def _doc_lengths_view(self) -> np.ndarray:
+        if self._doc_lengths_cache is None:
+            self._doc_lengths_cache = np.array(self.doc_lengths, dtype=np.float64)
+        return self._doc_lengths_cache
+
+    @staticmethod
+    def _merge(rows: List[np.ndarray], scores: List[np.ndarray],
+               exclude: Optional[np.ndarray]) -> Tuple[np.ndarray, np.ndarray]:
+        """Sumuje wyniki termów per dokument i pomija wiersze usunięte"""
+        rows, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        if exclude is not None:
+            keep = ~exclude[rows]
+            rows, totals = rows[keep], totals[keep]
+        return rows, totals
+
+    def _term_scores(self, term_id: int, tfs: np.ndarray, doc_lengths: np.ndarray) -> np.ndarray:
+        avg_length = self.avg_doc_length or 1.0
+        norm = self.k1 * (1.0 - self.b + self.b * doc_lengths / avg_length)
+        return self.idf(term_id) * tfs * (self.k1 + 1.0) / (tfs + norm)
+
+    def _upper_bound(self, term_id: int) -> float:
+        """Maksymalny wkład termu do wyniku dokumentu"""
+        bound = self._upper_bounds.get(term_id)
+        if bound is None:
+            docs, tfs = self._postings_view(term_id)
+            scores = self._term_scores(term_id, tfs, self._doc_lengths_view()[docs])
+            bound = float(scores.max()) if len(scores) else 0.0
+            self._upper_bounds[term_id] = bound
+        return bound
+
+    @staticmethod
+    def _kth_score(totals: np.ndarray, k: int) -> float:
+        """k-ty najlepszy wynik (0 gdy mniej niż k dokumentów)"""
+        if len(totals) < k:
+            return 0.0
+        return float(np.partition(totals, len(totals) - k)[len(totals) - k])
@@ -0,0 +1,171 @@
+"""
+Indeks słów kluczowych (.hhk) i spis treści (.hhc) zdekompilowanej pomocy CHM
+Gotowy indeks autora dokumentacji zamiast odtwarzania go z treści stron HTML
+"""
+
+import re
+import logging
+from html.parser import HTMLParser
+from pathlib import Path
+from dataclasses import dataclass
+from typing import Dict, Any, Optional, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Pliki HTML Help Workshop deklarują stronę kodową w <meta>, domyślnie windows-1250 (pomoc Comarch)
+DEFAULT_ENCODING = 'windows-1250'
+_CHARSET_PATTERN = re.compile(rb'charset\s*=\s*["\']?([\w-]+)', re.IGNORECASE)
+
+@dataclass
+class ChmTopic:
+    """Węzeł spisu treści wskazujący stronę pomocy"""
+    name: str
+    local: str
+    parents: Tuple[str, ...] = ()
+
+    @property
+    def toc_path(self) -> str:
+        return " > ".join(self.parents + (self.name,))
+
+class _SitemapParser(HTMLParser):
+    """Zdarzeniowy parser sitemap HTML Help: <OBJECT type="text/sitemap"> z <param>, zagnieżdżenie przez <UL>"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.entries: List[Tuple[int, List[Tuple[str, str]]]] = []
+        self.depth = 0
+        self._params: Optional[List[Tuple[str, str]]] = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == 'ul':
+            self.depth += 1
+        elif tag == 'object':
+            if (dict(attrs).get('type') or '').lower() == 'text/sitemap':
+                self._params = []
+        elif tag == 'param' and self._params is not None:
+            attrs = dict(attrs)
+            if attrs.get('name') and attrs.get('value') is not None:
+                self._params.append((attrs['name'].lower(), attrs['value']))
+
+    def handle_endtag(self, tag):
+        if tag == 'ul':
+            self.depth = max(0, self.depth - 1)
+        elif tag == 'object' and self._params is not None:
+            self.entries.append((self.depth, self._params))
+            self._params = None
+
+def _page_key(local: str) -> str:
+    """Klucz strony: bez kotwicy, separatory '/', bez wielkości liter (CHM jest case-insensitive)"""
+    return local.split('#', 1)[0].replace('\\', '/').strip().lower()
+
+def read_sitemap(file_path: Path) -> List[Tuple[int, List[Tuple[str, str]]]]:
+    """Wpisy pliku .hhk/.hhc: (głębokość zagnieżdżenia, [(parametr, wartość), ...])"""
+    raw = file_path.read_bytes()
+    match = _CHARSET_PATTERN.search(raw[:2048])
+    encoding = match.group(1).decode('ascii') if match else DEFAULT_ENCODING
+    try:
+        content = raw.decode(encoding, errors='replace')
+    except LookupError:
+        content = raw.decode(DEFAULT_ENCODING, errors='replace')
+
+    parser = _SitemapParser()
+    parser.feed(content)
+    parser.close()
+    return parser.entries
+
+class ChmIndex:
+    """Słowa kluczowe i hierarchia stron jednego katalogu pomocy CHM
+
+    keyword -> strony i strona -> (słowa kluczowe, węzeł spisu treści) to zwykłe słowniki,
+    więc wyszukanie funkcji API (np. XLNowyDokument) jest pojedynczym trafieniem w dict.
+    """
+
+    def __init__(self, base_dir: Path):
+        self.base_dir = Path(base_dir)
+        self.keywords: Dict[str, List[str]] = {}
+        self.page_keywords: Dict[str, List[str]] = {}
+        self.topics: Dict[str, ChmTopic] = {}
+        self.sources: List[str] = []
+
+    @classmethod
+    def from_directory(cls, directory: Path) -> Optional['ChmIndex']:
+        """Indeks z plików .hhk/.hhc katalogu - None gdy katalog ich nie zawiera"""
+        directory = Path(directory)
+        if not directory.is_dir():
+            return None
+        index = cls(directory)
+        for file_path in sorted(directory.iterdir()):
+            suffix = file_path.suffix.lower()
+            try:
+                if suffix == '.hhk':
+                    index.load_keyword_index(file_path)
+                elif suffix == '.hhc':
+                    index.load_toc(file_path)
+            except Exception as e:
+                logger.warning(f"⚠️ Nie można wczytać indeksu CHM {file_path}: {e}")
+        if not index.sources:
+            return None
+        logger.info(f"📑 Indeks CHM {directory.name}: {len(index.keywords)} słów kluczowych, "
+                    f"{len(index.topics)} stron w spisie treści")
+        return index
+
+    def load_keyword_index(self, file_path: Path):
+        """.hhk: słowo kluczowe (Name) -> strony (Local); podhasła zachowują własną nazwę"""
+        for _, params in read_sitemap(file_path):
+            names = [value for key, value in params if key == 'name']
+            pages = [_page_key(value) for key, value in params if key == 'local']
+            if not names or not pages:
+                continue
+            keyword = names[0].strip()
+            targets = self.keywords.setdefault(keyword.lower(), [])
+            for page in pages:
+                if page not in targets:
+                    targets.append(page)
+                page_keywords = self.page_keywords.setdefault(page, [])
+                if keyword not in page_keywords:
+                    page_keywords.append(keyword)
+        self.sources.append(file_path.name)
+
+    def load_toc(self, file_path: Path):
+        """.hhc: hierarchia stron - ścieżka węzłów nadrzędnych dla każdej strony"""
+        stack: List[str] = []
+        for depth, params in read_sitemap(file_path):
+            names = [value for key, value in params if key == 'name']
+            if not names:
+                continue
+            name = names[0].strip()
+            level = max(depth - 1, 0)
+            parents = tuple(stack[:level])
+            stack = stack[:level] + [name]
+
+            local = next((value for key, value in params if key == 'local'), None)
+            if local:
+                page = _page_key(local)
+                # Strona występująca kilka razy - obowiązuje pierwsze (najwyżej położone) miejsce
+                self.topics.setdefault(page, ChmTopic(name=name, local=page, parents=parents))
+        self.sources.append(file_path.name)
+
+    def lookup(self, keyword: str) -> List[Path]:
+        """Strony przypisane do słowa kluczowego (bez względu na wielkość liter)"""
+        return [self.base_dir / page for page in self.keywords.get(keyword.strip().lower(), ())]
+
+    def keywords_for(self, file_path: Path) -> List[str]:
+        return self.page_keywords.get(self._relative_key(file_path), [])
+
+    def topic_for(self, file_path: Path) -> Optional[ChmTopic]:
+        return self.topics.get(self._relative_key(file_path))
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            'directory': str(self.base_dir),
+            'sources': list(self.sources),
+            'keywords': len(self.keywords),
+            'topics': len(self.topics)
+        }
+
+    def _relative_key(self, file_path: Path) -> str:
+        file_path = Path(file_path)
+        try:
+            return _page_key(file_path.relative_to(self.base_dir).as_posix())
+        except ValueError:
+            return _page_key(file_path.name)
@@ -9,18 +9,28 @@ import logging
 import hashlib
 import sqlite3
 import json
+import io
+import math
+import time
 import asyncio
+import threading
+import queue
+import zlib
 import aiofiles
 from pathlib import Path
-from typing import List, Dict, Any, Optional, Tuple, AsyncGenerator
+from typing import List, Dict, Any, Optional, Tuple, AsyncGenerator, Iterator
 from bs4 import BeautifulSoup
-import chardet
 from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from datetime import datetime
-import pickle
 from dataclasses import dataclass, asdict
 from tqdm import tqdm
 
+from .embedding_store import get_embedding_store, cached_encode
+from .chm_index import ChmIndex
+from .text_chunker import TextChunker
+from .file_discovery import FileDiscovery
+from .encoding_detection import EncodingDetector
+
 # Dla obsługi PDF
 try:
     import PyPDF2
@@ -32,6 +42,34 @@ except ImportError:
     except ImportError:
         PDF_AVAILABLE = False
 
+# Szybki niekryptograficzny hash zawartości (opcjonalnie) - w przeciwnym razie BLAKE2b
+try:
+    import xxhash
+    XXHASH_AVAILABLE = True
+except ImportError:
+    XXHASH_AVAILABLE = False
+
+# Szybka ścieżka parsowania HTML/XML (lxml) - BeautifulSoup pozostaje rezerwą
+try:
+    import lxml.html
+    from lxml import etree
+    LXML_AVAILABLE = True
+except ImportError:
+    LXML_AVAILABLE = False
+
+# Kompresja treści dokumentów w cache: lz4 (najszybsza dekompresja), zstd, w ostateczności zlib
+try:
+    import lz4.block
+    LZ4_AVAILABLE = True
+except ImportError:
+    LZ4_AVAILABLE = False
+
+try:
+    import zstandard
+    ZSTD_AVAILABLE = True
+except ImportError:
+    ZSTD_AVAILABLE = False
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -62,17 +100,70 @@ class ProcessingProgress:
             return 0.0
         return (self.processed_files / self.total_files) * 100
 
+# Sygnatura pliku do szybkiego wykrywania zmian: (rozmiar, mtime_ns, inode)
+FileSignature = Tuple[int, int, int]
+
+def file_signature(stat_result: os.stat_result) -> FileSignature:
+    return (stat_result.st_size, stat_result.st_mtime_ns, stat_result.st_ino)
+
+# Format rekordu cache: 1 = pickle całego dokumentu (niewspierany), 2 = skompresowana treść + kolumny
+RECORD_FORMAT_VERSION = 2
+CODEC_RAW, CODEC_ZLIB, CODEC_ZSTD, CODEC_LZ4 = b'r', b'z', b's', b'l'
+DOCUMENT_FIELDS = ('title', 'content', 'category', 'keywords', 'source_file', 'file_path')
+
+# Obiekty zstd nie są bezpieczne przy współbieżnym użyciu - osobne na wątek
+_codec_local = threading.local()
+
+def encode_content(text: str) -> bytes:
+    """Treść UTF-8 skompresowana, z 1-bajtowym znacznikiem kodeka"""
+    data = text.encode('utf-8')
+    if LZ4_AVAILABLE:
+        return CODEC_LZ4 + lz4.block.compress(data, store_size=True)
+    if ZSTD_AVAILABLE:
+        if not hasattr(_codec_local, 'zstd_compressor'):
+            _codec_local.zstd_compressor = zstandard.ZstdCompressor(level=3)
+        return CODEC_ZSTD + _codec_local.zstd_compressor.compress(data)
+    return CODEC_ZLIB + zlib.compress(data, 6)
+
+def decode_content(blob: bytes) -> str:
+    codec, payload = blob[:1], memoryview(blob)[1:]
+    if codec == CODEC_LZ4 and LZ4_AVAILABLE:
+        return lz4.block.decompress(payload).decode('utf-8')
+    if codec == CODEC_ZSTD and ZSTD_AVAILABLE:
+        if not hasattr(_codec_local, 'zstd_decompressor'):
+            _codec_local.zstd_decompressor = zstandard.ZstdDecompressor()
+        return _codec_local.zstd_decompressor.decompress(payload).decode('utf-8')
+    if codec == CODEC_ZLIB:
+        return zlib.decompress(payload).decode('utf-8')
+    if codec == CODEC_RAW:
+        return bytes(payload).decode('utf-8')
+    raise ValueError(f"Nieobsługiwany kodek rekordu cache: {codec!r}")
+
 class DocumentCache:
     """Zarządzanie cache'em dokumentów w SQLite"""
     
+    HASH_ALGORITHM = "xxh64" if XXHASH_AVAILABLE else "blake2b"
+    
     def __init__(self, cache_path: str = "document_cache.db"):
         self.cache_path = cache_path
         self.conn = None
+        # Manifest (ścieżka -> sygnatura, hash) ładowany jednym zapytaniem
+        self._manifest: Optional[Dict[str, Tuple[FileSignature, str]]] = None
+        # Kodowania wykryte przy poprzednim przetworzeniu pliku - bez ponownego zgadywania
+        self._encodings: Dict[str, str] = {}
+        # Hashe policzone przy sprawdzaniu - ponownie używane przy zapisie
+        self._computed_hashes: Dict[str, Tuple[FileSignature, str]] = {}
+        # Write-behind: wiersze z wątków roboczych zapisywane jedną transakcją w flush()
+        self._pending_rows: List[tuple] = []
+        self._lock = threading.RLock()
         self._init_cache()
     
     def _init_cache(self):
         """Inicjalizuje bazę cache'u"""
         self.conn = sqlite3.connect(self.cache_path, check_same_thread=False)
+        # WAL + synchronous=NORMAL - fsync przy checkpoincie, nie przy każdym commicie
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
         self.conn.execute("""
             CREATE TABLE IF NOT EXISTS document_cache (
                 file_path TEXT PRIMARY KEY,
@@ -88,6 +179,13 @@ class DocumentCache:
             )
         """)
         
+        # Migracja starszych baz - kolumny sygnatury pliku
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(document_cache)")}
+        for column, column_type in (('mtime_ns', 'INTEGER'), ('inode', 'INTEGER'),
+                                    ('record_format', 'INTEGER'), ('extra', 'TEXT')):
+            if column not in columns:
+                self.conn.execute(f"ALTER TABLE document_cache ADD COLUMN {column} {column_type}")
+        
         self.conn.execute("""
             CREATE INDEX IF NOT EXISTS idx_file_hash ON document_cache(file_hash);
         """)
@@ -99,65 +197,171 @@ class DocumentCache:
         self.conn.commit()
     
     def get_file_hash(self, file_path: Path) -> str:
-        """Generuje hash pliku dla weryfikacji zmian"""
-        hasher = hashlib.md5()
+        """Generuje hash pliku dla weryfikacji zmian (z prefiksem algorytmu)"""
+        hasher = xxhash.xxh64() if XXHASH_AVAILABLE else hashlib.blake2b(digest_size=16)
         try:
             with open(file_path, 'rb') as f:
                 # Czytaj w chunkach dla dużych plików
-                while chunk := f.read(8192):
+                while chunk := f.read(1 << 20):
                     hasher.update(chunk)
-            return hasher.hexdigest()
+            return f"{self.HASH_ALGORITHM}:{hasher.hexdigest()}"
         except Exception as e:
             logger.warning(f"Nie można wygenerować hash dla {file_path}: {e}")
             return str(file_path.stat().st_mtime)
     
-    def is_cached(self, file_path: Path) -> bool:
-        """Sprawdza czy plik jest w cache i czy jest aktualny"""
+    def load_manifest(self) -> Dict[str, Tuple[FileSignature, str]]:
+        """Ładuje sygnatury wszystkich plików w cache jednym zapytaniem (rekordy starszych formatów pomijane)"""
+        cursor = self.conn.execute(
+            "SELECT file_path, file_size, mtime_ns, inode, file_hash, json_extract(extra, '$.encoding') "
+            "FROM document_cache WHERE record_format = ?",
+            (RECORD_FORMAT_VERSION,)
+        )
+        self._manifest = {}
+        self._encodings = {}
+        for path, size, mtime_ns, inode, file_hash, encoding in cursor:
+            self._manifest[path] = ((size, mtime_ns, inode), file_hash)
+            if encoding:
+                self._encodings[path] = encoding
+        return self._manifest
+    
+    def get_encoding(self, file_path: Path) -> Optional[str]:
+        """Kodowanie zapisane z dokumentem (z manifestu) - podpowiedź przy ponownym parsowaniu"""
+        return self._encodings.get(str(file_path))
+    
+    def is_cached(self, file_path: Path, stat_result: Optional[os.stat_result] = None) -> bool:
+        """Sprawdza czy plik jest w cache i czy jest aktualny
+        
+        Niezmieniona sygnatura (rozmiar, mtime_ns, inode) wystarcza - plik nie jest czytany.
+        Hash liczony jest tylko gdy sygnatura się zmieniła, a rozmiar nie (np. touch, kopia).
+        """
         try:
-            file_hash = self.get_file_hash(file_path)
-            file_mtime = file_path.stat().st_mtime
+            if self._manifest is None:
+                self.load_manifest()
             
-            cursor = self.conn.execute(
-                "SELECT file_hash, last_modified FROM document_cache WHERE file_path = ?",
-                (str(file_path),)
-            )
-            result = cursor.fetchone()
+            entry = self._manifest.get(str(file_path))
+            if entry is None:
+                return False
             
-            if result:
-                cached_hash, cached_mtime = result
-                return cached_hash == file_hash and cached_mtime == file_mtime
+            cached_signature, cached_hash = entry
+            signature = file_signature(stat_result or os.stat(file_path))
+            if signature == cached_signature:
+                return True
+            if signature[0] != cached_signature[0]:
+                return False
             
-            return False
+            file_hash = self.get_file_hash(file_path)
+            self._computed_hashes[str(file_path)] = (signature, file_hash)
+            if file_hash != cached_hash:
+                return False
+            
+            # Ta sama zawartość - odśwież sygnaturę, następny start nie będzie już hashował
+            with self._lock:
+                self.conn.execute(
+                    "UPDATE document_cache SET mtime_ns = ?, inode = ?, last_modified = ? WHERE file_path = ?",
+                    (signature[1], signature[2], signature[1] / 1e9, str(file_path))
+                )
+                self.conn.commit()
+            self._manifest[str(file_path)] = (signature, file_hash)
+            return True
         except Exception as e:
             logger.warning(f"Błąd sprawdzania cache dla {file_path}: {e}")
             return False
     
     def get_cached_document(self, file_path: Path) -> Optional[Dict[str, Any]]:
-        """Pobiera dokument z cache'u"""
+        """Pobiera dokument z cache'u - wyszukiwanie po kluczu głównym"""
+        try:
+            with self._lock:
+                row = self.conn.execute(
+                    """SELECT file_path, title, category, keywords, content_data, extra
+                       FROM document_cache WHERE file_path = ? AND record_format = ?""",
+                    (str(file_path), RECORD_FORMAT_VERSION)
+                ).fetchone()
+            return self._row_to_document(row, True) if row else None
+        except Exception as e:
+            logger.warning(f"Błąd pobierania z cache: {e}")
+            return None
+    
+    def get_cached_documents(self, file_paths: List[Path], include_content: bool = True) -> List[Dict[str, Any]]:
+        """Pobiera dokumenty z cache'u jednym zapytaniem
+        
+        Filtr ścieżek w SQL (json_each) - czytane są tylko żądane wiersze.
+        Bez include_content blob z treścią nie jest ani czytany, ani dekompresowany.
+        """
+        content_column = "content_data" if include_content else "NULL"
         try:
+            with self._lock:
+                rows = self.conn.execute(
+                    f"""SELECT file_path, title, category, keywords, {content_column}, extra
+                        FROM document_cache
+                        WHERE record_format = ? AND file_path IN (SELECT value FROM json_each(?))""",
+                    (RECORD_FORMAT_VERSION, json.dumps([str(file_path) for file_path in file_paths]))
+                ).fetchall()
+            
+            documents = (self._row_to_document(row, include_content) for row in rows)
+            return [document for document in documents if document is not None]
+        except Exception as e:
+            logger.warning(f"Błąd pobierania z cache: {e}")
+            return []
+    
+    def iter_cached_documents(self, file_paths: List[Path], batch_size: int = 50) -> Iterator[List[Dict[str, Any]]]:
+        """Strumień dokumentów z cache'u w batchach - jedno zapytanie, kursor czytany porcjami"""
+        with self._lock:
             cursor = self.conn.execute(
-                "SELECT content_data FROM document_cache WHERE file_path = ?",
-                (str(file_path),)
+                """SELECT file_path, title, category, keywords, content_data, extra
+                   FROM document_cache
+                   WHERE record_format = ? AND file_path IN (SELECT value FROM json_each(?))""",
+                (RECORD_FORMAT_VERSION, json.dumps([str(file_path) for file_path in file_paths]))
             )
-            result = cursor.fetchone()
-            
-            if result:
-                content_blob = result[0]
-                return pickle.loads(content_blob)
-            
-            return None
+        try:
+            while True:
+                with self._lock:
+                    rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                documents = (self._row_to_document(row, True) for row in rows)
+                yield [document for document in documents if document is not None]
+        finally:
+            cursor.close()
+    
+    def _row_to_document(self, row: tuple, include_content: bool) -> Optional[Dict[str, Any]]:
+        """Wiersz document_cache -> słownik dokumentu (None dla uszkodzonego rekordu)"""
+        file_path, title, category, keywords, content_blob, extra = row
+        try:
+            document = {
+                'title': title,
+                'content': decode_content(content_blob) if include_content else None,
+                'category': category,
+                'keywords': json.loads(keywords),
+                'source_file': os.path.basename(file_path),
+                'file_path': file_path
+            }
+            if extra:
+                document.update(json.loads(extra))
+            return document
         except Exception as e:
-            logger.warning(f"Błąd pobierania z cache {file_path}: {e}")
+            logger.warning(f"Uszkodzony rekord cache {file_path}: {e}")
             return None
     
     def cache_document(self, file_path: Path, document: Dict[str, Any]):
-        """Zapisuje dokument do cache'u"""
+        """Zapisuje dokument do cache'u (natychmiast)"""
+        if self.queue_document(file_path, document):
+            self.flush()
+    
+    def queue_document(self, file_path: Path, document: Dict[str, Any]) -> bool:
+        """Przygotowuje wiersz cache'u i odkłada do zapisu w flush() - bezpieczne z wątków roboczych"""
         try:
+            stat_result = os.stat(file_path)
+            signature = file_signature(stat_result)
+            
+            # Hash policzony już w is_cached jest ważny tylko dla tej samej sygnatury
+            computed = self._computed_hashes.pop(str(file_path), None)
+            file_hash = computed[1] if computed and computed[0] == signature else self.get_file_hash(file_path)
+            
             metadata = DocumentMetadata(
                 file_path=str(file_path),
-                file_hash=self.get_file_hash(file_path),
-                last_modified=file_path.stat().st_mtime,
-                file_size=file_path.stat().st_size,
+                file_hash=file_hash,
+                last_modified=stat_result.st_mtime,
+                file_size=stat_result.st_size,
                 category=document.get('category', 'unknown'),
                 title=document.get('title', ''),
                 keywords=document.get('keywords', []),
@@ -165,24 +369,49 @@ class DocumentCache:
                 content_length=len(document.get('content', ''))
             )
             
-            content_blob = pickle.dumps(document)
+            content_blob = encode_content(document.get('content', ''))
+            extra = {key: value for key, value in document.items() if key not in DOCUMENT_FIELDS}
             
-            self.conn.execute(
-                """INSERT OR REPLACE INTO document_cache 
-                   (file_path, file_hash, last_modified, file_size, category, 
-                    title, keywords, processed_at, content_length, content_data)
-                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                (
-                    metadata.file_path, metadata.file_hash, metadata.last_modified,
-                    metadata.file_size, metadata.category, metadata.title,
-                    json.dumps(metadata.keywords), metadata.processed_at,
-                    metadata.content_length, content_blob
-                )
+            row = (
+                metadata.file_path, metadata.file_hash, metadata.last_modified,
+                metadata.file_size, metadata.category, metadata.title,
+                json.dumps(metadata.keywords), metadata.processed_at,
+                metadata.content_length, content_blob,
+                signature[1], signature[2],
+                RECORD_FORMAT_VERSION, json.dumps(extra, ensure_ascii=False) if extra else None
             )
-            self.conn.commit()
+            with self._lock:
+                self._pending_rows.append(row)
+            return True
             
         except Exception as e:
             logger.error(f"Błąd zapisywania do cache {file_path}: {e}")
+            return False
+    
+    def flush(self) -> int:
+        """Zapisuje odłożone wiersze jedną transakcją (executemany) - zwraca liczbę wierszy"""
+        with self._lock:
+            rows, self._pending_rows = self._pending_rows, []
+            if not rows:
+                return 0
+            try:
+                with self.conn:
+                    self.conn.executemany(
+                        """INSERT OR REPLACE INTO document_cache 
+                           (file_path, file_hash, last_modified, file_size, category, 
+                            title, keywords, processed_at, content_length, content_data,
+                            mtime_ns, inode, record_format, extra)
+                           VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                        rows
+                    )
+            except Exception as e:
+                logger.error(f"Błąd zapisu batcha cache ({len(rows)} dokumentów): {e}")
+                return 0
+            
+            if self._manifest is not None:
+                for row in rows:
+                    self._manifest[row[0]] = ((row[3], row[10], row[11]), row[1])
+            return len(rows)
     
     def get_cache_stats(self) -> Dict[str, Any]:
         """Zwraca statystyki cache'u"""
@@ -226,12 +455,13 @@ class DocumentCache:
         """Czyści stare wpisy z cache'u"""
         cutoff_time = datetime.now().timestamp() - (max_age_days * 24 * 3600)
         try:
-            cursor = self.conn.execute(
-                "DELETE FROM document_cache WHERE processed_at < ?",
-                (cutoff_time,)
-            )
-            deleted_count = cursor.rowcount
-            self.conn.commit()
+            with self._lock:
+                cursor = self.conn.execute(
+                    "DELETE FROM document_cache WHERE processed_at < ?",
+                    (cutoff_time,)
+                )
+                deleted_count = cursor.rowcount
+                self.conn.commit()
             logger.info(f"Usunięto {deleted_count} starych wpisów z cache")
             return deleted_count
         except Exception as e:
@@ -241,13 +471,177 @@ class DocumentCache:
     def close(self):
         """Zamyka połączenie z cache'em"""
         if self.conn:
+            self.flush()
             self.conn.close()
 
+# Dokument przesyłany z procesu roboczego jako zwarta krotka zamiast słownika
+DocumentRecord = Tuple[str, str, str, str, Tuple[str, ...], str, Optional[str]]
+
+def document_to_record(document: Dict[str, Any]) -> DocumentRecord:
+    return (document['file_path'], document['title'], document['content'], document['category'],
+            tuple(document['keywords']), document['source_file'], document.get('encoding'))
+
+def record_to_document(record: DocumentRecord) -> Dict[str, Any]:
+    file_path, title, content, category, keywords, source_file, encoding = record
+    document = {
+        'title': title,
+        'content': content,
+        'category': category,
+        'keywords': list(keywords),
+        'source_file': source_file,
+        'file_path': file_path
+    }
+    if encoding:
+        document['encoding'] = encoding
+    return document
+
+# ============================================================================
+# KEYWORD / CATEGORY ENGINE
+# ============================================================================
+
+# Słowa kluczowe to całe tokeny \w+ - zamiast kilkunastu findall po treści: jeden podział na tokeny,
+# a unikalne tokeny klasyfikowane jednym wzorcem (fullmatch) i zbiorem terminów
+_TOKEN_PATTERN = re.compile(r'\w+')
+_TITLE_WORD_PATTERN = re.compile(r'\b[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+\b')
+_KEYWORD_TOKEN_PATTERN = re.compile(r'''
+      (?P<api_function>XL[A-Za-z]+)
+    | (?P<table_name>[A-Z][a-zA-Z]*(?:Nag|Elem|Karty|Dane|Info|Log|Hist))
+    | (?P<ai_procedure>AI_[A-Za-z_]+)
+    | (?P<db_column>[A-Z]{2,4}_[A-Za-z]+)
+    | (?P<sql_type>INTEGER|VARCHAR|TEXT|DECIMAL|DATETIME|CSTRING|LONG)
+    | (?P<cs_identifier>[A-Z][a-zA-Z]*(?:Handler|Manager|Service|Helper|Util|Controller))
+    | (?P<cs_keyword>using|namespace|class|public|private|static|void|string|int|bool|DateTime)
+    | (?P<event_handler>\w*(?:Event|Handler|Callback|Action|Method))
+''', re.VERBOSE)
+
+# Terminy biznesowe i Hydry - dopasowanie całych słów bez względu na wielkość liter (zwracane małymi)
+_KEYWORD_TERMS = frozenset((
+    'dokument', 'pozycja', 'kontrahent', 'towar', 'cena', 'rabat', 'vat', 'waluta', 'ilosc',
+    'magazyn', 'zlecenie', 'produkcja', 'księgowanie',
+    'callback', 'debug', 'log', 'print', 'wydruk', 'odczyt', 'klawisz', 'ukrycie', 'kolumna',
+    'akcje', 'daty', 'keycodes', 'kolory', 'fonty', 'style'
+))
+
+def extract_keywords(title: str, content: str) -> List[str]:
+    """Słowa kluczowe dokumentu: wyrazy tytułu, identyfikatory API/SQL/C# i terminy dziedzinowe"""
+    keywords = set(_TITLE_WORD_PATTERN.findall(title))
+    tokens = set(_TOKEN_PATTERN.findall(content))
+    is_keyword = _KEYWORD_TOKEN_PATTERN.fullmatch
+    keywords.update(token for token in tokens if is_keyword(token))
+    keywords.update(_KEYWORD_TERMS.intersection(token.lower() for token in tokens))
+    return list(keywords)
+
+def _terms(*terms: str) -> 're.Pattern':
+    """Wystąpienie dowolnego z podciągów - jedno przeszukanie zamiast any(term in text ...)"""
+    return re.compile('|'.join(re.escape(term) for term in terms))
+
+# Reguły kategorii po tytule (małymi literami) - sprawdzane w podanej kolejności
+_HYDRA_CODE_RULES = (
+    (_terms('callback'), 'hydra_callback'),
+    (_terms('debug', 'log'), 'hydra_debug'),
+    (_terms('odczyt', 'klawisz', 'keycode'), 'hydra_input'),
+    (_terms('wydruk', 'print'), 'hydra_print'),
+    (_terms('kolumna', 'ukrycie'), 'hydra_ui'),
+)
+_HYDRA_CONFIG_TERMS = _terms('akcje', 'daty', 'keycodes', 'kolory')
+_TABLE_TITLE_TERMS = _terms('tabela', 'struktura', 'kolumna')
+_AI_TABLE_TERMS = _terms('ailimity', 'aiprognoza', 'aiwindykacja')
+_TABLE_RULES = (
+    (_terms('bst', 'budżet', 'bilans'), 'tabele_finansowe'),
+    (_terms('twr', 'towar', 'cen', 'mag'), 'tabele_magazynowe'),
+    (_terms('knt', 'kontrahent', 'adres'), 'tabele_kontrahentow'),
+    (_terms('tra', 'dokument', 'elem'), 'tabele_dokumentow'),
+)
+_INDEX_TERMS = _terms('spis', 'treści', 'index')
+_INTRO_TERMS = _terms('wprowadzenie', 'uwagi', 'ogólne')
+_AUTH_TERMS = _terms('login', 'logout', 'sprawdz')
+_API_RULES = (
+    (_terms('dokument', 'handlowe', 'magazynowe', 'sad'), 'dokumenty'),
+    (_terms('kontrahent', 'adres'), 'kontrahenci'),
+    (_terms('towar', 'cena', 'cennik'), 'towary'),
+    (_terms('dekret', 'księgowe'), 'księgowość'),
+    (_terms('produkcja', 'zlecenie'), 'produkcja'),
+    (_terms('parametry', 'obowiązkowe'), 'parametry'),
+    (_terms('prototyp', 'działanie'), 'funkcje'),
+)
+_API_FUNCTION_TERMS = _terms('xlnowy', 'xldodaj', 'xlmodyfikuj', 'xlusun')
+
+def _match_rules(rules, text: str) -> Optional[str]:
+    for pattern, category in rules:
+        if pattern.search(text):
+            return category
+    return None
+
+def determine_category(title: str, content: str, file_path: str = "") -> str:
+    """Kategoria dokumentu na podstawie ścieżki, tytułu i (tylko gdy potrzeba) treści"""
+    title_lower = title.lower()
+    file_path_lower = file_path.lower()
+    
+    # Kategorie dla systemu Hydra
+    if 'xl003-hydra' in file_path_lower or 'hydra' in title_lower:
+        if file_path_lower.endswith('.pdf'):
+            return 'hydra_dokumentacja'
+        elif file_path_lower.endswith('.cs'):
+            # Typ kodu C# na podstawie nazwy pliku
+            return _match_rules(_HYDRA_CODE_RULES, title_lower) or 'hydra_code_cs'
+        elif _HYDRA_CONFIG_TERMS.search(title_lower):
+            return 'hydra_config'
+        return 'hydra_inne'
+    
+    # Kategorie dla struktur bazy danych
+    if 'tabele_2025' in file_path_lower or _TABLE_TITLE_TERMS.search(title_lower):
+        # Procedury AI ChatERP - sprawdź zawartość
+        content_lower = content.lower()
+        if 'ai_chaterp' in content_lower or 'ai_pp_' in content_lower or 'ai_' in content_lower and 'create procedure' in content_lower:
+            return 'ai_procedury_sql'
+        elif title_lower.startswith('ai') or _AI_TABLE_TERMS.search(title_lower):
+            return 'ai_tabele'
+        return _match_rules(_TABLE_RULES, title_lower) or 'tabele_inne'
+    
+    # Kategorie dla API
+    if _INDEX_TERMS.search(title_lower):
+        return 'index'
+    elif _INTRO_TERMS.search(title_lower):
+        return 'wprowadzenie'
+    elif 'xl' in title_lower and _AUTH_TERMS.search(title_lower):
+        return 'autoryzacja'
+    category = _match_rules(_API_RULES, title_lower)
+    if category:
+        return category
+    # Treść przeszukiwana dopiero gdy tytuł nic nie rozstrzygnął
+    if _API_FUNCTION_TERMS.search(content.lower()):
+        return 'api_funkcje'
+    return 'inne'
+
+
+# Parser procesu roboczego - tworzony raz na proces (bez cache'u i puli wątków)
+_worker_loader = None
+
+def _init_parse_worker():
+    global _worker_loader
+    _worker_loader = OptimizedComarchDocumentLoader(docs_path=".", cache_enabled=False, max_workers=1)
+
+def _parse_files_chunk(file_paths: List[str]) -> Tuple[List[Tuple[str, Optional[DocumentRecord]]], Dict[str, List[float]]]:
+    """Parsuje fragment listy plików w procesie roboczym - zwraca wyniki i czasy parserów"""
+    if _worker_loader is None:
+        _init_parse_worker()
+    _worker_loader.parse_stats.clear()
+    results = []
+    for file_path in file_paths:
+        doc = _worker_loader._process_single_file(Path(file_path))
+        results.append((file_path, document_to_record(doc) if doc else None))
+    return results, dict(_worker_loader.parse_stats)
+
 class OptimizedComarchDocumentLoader:
     """Zoptymalizowana klasa do ładowania dokumentacji Comarch API"""
     
+    EXECUTOR_MODES = ("thread", "process")
+    
     def __init__(self, docs_path: str = None, cache_enabled: bool = True, 
-                 max_workers: int = 4, batch_size: int = 50):
+                 max_workers: Optional[int] = None, batch_size: int = 50,
+                 executor_mode: str = "thread", process_chunk_size: int = 8,
+                 fast_parsers: bool = True, use_chm_index: bool = True,
+                 watch_directories: bool = False):
         if docs_path is None:
             backend_dir = Path(__file__).parent
             self.docs_paths = [
@@ -258,62 +652,72 @@ class OptimizedComarchDocumentLoader:
         else:
             self.docs_paths = [Path(docs_path)]
         
+        if executor_mode not in self.EXECUTOR_MODES:
+            raise ValueError(f"Nieobsługiwany tryb wykonawcy: {executor_mode}")
+        
+        # Parsowanie HTML/XML jest CPU-bound (GIL) - w trybie "process" domyślnie tyle procesów co rdzeni
+        if max_workers is None:
+            max_workers = (os.cpu_count() or 1) if executor_mode == "process" else 4
+        
         self.cache_enabled = cache_enabled
         self.max_workers = max_workers
         self.batch_size = batch_size
+        self.executor_mode = executor_mode
+        self.process_chunk_size = process_chunk_size
+        self.process_executor: Optional[ProcessPoolExecutor] = None
+        
+        # lxml dla stron pomocy i XML tabel; parse_stats: parser -> [liczba plików, łączny czas s]
+        self.fast_parsers = fast_parsers and LXML_AVAILABLE
+        self.parse_stats: Dict[str, List[float]] = {}
+        self._stats_lock = threading.Lock()
         self.cache = DocumentCache() if cache_enabled else None
         self.progress = ProcessingProgress()
         
-        # Encoding cache dla optymalizacji
-        self._encoding_cache = {}
+        # Indeksy pomocy CHM (.hhk słowa kluczowe, .hhc spis treści) - wczytywane przy pierwszym użyciu
+        self.use_chm_index = use_chm_index
+        self._chm_indexes: Optional[Dict[Path, ChmIndex]] = None
+        
+        # Jedno przejście scandir na katalog; stat z DirEntry trafia do sprawdzenia cache'u
+        self.discovery = FileDiscovery(
+            self.docs_paths,
+            extensions=('.htm', '.html', '.xml', '.pdf'),
+            recursive_extensions=('.txt', '.cs'),
+            watch=watch_directories
+        )
+        self._discovered_stats: Dict[str, os.stat_result] = {}
+        
+        # BOM / deklaracja / kodowanie wyuczone dla katalogu zamiast chardet dla każdego pliku
+        self.encoding_detector = EncodingDetector()
         
         # Thread pool dla I/O operations
         self.executor = ThreadPoolExecutor(max_workers=max_workers)
+    
+    def _get_process_executor(self) -> ProcessPoolExecutor:
+        """Pula procesów tworzona przy pierwszym użyciu"""
+        if self.process_executor is None:
+            self.process_executor = ProcessPoolExecutor(max_workers=self.max_workers,
+                                                        initializer=_init_parse_worker)
+        return self.process_executor
         
     def get_file_encoding(self, file_path: Path) -> str:
-        """Optymalizowane wykrywanie kodowania z cache'em"""
-        file_key = str(file_path)
-        if file_key in self._encoding_cache:
-            return self._encoding_cache[file_key]
-        
+        """Kodowanie pliku (BOM, deklaracja, kodowanie z cache'u lub wyuczone dla katalogu)"""
         try:
-            with open(file_path, 'rb') as f:
-                # Czytaj tylko pierwsze 8KB dla wydajności
-                sample = f.read(8192)
-                
-            detected = chardet.detect(sample)
-            encoding = detected.get('encoding', 'windows-1250')
-            
-            # Cache encoding
-            self._encoding_cache[file_key] = encoding
-            return encoding
-            
+            return self._read_text(file_path)[1]
         except Exception as e:
             logger.warning(f"Błąd wykrywania kodowania {file_path}: {e}")
             return 'windows-1250'
     
+    def _read_text(self, file_path: Path) -> Tuple[str, str]:
+        """Jeden odczyt pliku: (tekst, kodowanie)"""
+        raw = file_path.read_bytes()
+        hint = self.cache.get_encoding(file_path) if self.cache_enabled else None
+        return self.encoding_detector.decode(raw, str(file_path.parent), hint)
+    
     def discover_files(self) -> List[Path]:
         """Odkrywa wszystkie pliki do przetworzenia"""
-        all_files = []
-        
-        for docs_path in self.docs_paths:
-            if not docs_path.exists():
-                logger.warning(f"Folder dokumentacji nie istnieje: {docs_path}")
-                continue
-            
-            # Znajdź wszystkie pliki różnych typów
-            patterns = ["*.htm", "*.html", "*.xml", "*.pdf", "**/*.txt", "**/*.cs"]
-            
-            for pattern in patterns:
-                if pattern.startswith("**"):
-                    files = list(docs_path.rglob(pattern[3:]))  # Usuń ** prefix
-                else:
-                    files = list(docs_path.glob(pattern))
-                all_files.extend(files)
-        
-        # Usuń duplikaty i sortuj
-        all_files = list(set(all_files))
-        all_files.sort()
+        discovered = self.discovery.scan()
+        self._discovered_stats = {item.path: item.stat for item in discovered}
+        all_files = [Path(item.path) for item in discovered]
         
         logger.info(f"Znaleziono {len(all_files)} plików do przetworzenia")
         return all_files
@@ -326,8 +730,11 @@ class OptimizedComarchDocumentLoader:
         files_to_process = []
         cached_files = []
         
+        # Jedno zapytanie zamiast SELECT na plik
+        self.cache.load_manifest()
+        
         for file_path in all_files:
-            if self.cache.is_cached(file_path):
+            if self.cache.is_cached(file_path, self._discovered_stats.get(str(file_path))):
                 cached_files.append(file_path)
             else:
                 files_to_process.append(file_path)
@@ -352,14 +759,11 @@ class OptimizedComarchDocumentLoader:
         # Załaduj dokumenty z cache'u
         if cached_files:
             logger.info(f"Ładowanie {len(cached_files)} dokumentów z cache...")
-            for cached_file in cached_files:
-                if self.cache_enabled:
-                    doc = self.cache.get_cached_document(cached_file)
-                    if doc:
-                        documents.append(doc)
-                
-                if progress_callback:
-                    progress_callback(self.progress)
+            if self.cache_enabled:
+                documents.extend(map(self._apply_chm_index, self.cache.get_cached_documents(cached_files)))
+            
+            if progress_callback:
+                progress_callback(self.progress)
         
         # Przetwórz nowe pliki w batch'ach
         if files_to_process:
@@ -374,37 +778,35 @@ class OptimizedComarchDocumentLoader:
                 
                 # Przetwórz batch równolegle
                 batch_documents = await self._process_batch_async(batch, progress_callback)
-                documents.extend(batch_documents)
+                documents.extend(map(self._apply_chm_index, batch_documents))
         
         logger.info(f"Załadowano łącznie {len(documents)} dokumentów")
         return documents
     
     async def _process_batch_async(self, batch: List[Path], progress_callback=None) -> List[Dict[str, Any]]:
         """Przetwarza batch plików asynchronicznie"""
+        if self.executor_mode == "process":
+            return await self._process_batch_in_processes(batch, progress_callback)
+        
         loop = asyncio.get_event_loop()
         
+        async def process(file_path: Path):
+            return file_path, await loop.run_in_executor(self.executor, self._process_and_queue, file_path)
+        
         # Użyj ThreadPoolExecutor dla CPU-intensive operations
-        futures = []
-        for file_path in batch:
-            future = loop.run_in_executor(self.executor, self._process_single_file, file_path)
-            futures.append(future)
+        futures = [process(file_path) for file_path in batch]
         
         batch_documents = []
         
         # Poczekaj na zakończenie wszystkich zadań w batch'u
-        for idx, future in enumerate(asyncio.as_completed(futures)):
+        for future in asyncio.as_completed(futures):
             try:
-                doc = await future
+                file_path, doc = await future
                 if doc:
                     batch_documents.append(doc)
-                    
-                    # Cache document if enabled
-                    if self.cache_enabled:
-                        file_path = batch[futures.index(future)]
-                        self.cache.cache_document(file_path, doc)
                 
                 self.progress.processed_files += 1
-                self.progress.current_file = batch[idx].name if idx < len(batch) else ""
+                self.progress.current_file = file_path.name
                 
                 if progress_callback:
                     progress_callback(self.progress)
@@ -413,8 +815,126 @@ class OptimizedComarchDocumentLoader:
                 self.progress.failed_files += 1
                 logger.error(f"Błąd przetwarzania pliku: {e}")
         
+        # Jedna transakcja cache'u na batch, poza wątkiem pętli zdarzeń
+        if self.cache_enabled:
+            await loop.run_in_executor(self.executor, self.cache.flush)
+        
         return batch_documents
     
+    async def _process_batch_in_processes(self, batch: List[Path], progress_callback=None) -> List[Dict[str, Any]]:
+        """Przetwarza batch w puli procesów - pliki wysyłane fragmentami, wyniki jako krotki"""
+        loop = asyncio.get_event_loop()
+        executor = self._get_process_executor()
+        
+        # Równy podział batcha między procesy, najwyżej process_chunk_size plików na zadanie
+        chunk_size = max(1, min(self.process_chunk_size, math.ceil(len(batch) / self.max_workers)))
+        chunks = [[str(file_path) for file_path in batch[i:i + chunk_size]]
+                  for i in range(0, len(batch), chunk_size)]
+        futures = [loop.run_in_executor(executor, _parse_files_chunk, chunk) for chunk in chunks]
+        
+        batch_documents = []
+        for future in asyncio.as_completed(futures):
+            try:
+                results, parse_stats = await future
+                self._merge_parse_stats(parse_stats)
+            except Exception as e:
+                self.progress.failed_files += chunk_size
+                logger.error(f"Błąd przetwarzania fragmentu plików: {e}")
+                continue
+            
+            parsed = [(Path(file_path), record_to_document(record)) for file_path, record in results if record]
+            batch_documents.extend(doc for _, doc in parsed)
+            
+            # Stat + hash do cache'u w wątku - pętla zdarzeń odbiera kolejne wyniki
+            if self.cache_enabled and parsed:
+                await loop.run_in_executor(self.executor, self._queue_documents, parsed)
+            
+            self.progress.processed_files += len(results)
+            self.progress.current_file = Path(results[-1][0]).name if results else ""
+            if progress_callback:
+                progress_callback(self.progress)
+        
+        if self.cache_enabled:
+            await loop.run_in_executor(self.executor, self.cache.flush)
+        
+        return batch_documents
+    
+    def get_chm_indexes(self) -> Dict[Path, ChmIndex]:
+        """Indeksy CHM katalogów dokumentacji (tylko katalogi z plikami .hhk/.hhc)"""
+        if self._chm_indexes is None:
+            indexes = {}
+            if self.use_chm_index:
+                for docs_path in self.docs_paths:
+                    index = ChmIndex.from_directory(docs_path)
+                    if index:
+                        indexes[docs_path] = index
+            self._chm_indexes = indexes
+        return self._chm_indexes
+    
+    def lookup_keyword(self, keyword: str) -> List[Dict[str, Any]]:
+        """Strony pomocy dla słowa kluczowego z indeksu .hhk - trafienie w słowniku, bez przeszukiwania treści"""
+        results = []
+        for index in self.get_chm_indexes().values():
+            for file_path in index.lookup(keyword):
+                topic = index.topic_for(file_path)
+                results.append({
+                    'file_path': str(file_path),
+                    'source_file': file_path.name,
+                    'title': topic.name if topic else keyword,
+                    'toc_path': topic.toc_path if topic else ''
+                })
+        return results
+    
+    def _apply_chm_index(self, doc: Dict[str, Any]) -> Dict[str, Any]:
+        """Uzupełnia dokument o słowa kluczowe z .hhk i ścieżkę w spisie treści .hhc"""
+        indexes = self.get_chm_indexes()
+        if not indexes:
+            return doc
+        file_path = Path(doc['file_path'])
+        index = indexes.get(file_path.parent)
+        if index is None:
+            return doc
+        
+        chm_keywords = index.keywords_for(file_path)
+        if chm_keywords:
+            doc['keywords'] = list(set(doc['keywords']).union(chm_keywords))
+        topic = index.topic_for(file_path)
+        if topic:
+            doc['toc_path'] = topic.toc_path
+        return doc
+    
+    def _record_parse(self, parser: str, seconds: float):
+        with self._stats_lock:
+            stats = self.parse_stats.setdefault(parser, [0, 0.0])
+            stats[0] += 1
+            stats[1] += seconds
+    
+    def _merge_parse_stats(self, parse_stats: Dict[str, List[float]]):
+        with self._stats_lock:
+            for parser, (count, seconds) in parse_stats.items():
+                stats = self.parse_stats.setdefault(parser, [0, 0.0])
+                stats[0] += count
+                stats[1] += seconds
+    
+    def get_parse_stats(self) -> Dict[str, Dict[str, float]]:
+        """Liczba plików i średni czas parsowania (ms/plik) dla każdego parsera"""
+        with self._stats_lock:
+            return {
+                parser: {'files': int(count), 'avg_ms': round(seconds * 1000 / count, 3) if count else 0.0}
+                for parser, (count, seconds) in self.parse_stats.items()
+            }
+    
+    def _queue_documents(self, documents: List[Tuple[Path, Dict[str, Any]]]):
+        for file_path, doc in documents:
+            self.cache.queue_document(file_path, doc)
+    
+    def _process_and_queue(self, file_path: Path) -> Optional[Dict[str, Any]]:
+        """Przetwarza plik i odkłada wynik do zapisu w cache (wątek roboczy)"""
+        doc = self._process_single_file(file_path)
+        if doc and self.cache_enabled:
+            self.cache.queue_document(file_path, doc)
+        return doc
+    
     def _process_single_file(self, file_path: Path) -> Optional[Dict[str, Any]]:
         """Przetwarza pojedynczy plik (thread-safe)"""
         try:
@@ -436,6 +956,31 @@ class OptimizedComarchDocumentLoader:
             logger.error(f"Błąd przetwarzania {file_path}: {e}")
             return None
     
+    def iter_documents(self, progress_callback=None) -> Iterator[Dict[str, Any]]:
+        """Generator dokumentów batch po batchu - w pamięci najwyżej jeden batch naraz"""
+        all_files = self.discover_files()
+        files_to_process, cached_files = self.filter_files_for_processing(all_files)
+        
+        self.progress.total_files = len(all_files)
+        self.progress.cached_files = len(cached_files)
+        self.progress.processed_files = len(cached_files)
+        
+        if cached_files:
+            for batch in self.cache.iter_cached_documents(cached_files, self.batch_size):
+                yield from map(self._apply_chm_index, batch)
+            if progress_callback:
+                progress_callback(self.progress)
+        
+        # Własna pętla zdarzeń - generator może działać w dowolnym wątku
+        loop = asyncio.new_event_loop()
+        try:
+            for i in range(0, len(files_to_process), self.batch_size):
+                batch = files_to_process[i:i + self.batch_size]
+                yield from map(self._apply_chm_index,
+                               loop.run_until_complete(self._process_batch_async(batch, progress_callback)))
+        finally:
+            loop.close()
+    
     def load_all_documents(self, progress_callback=None) -> List[Dict[str, Any]]:
         """Synchroniczna wersja - wrapper dla async version"""
         try:
@@ -456,19 +1001,24 @@ class OptimizedComarchDocumentLoader:
     
     def _parse_html_file(self, file_path: Path) -> Dict[str, Any]:
         """Parsuje pojedynczy plik HTML - zoptymalizowana wersja"""
-        encoding = self.get_file_encoding(file_path)
-        
-        with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
-            content = f.read()
-        
-        soup = BeautifulSoup(content, 'html.parser')
-        
-        # Wyciągnij tytuł
-        title = soup.find('title')
-        title_text = title.get_text().strip() if title else file_path.stem
-        
-        # Wyciągnij główną zawartość
-        main_content = self._extract_main_content(soup)
+        content, encoding = self._read_text(file_path)
+        
+        start = time.perf_counter()
+        parsed = self._parse_html_lxml(content) if self.fast_parsers else None
+        if parsed is not None:
+            title_text, main_content = parsed
+            title_text = title_text if title_text is not None else file_path.stem
+            self._record_parse('lxml_html', time.perf_counter() - start)
+        else:
+            soup = BeautifulSoup(content, 'html.parser')
+            
+            # Wyciągnij tytuł
+            title = soup.find('title')
+            title_text = title.get_text().strip() if title else file_path.stem
+            
+            # Wyciągnij główną zawartość
+            main_content = self._extract_main_content(soup)
+            self._record_parse('bs4_html', time.perf_counter() - start)
         
         # Określ kategorię na podstawie tytułu i zawartości
         category = self._determine_category(title_text, main_content, str(file_path))
@@ -482,28 +1032,34 @@ class OptimizedComarchDocumentLoader:
             'category': category,
             'keywords': keywords,
             'source_file': str(file_path.name),
-            'file_path': str(file_path)
+            'file_path': str(file_path),
+            'encoding': encoding
         }
     
     def _parse_xml_file(self, file_path: Path) -> Dict[str, Any]:
         """Parsuje pojedynczy plik XML - zoptymalizowana wersja"""
-        encoding = self.get_file_encoding(file_path)
+        content, encoding = self._read_text(file_path)
         
-        with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
-            content = f.read()
-        
-        soup = BeautifulSoup(content, 'xml')
+        start = time.perf_counter()
+        parsed = self._scan_table_xml_lxml(content) if self.fast_parsers else None
+        if parsed is not None:
+            table_attrs, columns = parsed
+            self._record_parse('lxml_xml', time.perf_counter() - start)
+        else:
+            soup = BeautifulSoup(content, 'xml')
+            table_elem = soup.find('table')
+            table_attrs = dict(table_elem.attrs) if table_elem else None
+            columns = [dict(col.attrs) for col in soup.find_all('column')]
+            self._record_parse('bs4_xml', time.perf_counter() - start)
         
         # Wyciągnij nazwę tabeli
-        table_elem = soup.find('table')
-        table_name = table_elem.get('name') if table_elem else file_path.stem
+        table_name = table_attrs.get('name') if table_attrs is not None else file_path.stem
         
         # Wyciągnij opis tabeli
-        description = table_elem.get('description', '') if table_elem else ''
+        description = table_attrs.get('description', '') if table_attrs is not None else ''
         
         # Parsuj kolumny
         columns_info = []
-        columns = soup.find_all('column')
         for col in columns:
             col_info = {
                 'name': col.get('sqlname', ''),
@@ -543,7 +1099,8 @@ class OptimizedComarchDocumentLoader:
             'category': category,
             'keywords': keywords,
             'source_file': str(file_path.name),
-            'file_path': str(file_path)
+            'file_path': str(file_path),
+            'encoding': encoding
         }
     
     def _parse_pdf_file(self, file_path: Path) -> Dict[str, Any]:
@@ -599,10 +1156,7 @@ class OptimizedComarchDocumentLoader:
     
     def _parse_text_file(self, file_path: Path) -> Dict[str, Any]:
         """Parsuje pojedynczy plik TXT lub CS"""
-        encoding = self.get_file_encoding(file_path)
-        
-        with open(file_path, 'r', encoding=encoding, errors='ignore') as f:
-            content = f.read()
+        content, encoding = self._read_text(file_path)
         
         if not content.strip():
             return None
@@ -633,9 +1187,79 @@ class OptimizedComarchDocumentLoader:
             'category': category,
             'keywords': keywords,
             'source_file': str(file_path.name),
-            'file_path': str(file_path)
+            'file_path': str(file_path),
+            'encoding': encoding
         }
     
+    def _parse_html_lxml(self, content: str) -> Optional[Tuple[Optional[str], str]]:
+        """Szybka ścieżka lxml.html: (tytuł, treść div.Section1) - None gdy potrzebny BeautifulSoup
+        
+        Odtwarza get_text(separator='\n', strip=True) z BeautifulSoup. Strony bez div.Section1
+        (treść z całego dokumentu) obsługuje BeautifulSoup - zachowanie html.parser i lxml różni się
+        tam sposobem budowania drzewa.
+        """
+        try:
+            root = lxml.html.document_fromstring(content)
+        except (ValueError, etree.ParserError):
+            return None
+        
+        sections = root.xpath("//div[contains(concat(' ', normalize-space(@class), ' '), ' Section1 ')]")
+        if not sections:
+            return None
+        main_div = sections[0]
+        
+        titles = root.xpath("//title")
+        title_text = titles[0].text_content().strip() if titles else None
+        
+        strings = []
+        self._collect_html_strings(main_div, strings)
+        text = '\n'.join(piece for piece in (s.strip() for s in strings) if piece)
+        
+        text = re.sub(r'\n\s*\n', '\n\n', text)
+        text = re.sub(r'[ \t]+', ' ', text)
+        return title_text, text.strip()
+    
+    # Elementy usuwane przed wyciągnięciem tekstu (jak decompose() w _extract_main_content)
+    _SKIPPED_HTML_TAGS = frozenset(('script', 'style', 'meta', 'link'))
+    
+    def _collect_html_strings(self, element, strings: List[str]):
+        """Napisy poddrzewa w kolejności dokumentu - tekst za pominiętym elementem (tail) zostaje osobnym napisem"""
+        # Komentarze i instrukcje przetwarzania nie należą do tekstu, ale ich tail tak
+        if isinstance(element.tag, str) and element.text:
+            strings.append(element.text)
+        for child in element:
+            if not (isinstance(child.tag, str) and child.tag in self._SKIPPED_HTML_TAGS):
+                self._collect_html_strings(child, strings)
+            if child.tail:
+                strings.append(child.tail)
+    
+    def _scan_table_xml_lxml(self, content: str) -> Optional[Tuple[Optional[Dict[str, str]], List[Dict[str, str]]]]:
+        """Strumieniowe iterparse: atrybuty pierwszego <table> i wszystkich <column>, bez budowy drzewa"""
+        table_attrs = None
+        columns = []
+        try:
+            source = io.BytesIO(content.encode('utf-8'))
+            for event, element in etree.iterparse(source, events=('start', 'end'), encoding='utf-8',
+                                                  recover=True, resolve_entities=False):
+                if event == 'start':
+                    if not isinstance(element.tag, str):
+                        continue
+                    local_name = etree.QName(element).localname
+                    if local_name == 'column':
+                        columns.append(dict(element.attrib))
+                    elif local_name == 'table' and table_attrs is None:
+                        table_attrs = dict(element.attrib)
+                else:
+                    # Zwolnij przetworzone elementy - pamięć stała niezależnie od rozmiaru pliku
+                    element.clear()
+                    parent = element.getparent()
+                    if parent is not None:
+                        while element.getprevious() is not None:
+                            del parent[0]
+        except etree.XMLSyntaxError:
+            return None
+        return table_attrs, columns
+    
     def _extract_main_content(self, soup: BeautifulSoup) -> str:
         """Wyciąga główną zawartość z HTML"""
         # Usuń zbędne elementy
@@ -660,138 +1284,45 @@ class OptimizedComarchDocumentLoader:
     
     def _determine_category(self, title: str, content: str, file_path: str = "") -> str:
         """Określa kategorię dokumentu na podstawie tytułu i zawartości"""
-        title_lower = title.lower()
-        content_lower = content.lower()
-        file_path_lower = file_path.lower()
-        
-        # Kategorie dla systemu Hydra (nowe)
-        if 'xl003-hydra' in file_path_lower or 'hydra' in title_lower:
-            if file_path_lower.endswith('.pdf'):
-                return 'hydra_dokumentacja'
-            elif file_path_lower.endswith('.cs'):
-                # Określ typ kodu C# na podstawie nazwy pliku
-                if 'callback' in title_lower:
-                    return 'hydra_callback'
-                elif 'debug' in title_lower or 'log' in title_lower:
-                    return 'hydra_debug'
-                elif any(word in title_lower for word in ['odczyt', 'klawisz', 'keycode']):
-                    return 'hydra_input'
-                elif any(word in title_lower for word in ['wydruk', 'print']):
-                    return 'hydra_print'
-                elif any(word in title_lower for word in ['kolumna', 'ukrycie']):
-                    return 'hydra_ui'
-                else:
-                    return 'hydra_code_cs'
-            elif any(config_word in title_lower for config_word in ['akcje', 'daty', 'keycodes', 'kolory']):
-                return 'hydra_config'
-            else:
-                return 'hydra_inne'
-        
-        # Kategorie dla struktur bazy danych (nowe)
-        elif 'tabele_2025' in file_path_lower or any(word in title_lower for word in ['tabela', 'struktura', 'kolumna']):
-            # Procedury AI ChatERP - sprawdź zawartość
-            if 'ai_chaterp' in content_lower or 'ai_pp_' in content_lower or 'ai_' in content_lower and 'create procedure' in content_lower:
-                return 'ai_procedury_sql'
-            elif title_lower.startswith('ai') or any(ai_word in title_lower for ai_word in ['ailimity', 'aiprognoza', 'aiwindykacja']):
-                return 'ai_tabele'
-            elif any(word in title_lower for word in ['bst', 'budżet', 'bilans']):
-                return 'tabele_finansowe'
-            elif any(word in title_lower for word in ['twr', 'towar', 'cen', 'mag']):
-                return 'tabele_magazynowe'
-            elif any(word in title_lower for word in ['knt', 'kontrahent', 'adres']):
-                return 'tabele_kontrahentow'
-            elif any(word in title_lower for word in ['tra', 'dokument', 'elem']):
-                return 'tabele_dokumentow'
-            else:
-                return 'tabele_inne'
-        
-        # Kategorie dla API (oryginalne)
-        if any(word in title_lower for word in ['spis', 'treści', 'index']):
-            return 'index'
-        elif any(word in title_lower for word in ['wprowadzenie', 'uwagi', 'ogólne']):
-            return 'wprowadzenie'
-        elif 'xl' in title_lower and any(word in title_lower for word in ['login', 'logout', 'sprawdz']):
-            return 'autoryzacja'
-        elif any(word in title_lower for word in ['dokument', 'handlowe', 'magazynowe', 'sad']):
-            return 'dokumenty'
-        elif any(word in title_lower for word in ['kontrahent', 'adres']):
-            return 'kontrahenci'
-        elif any(word in title_lower for word in ['towar', 'cena', 'cennik']):
-            return 'towary'
-        elif any(word in title_lower for word in ['dekret', 'księgowe']):
-            return 'księgowość'
-        elif any(word in title_lower for word in ['produkcja', 'zlecenie']):
-            return 'produkcja'
-        elif any(word in title_lower for word in ['parametry', 'obowiązkowe']):
-            return 'parametry'
-        elif any(word in title_lower for word in ['prototyp', 'działanie']):
-            return 'funkcje'
-        elif any(word in content_lower for word in ['xlnowy', 'xldodaj', 'xlmodyfikuj', 'xlusun']):
-            return 'api_funkcje'
-        else:
-            return 'inne'
+        return determine_category(title, content, file_path)
     
     def _extract_keywords(self, title: str, content: str) -> List[str]:
         """Wyciąga kluczowe słowa z tytułu i zawartości"""
-        keywords = []
-        
-        # Kluczowe słowa z tytułu
-        title_words = re.findall(r'\b[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+\b', title)
-        keywords.extend(title_words)
-        
-        # Nazwy funkcji API
-        api_functions = re.findall(r'\bXL[A-Za-z]+\b', content)
-        keywords.extend(api_functions)
-        
-        # Kluczowe słowa biznesowe
-        business_terms = re.findall(r'\b(?:dokument|pozycja|kontrahent|towar|cena|rabat|vat|waluta|ilosc|magazyn|zlecenie|produkcja|księgowanie)\b', content.lower())
-        keywords.extend(business_terms)
-        
-        # Nazwy tabel (dla struktur bazy danych)
-        table_names = re.findall(r'\b[A-Z][a-zA-Z]*(?:Nag|Elem|Karty|Dane|Info|Log|Hist)\b', content)
-        keywords.extend(table_names)
-        
-        # Procedury AI i ChatERP
-        ai_procedures = re.findall(r'\bAI_[A-Za-z_]+\b', content)
-        keywords.extend(ai_procedures)
-        
-        # Kolumny bazy danych (prefiksy)
-        db_prefixes = re.findall(r'\b[A-Z]{2,4}_[A-Za-z]+\b', content)
-        keywords.extend(db_prefixes)
-        
-        # Typy danych SQL
-        sql_types = re.findall(r'\b(?:INTEGER|VARCHAR|TEXT|DECIMAL|DATETIME|CSTRING|LONG)\b', content)
-        keywords.extend(sql_types)
-        
-        # Kluczowe słowa dla systemu Hydra
-        hydra_functions = re.findall(r'\b(?:callback|debug|log|print|wydruk|odczyt|klawisz|ukrycie|kolumna)\b', content.lower())
-        keywords.extend(hydra_functions)
-        
-        # Nazwy klas i funkcji C#
-        cs_identifiers = re.findall(r'\b[A-Z][a-zA-Z]*(?:Handler|Manager|Service|Helper|Util|Controller)\b', content)
-        keywords.extend(cs_identifiers)
-        
-        # Słowa kluczowe C#
-        cs_keywords = re.findall(r'\b(?:using|namespace|class|public|private|static|void|string|int|bool|DateTime)\b', content)
-        keywords.extend(cs_keywords)
-        
-        # Akcje i konfiguracje Hydra
-        hydra_config = re.findall(r'\b(?:akcje|daty|keycodes|kolory|fonty|style)\b', content.lower())
-        keywords.extend(hydra_config)
-        
-        # Event handlers i callbacks
-        event_handlers = re.findall(r'\b\w*(?:Event|Handler|Callback|Action|Method)\b', content)
-        keywords.extend(event_handlers)
-        
-        # Usuń duplikaty i zwróć
-        return list(set(keywords))
+        return extract_keywords(title, content)
     
     def cleanup(self):
         """Czyści zasoby"""
         if self.executor:
             self.executor.shutdown(wait=True)
+        if self.process_executor:
+            self.process_executor.shutdown(wait=True)
+            self.process_executor = None
         if self.cache:
             self.cache.close()
+        self.discovery.close()
+
+# Przelicznik dawnych ustawień fragmentów w znakach na tokeny
+CHARS_PER_TOKEN = 4
+
+# Znacznik końca strumienia między etapami potoku indeksowania
+_PIPELINE_DONE = object()
+
+def _pipeline_put(q: queue.Queue, item, stop: threading.Event):
+    """Blokujący put przerywany zatrzymaniem potoku (ograniczona kolejka = backpressure)"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
+
+def _pipeline_get(q: queue.Queue, stop: threading.Event):
+    while not stop.is_set():
+        try:
+            return q.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _PIPELINE_DONE
 
 class OptimizedComarchKnowledgeService:
     """Zoptymalizowany service do zarządzania bazą wiedzy Comarch API"""
@@ -802,24 +1333,34 @@ class OptimizedComarchKnowledgeService:
         self.vector_service = vector_service
         self.document_loader = OptimizedComarchDocumentLoader(
             cache_enabled=True,
-            max_workers=getattr(config, 'LOADER_MAX_WORKERS', 4),
-            batch_size=getattr(config, 'LOADER_BATCH_SIZE', 50)
+            max_workers=getattr(config, 'LOADER_MAX_WORKERS', None),
+            executor_mode=getattr(config, 'LOADER_EXECUTOR_MODE', 'thread'),
+            batch_size=getattr(config, 'LOADER_BATCH_SIZE', 50),
+            watch_directories=getattr(config, 'LOADER_WATCH_DIRECTORIES', False)
         )
         self.documents = []
+        self._streamed_stats = self._new_document_stats()
+        
+        # Fragmenty liczone w tokenach; dawne CHUNK_SIZE/CHUNK_OVERLAP (w znakach) przeliczane na tokeny
+        self.chunker = TextChunker(
+            chunk_tokens=getattr(config, 'CHUNK_TOKENS', None) or getattr(config, 'CHUNK_SIZE', 1000) // CHARS_PER_TOKEN,
+            chunk_overlap=getattr(config, 'CHUNK_OVERLAP_TOKENS', None) or getattr(config, 'CHUNK_OVERLAP', 200) // CHARS_PER_TOKEN
+        )
         self._loading_progress = ProcessingProgress()
+        self.embedding_store = get_embedding_store(getattr(config, 'EMBEDDING_STORE_DIR', None),
+                                                   getattr(config, 'EMBEDDING_MODEL', ''))
         
-    def load_comarch_documentation(self, progress_callback=None):
+    def load_comarch_documentation(self, progress_callback=None, streaming: Optional[bool] = None):
         """Ładuje dokumentację Comarch do bazy wektorowej z progress tracking"""
-        logger.info("📚 Ładowanie dokumentacji Comarch API...")
+        if streaming is None:
+            streaming = getattr(self.config, 'STREAMING_INDEXING', False)
+        if streaming:
+            return self.index_documentation_streaming(progress_callback)
         
-        def internal_progress_callback(progress: ProcessingProgress):
-            self._loading_progress = progress
-            logger.info(f"Progress: {progress.percentage:.1f}% ({progress.processed_files}/{progress.total_files}) - {progress.current_file}")
-            if progress_callback:
-                progress_callback(progress)
+        logger.info("📚 Ładowanie dokumentacji Comarch API...")
         
         # Załaduj dokumenty
-        self.documents = self.document_loader.load_all_documents(internal_progress_callback)
+        self.documents = self.document_loader.load_all_documents(self._progress_callback(progress_callback))
         
         if not self.documents:
             logger.warning("❌ Nie znaleziono dokumentów do załadowania")
@@ -833,23 +1374,10 @@ class OptimizedComarchKnowledgeService:
         logger.info("🔄 Przygotowywanie dokumentów do indeksowania...")
         
         for doc in self.documents:
-            # Podziel długie dokumenty na chunki
-            chunks = self._chunk_text(doc['content'])
-            
-            for i, chunk in enumerate(chunks):
-                if len(chunk.strip()) < 50:  # Pomiń bardzo krótkie chunki
-                    continue
-                    
+            for chunk, metadata, chunk_id in self._document_chunks(doc):
                 documents_to_index.append(chunk)
-                metadatas.append({
-                    "source": doc['source_file'],
-                    "title": doc['title'],
-                    "category": doc['category'],
-                    "keywords": ",".join(doc['keywords']),
-                    "chunk_id": i,
-                    "file_path": doc['file_path']
-                })
-                ids.append(f"{doc['source_file']}_chunk_{i}")
+                metadatas.append(metadata)
+                ids.append(chunk_id)
         
         if not documents_to_index:
             logger.warning("❌ Brak dokumentów do indeksowania po przetworzeniu")
@@ -865,8 +1393,8 @@ class OptimizedComarchKnowledgeService:
             for i in range(0, len(documents_to_index), batch_size):
                 batch = documents_to_index[i:i + batch_size]
                 logger.info(f"Generowanie embeddings dla batch {i//batch_size + 1}/{(len(documents_to_index) + batch_size - 1)//batch_size}")
-                batch_embeddings = self.ai_service.generate_embeddings(batch)
-                embeddings.extend(batch_embeddings)
+                batch_embeddings = cached_encode(batch, self.ai_service.generate_embeddings, self.embedding_store)
+                embeddings.extend(batch_embeddings.tolist())
             
             # Dodaj do bazy wektorowej w batch'ach
             logger.info("💾 Dodawanie do bazy wektorowej...")
@@ -892,58 +1420,149 @@ class OptimizedComarchKnowledgeService:
             # Cleanup
             self.document_loader.cleanup()
     
-    def _chunk_text(self, text: str) -> List[str]:
-        """Dzieli tekst na chunki - zoptymalizowana wersja"""
-        chunk_size = getattr(self.config, 'CHUNK_SIZE', 1000)
-        overlap = getattr(self.config, 'CHUNK_OVERLAP', 200)
+    def index_documentation_streaming(self, progress_callback=None) -> int:
+        """Potokowe indeksowanie: parsowanie → chunking → embeddingi → baza wektorowa
         
-        # Sprawdź długość tekstu
-        if len(text) <= chunk_size:
-            return [text]
+        Etapy działają w osobnych wątkach połączonych ograniczonymi kolejkami, więc parsowanie,
+        kodowanie i zapis do bazy nakładają się w czasie. W pamięci jest stała liczba batchy
+        niezależnie od rozmiaru korpusu - pełna lista dokumentów nie jest przechowywana.
+        """
+        logger.info("📚 Potokowe indeksowanie dokumentacji Comarch API...")
         
-        chunks = []
+        batch_size = getattr(self.config, 'EMBEDDING_BATCH_SIZE', 100)
+        vector_batch_size = getattr(self.config, 'VECTOR_BATCH_SIZE', 1000)
+        queue_size = getattr(self.config, 'PIPELINE_QUEUE_SIZE', 4)
         
-        # Podziel po akapitach
-        paragraphs = text.split('\n\n')
-        current_chunk = ""
+        chunk_queue = queue.Queue(maxsize=queue_size)
+        embedded_queue = queue.Queue(maxsize=queue_size)
+        stop = threading.Event()
+        errors = []
         
-        for paragraph in paragraphs:
-            # Jeśli dodanie akapitu nie przekroczy limitu
-            if len(current_chunk + paragraph) < chunk_size:
-                current_chunk += paragraph + "\n\n"
-            else:
-                # Zapisz aktualny chunk jeśli nie jest pusty
-                if current_chunk.strip():
-                    chunks.append(current_chunk.strip())
-                
-                # Jeśli akapit jest za długi, podziel go na zdania
-                if len(paragraph) > chunk_size:
-                    sentences = paragraph.split('.')
-                    sentence_chunk = ""
-                    
-                    for sentence in sentences:
-                        if len(sentence_chunk + sentence) < chunk_size:
-                            sentence_chunk += sentence + "."
-                        else:
-                            if sentence_chunk.strip():
-                                chunks.append(sentence_chunk.strip())
-                            sentence_chunk = sentence + "."
-                    
-                    if sentence_chunk.strip():
-                        current_chunk = sentence_chunk
-                    else:
-                        current_chunk = ""
-                else:
-                    current_chunk = paragraph + "\n\n"
+        self.documents = []
+        self._streamed_stats = self._new_document_stats()
+        loader_progress = self._progress_callback(progress_callback)
+        
+        def produce_chunks():
+            texts, metas, ids = [], [], []
+            for doc in self.document_loader.iter_documents(loader_progress):
+                if stop.is_set():
+                    return
+                self._add_document_stats(self._streamed_stats, doc)
+                for chunk, metadata, chunk_id in self._document_chunks(doc):
+                    texts.append(chunk)
+                    metas.append(metadata)
+                    ids.append(chunk_id)
+                    if len(texts) >= batch_size:
+                        _pipeline_put(chunk_queue, (texts, metas, ids), stop)
+                        texts, metas, ids = [], [], []
+            if texts:
+                _pipeline_put(chunk_queue, (texts, metas, ids), stop)
+        
+        def embed_chunks():
+            while True:
+                item = _pipeline_get(chunk_queue, stop)
+                if item is _PIPELINE_DONE:
+                    return
+                texts, metas, ids = item
+                embeddings = cached_encode(texts, self.ai_service.generate_embeddings, self.embedding_store)
+                _pipeline_put(embedded_queue, (texts, metas, ids, embeddings.tolist()), stop)
+        
+        def run_stage(stage, output: queue.Queue):
+            try:
+                stage()
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+            finally:
+                _pipeline_put(output, _PIPELINE_DONE, stop)
+        
+        stages = [
+            threading.Thread(target=run_stage, args=(produce_chunks, chunk_queue), name="index-parse", daemon=True),
+            threading.Thread(target=run_stage, args=(embed_chunks, embedded_queue), name="index-embed", daemon=True)
+        ]
+        for stage in stages:
+            stage.start()
+        
+        start = time.perf_counter()
+        indexed = 0
+        pending = ([], [], [], [])
+        
+        def write_pending():
+            nonlocal pending, indexed
+            if pending[0]:
+                self.vector_service.add_documents(*pending)
+                indexed += len(pending[0])
+                logger.info(f"💾 Zaindeksowano {indexed} fragmentów")
+            pending = ([], [], [], [])
         
-        # Dodaj ostatni chunk
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
+        try:
+            # Zapis do bazy wektorowej w wątku wywołującym, w batchach VECTOR_BATCH_SIZE
+            while True:
+                item = _pipeline_get(embedded_queue, stop)
+                if item is _PIPELINE_DONE:
+                    break
+                for target, values in zip(pending, item):
+                    target.extend(values)
+                if len(pending[0]) >= vector_batch_size:
+                    write_pending()
+            if not errors:
+                write_pending()
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+        finally:
+            for stage in stages:
+                stage.join()
+            self.document_loader.cleanup()
         
-        # Filtruj krótkie chunki
-        filtered_chunks = [chunk for chunk in chunks if len(chunk.strip()) > 20]
+        if errors:
+            logger.error(f"❌ Błąd indeksowania dokumentacji: {errors[0]}")
+            raise errors[0]
         
-        return filtered_chunks
+        if not indexed:
+            logger.warning("❌ Brak dokumentów do indeksowania po przetworzeniu")
+        else:
+            logger.info(f"✅ Zaindeksowano {indexed} fragmentów z {self._streamed_stats['total_documents']} "
+                        f"dokumentów w {time.perf_counter() - start:.1f}s")
+        return indexed
+    
+    def _progress_callback(self, progress_callback=None):
+        def internal_progress_callback(progress: ProcessingProgress):
+            self._loading_progress = progress
+            logger.info(f"Progress: {progress.percentage:.1f}% ({progress.processed_files}/{progress.total_files}) - {progress.current_file}")
+            if progress_callback:
+                progress_callback(progress)
+        return internal_progress_callback
+    
+    def _document_chunks(self, doc: Dict[str, Any]) -> Iterator[Tuple[str, Dict[str, Any], str]]:
+        """Fragmenty dokumentu do indeksowania: (tekst, metadane, id)"""
+        # Podziel długie dokumenty na chunki (zakresy w treści - odtwarzalne z cache'u dokumentów)
+        content = doc['content']
+        for i, span in enumerate(self.chunker.split(content, doc['source_file'])):
+            chunk = span.text(content)
+            if len(chunk) < 50:  # Pomiń bardzo krótkie chunki
+                continue
+            metadata = {
+                "source": doc['source_file'],
+                "title": doc['title'],
+                "category": doc['category'],
+                "keywords": ",".join(doc['keywords']),
+                "chunk_id": i,
+                "file_path": doc['file_path'],
+                "start": span.start,
+                "end": span.end
+            }
+            if doc.get('toc_path'):
+                metadata["toc_path"] = doc['toc_path']
+            yield chunk, metadata, f"{doc['source_file']}_chunk_{i}"
+    
+    def _chunk_text(self, text: str) -> List[str]:
+        """Dzieli tekst na chunki liczone w tokenach, z nakładką"""
+        return [span.text(text) for span in self.chunker.split(text)]
+    
+    def lookup_keyword(self, keyword: str) -> List[Dict[str, Any]]:
+        """Dokładne trafienie słowa kluczowego (np. XLNowyDokument) w indeksie CHM"""
+        return self.document_loader.lookup_keyword(keyword)
     
     def search_knowledge(self, query: str, num_results: int = 5):
         """Wyszukuje w bazie wiedzy Comarch"""
@@ -956,23 +1575,20 @@ class OptimizedComarchKnowledgeService:
     
     def get_statistics(self) -> Dict[str, Any]:
         """Zwraca szczegółowe statystyki załadowanej dokumentacji"""
-        if not self.documents:
-            return {"total_documents": 0}
-        
-        categories = {}
-        total_functions = 0
-        total_size = 0
+        if self.documents:
+            stats = self._new_document_stats()
+            for doc in self.documents:
+                self._add_document_stats(stats, doc)
+        else:
+            # Indeksowanie potokowe nie przechowuje dokumentów - statystyki zbierane w locie
+            stats = self._streamed_stats
         
-        for doc in self.documents:
-            category = doc['category']
-            categories[category] = categories.get(category, 0) + 1
-            
-            # Policz funkcje API
-            api_functions = [kw for kw in doc['keywords'] if kw.startswith('XL')]
-            total_functions += len(api_functions)
-            
-            # Dodaj rozmiar
-            total_size += len(doc.get('content', ''))
+        total_documents = stats['total_documents']
+        if not total_documents:
+            return {"total_documents": 0}
+        categories = stats['categories']
+        total_functions = stats['total_api_functions']
+        total_size = stats['total_content_size']
         
         # Dodaj statystyki cache'u
         cache_stats = {}
@@ -980,13 +1596,15 @@ class OptimizedComarchKnowledgeService:
             cache_stats = self.document_loader.cache.get_cache_stats()
         
         return {
-            "total_documents": len(self.documents),
+            "total_documents": total_documents,
             "categories": categories,
             "total_api_functions": total_functions,
             "total_content_size": total_size,
-            "avg_content_size": total_size / len(self.documents) if self.documents else 0,
+            "avg_content_size": total_size / total_documents,
             "categories_list": list(categories.keys()),
             "cache_stats": cache_stats,
+            "chm_indexes": [index.get_stats() for index in self.document_loader.get_chm_indexes().values()],
+            "file_discovery": self.document_loader.discovery.get_stats(),
             "loading_progress": {
                 "total_files": self._loading_progress.total_files,
                 "processed_files": self._loading_progress.processed_files,
@@ -996,6 +1614,22 @@ class OptimizedComarchKnowledgeService:
             }
         }
     
+    @staticmethod
+    def _new_document_stats() -> Dict[str, Any]:
+        return {'total_documents': 0, 'categories': {}, 'total_api_functions': 0, 'total_content_size': 0}
+    
+    @staticmethod
+    def _add_document_stats(stats: Dict[str, Any], doc: Dict[str, Any]):
+        stats['total_documents'] += 1
+        category = doc['category']
+        stats['categories'][category] = stats['categories'].get(category, 0) + 1
+        
+        # Policz funkcje API
+        stats['total_api_functions'] += sum(1 for kw in doc['keywords'] if kw.startswith('XL'))
+        
+        # Dodaj rozmiar
+        stats['total_content_size'] += len(doc.get('content', ''))
+    
     def cleanup(self):
         """Czyści zasoby"""
         if self.document_loader:
@@ -1003,12 +1637,14 @@ class OptimizedComarchKnowledgeService:
 
 # Utility functions dla prostego użycia
 
-def create_optimized_loader(cache_enabled: bool = True, max_workers: int = 4, batch_size: int = 50) -> OptimizedComarchDocumentLoader:
+def create_optimized_loader(cache_enabled: bool = True, max_workers: Optional[int] = 4, batch_size: int = 50,
+                            executor_mode: str = "thread") -> OptimizedComarchDocumentLoader:
     """Factory function dla szybkiego tworzenia optimized loader"""
     return OptimizedComarchDocumentLoader(
         cache_enabled=cache_enabled,
         max_workers=max_workers,
-        batch_size=batch_size
+        batch_size=batch_size,
+        executor_mode=executor_mode
     )
 
 def load_documents_with_progress(progress_callback=None) -> List[Dict[str, Any]]:
@@ -1058,6 +1694,147 @@ def test_optimized_loader():
     finally:
         loader.cleanup()
 
+def benchmark_parsing(docs_path: str = None, worker_counts: Tuple[int, ...] = (1, 2, 4, 8),
+                      limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Benchmark parsowania bazy wiedzy: pula wątków vs pula procesów dla różnej liczby rdzeni"""
+    probe = OptimizedComarchDocumentLoader(docs_path=docs_path, cache_enabled=False, max_workers=1)
+    files = probe.discover_files()[:limit]
+    probe.cleanup()
+    if not files:
+        print("❌ Brak plików do benchmarku")
+        return []
+    
+    print(f"🏁 Benchmark parsowania: {len(files)} plików, {os.cpu_count()} rdzeni")
+    results = []
+    baseline = None
+    for executor_mode in OptimizedComarchDocumentLoader.EXECUTOR_MODES:
+        for workers in worker_counts:
+            loader = OptimizedComarchDocumentLoader(docs_path=docs_path, cache_enabled=False, max_workers=workers,
+                                                    batch_size=max(50, workers * 8), executor_mode=executor_mode)
+            try:
+                if executor_mode == "process":
+                    # Rozgrzanie puli - start procesów nie wlicza się do czasu parsowania
+                    list(loader._get_process_executor().map(_parse_files_chunk, [[]] * workers))
+                
+                loop = asyncio.new_event_loop()
+                start = time.perf_counter()
+                documents = []
+                for i in range(0, len(files), loader.batch_size):
+                    documents.extend(loop.run_until_complete(
+                        loader._process_batch_async(files[i:i + loader.batch_size])))
+                duration = time.perf_counter() - start
+                loop.close()
+            finally:
+                loader.cleanup()
+            
+            baseline = baseline or duration
+            result = {
+                'mode': executor_mode,
+                'workers': workers,
+                'documents': len(documents),
+                'seconds': round(duration, 3),
+                'files_per_sec': round(len(files) / duration, 1),
+                'speedup': round(baseline / duration, 2)
+            }
+            results.append(result)
+            print(f"   {executor_mode:8s} x{workers}: {result['seconds']:.2f}s, "
+                  f"{result['files_per_sec']:.1f} plików/s, przyspieszenie {result['speedup']:.2f}x")
+    return results
+
+def compare_parsers(docs_path: str = None, limit: Optional[int] = None) -> Dict[str, Any]:
+    """Porównuje szybką ścieżkę lxml z BeautifulSoup: zgodność wyników i czas parsowania na plik"""
+    fast = OptimizedComarchDocumentLoader(docs_path=docs_path, cache_enabled=False, max_workers=1)
+    slow = OptimizedComarchDocumentLoader(docs_path=docs_path, cache_enabled=False, max_workers=1,
+                                          fast_parsers=False)
+    files = [f for f in fast.discover_files() if f.suffix.lower() in ('.htm', '.html', '.xml')][:limit]
+    
+    mismatches = []
+    for file_path in files:
+        if fast._process_single_file(file_path) != slow._process_single_file(file_path):
+            mismatches.append(str(file_path))
+    
+    report = {
+        'files': len(files),
+        'mismatches': mismatches,
+        'fast_path': fast.get_parse_stats(),
+        'beautifulsoup': slow.get_parse_stats()
+    }
+    fast.cleanup()
+    slow.cleanup()
+    
+    print(f"🔍 Porównanie parserów: {len(files)} plików, niezgodności: {len(mismatches)}")
+    for name in ('fast_path', 'beautifulsoup'):
+        for parser, stats in report[name].items():
+            print(f"   {parser:10s}: {stats['files']} plików, {stats['avg_ms']:.2f} ms/plik")
+    for file_path in mismatches[:20]:
+        print(f"   ❌ {file_path}")
+    return report
+
+# Poprzednia implementacja (osobny findall na wzorzec) - wzorzec zgodności dla benchmarku
+_REFERENCE_KEYWORD_PATTERNS = (
+    (r'\bXL[A-Za-z]+\b', False),
+    (r'\b(?:dokument|pozycja|kontrahent|towar|cena|rabat|vat|waluta|ilosc|magazyn|zlecenie|produkcja|księgowanie)\b', True),
+    (r'\b[A-Z][a-zA-Z]*(?:Nag|Elem|Karty|Dane|Info|Log|Hist)\b', False),
+    (r'\bAI_[A-Za-z_]+\b', False),
+    (r'\b[A-Z]{2,4}_[A-Za-z]+\b', False),
+    (r'\b(?:INTEGER|VARCHAR|TEXT|DECIMAL|DATETIME|CSTRING|LONG)\b', False),
+    (r'\b(?:callback|debug|log|print|wydruk|odczyt|klawisz|ukrycie|kolumna)\b', True),
+    (r'\b[A-Z][a-zA-Z]*(?:Handler|Manager|Service|Helper|Util|Controller)\b', False),
+    (r'\b(?:using|namespace|class|public|private|static|void|string|int|bool|DateTime)\b', False),
+    (r'\b(?:akcje|daty|keycodes|kolory|fonty|style)\b', True),
+    (r'\b\w*(?:Event|Handler|Callback|Action|Method)\b', False),
+)
+
+def _reference_extract_keywords(title: str, content: str) -> List[str]:
+    keywords = re.findall(r'\b[A-ZĄĆĘŁŃÓŚŹŻ][a-ząćęłńóśźż]+\b', title)
+    for pattern, lowercase in _REFERENCE_KEYWORD_PATTERNS:
+        keywords.extend(re.findall(pattern, content.lower() if lowercase else content))
+    return list(set(keywords))
+
+def benchmark_keyword_extraction(docs_path: str = None, limit: Optional[int] = None,
+                                 repeat: int = 3) -> Dict[str, Any]:
+    """Mikrobenchmark ekstrakcji słów kluczowych: silnik prekompilowany vs findall na wzorzec"""
+    loader = OptimizedComarchDocumentLoader(docs_path=docs_path, cache_enabled=False, max_workers=1)
+    documents = [doc for doc in map(loader._process_single_file, loader.discover_files()[:limit]) if doc]
+    loader.cleanup()
+    if not documents:
+        print("❌ Brak dokumentów do benchmarku")
+        return {}
+    
+    samples = [(doc['title'], doc['content']) for doc in documents]
+    mismatches = [doc['file_path'] for doc, (title, content) in zip(documents, samples)
+                  if set(extract_keywords(title, content)) != set(_reference_extract_keywords(title, content))]
+    
+    timings = {}
+    for name, extract in (('reference', _reference_extract_keywords), ('compiled', extract_keywords)):
+        start = time.perf_counter()
+        for _ in range(repeat):
+            for title, content in samples:
+                extract(title, content)
+        timings[name] = (time.perf_counter() - start) * 1000 / (repeat * len(samples))
+    
+    report = {
+        'documents': len(samples),
+        'mismatches': mismatches,
+        'reference_ms': round(timings['reference'], 3),
+        'compiled_ms': round(timings['compiled'], 3),
+        'speedup': round(timings['reference'] / timings['compiled'], 2)
+    }
+    print(f"🔑 Słowa kluczowe: {len(samples)} dokumentów, niezgodności: {len(mismatches)}")
+    print(f"   findall na wzorzec: {report['reference_ms']:.3f} ms/dok, "
+          f"silnik: {report['compiled_ms']:.3f} ms/dok ({report['speedup']:.1f}x)")
+    for file_path in mismatches[:20]:
+        print(f"   ❌ {file_path}")
+    return report
+
 if __name__ == "__main__":
-    # Uruchom test
-    test_optimized_loader()
+    import sys
+    if "--benchmark" in sys.argv:
+        benchmark_parsing()
+    elif "--compare-parsers" in sys.argv:
+        compare_parsers()
+    elif "--benchmark-keywords" in sys.argv:
+        benchmark_keyword_extraction()
+    else:
+        # Uruchom test
+        test_optimized_loader()
@@ -0,0 +1,233 @@
+"""
+Trwały magazyn embeddingów współdzielony przez loadery i silniki RAG
+Klucz (model, sha1(tekst fragmentu)), wektory float16 w pliku mapowanym w pamięci
+"""
+
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import numpy as np
+from typing import Dict, Any, Optional, List, Callable, Sequence
+
+# Blokada plikowa między procesami (POSIX) - bez niej magazyn działa w obrębie jednego procesu
+try:
+    import fcntl
+    FILE_LOCK_AVAILABLE = True
+except ImportError:
+    FILE_LOCK_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DIGEST_SIZE = 20  # sha1
+VECTORS_FILE = "vectors.f16"
+KEYS_FILE = "keys.sha1"
+META_FILE = "meta.json"
+LOCK_FILE = ".lock"
+
+# ============================================================================
+# EMBEDDING STORE
+# ============================================================================
+
+class EmbeddingStore:
+    """Append-only magazyn embeddingów jednego modelu
+
+    Wiersz i to i-ty skrót w keys.sha1 oraz i-ty wektor w vectors.f16. Liczbę wierszy
+    wyznacza plik kluczy (zapisywany po wektorach), więc przerwany zapis nie psuje magazynu.
+    """
+
+    def __init__(self, store_dir: str, model_name: str):
+        self.model_name = model_name
+        self.model_dir = os.path.join(store_dir, self._model_dir_name(model_name))
+        os.makedirs(self.model_dir, exist_ok=True)
+
+        self.dim: Optional[int] = None
+        self._rows: Dict[bytes, int] = {}
+        self._keys_size = 0
+        self._vectors: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+
+        self._read_meta()
+        with self._lock:
+            self._refresh()
+
+    @property
+    def num_vectors(self) -> int:
+        return len(self._rows)
+
+    @staticmethod
+    def text_key(text: str) -> bytes:
+        return hashlib.sha1(text.encode('utf-8', errors='ignore')).digest()
+
+    def encode(self, texts: Sequence[str], encoder: Callable[[List[str]], Any],
+               batch_size: int = 256) -> np.ndarray:
+        """Embeddingi tekstów (float32) - enkoder dostaje wyłącznie brakujące fragmenty, w batchach"""
+        texts = list(texts)
+        keys = [self.text_key(text) for text in texts]
+
+        with self._lock:
+            self._refresh()
+            missing = {}
+            for key, text in zip(keys, texts):
+                if key not in self._rows and key not in missing:
+                    missing[key] = text
+
+        if missing:
+            missing_keys = list(missing)
+            missing_texts = list(missing.values())
+            for start in range(0, len(missing_texts), batch_size):
+                batch = missing_texts[start:start + batch_size]
+                vectors = np.asarray(encoder(batch), dtype=np.float32)
+                self._append(missing_keys[start:start + batch_size], vectors)
+
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        if missing:
+            logger.info(f"🧮 Embeddingi: {len(texts) - len(missing)} z magazynu, {len(missing)} nowych")
+
+        with self._lock:
+            if not texts:
+                return np.empty((0, self.dim or 0), dtype=np.float32)
+            rows = np.fromiter((self._rows[key] for key in keys), dtype=np.int64, count=len(keys))
+            return np.asarray(self._vectors[rows], dtype=np.float32)
+
+    def get_stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            'model': self.model_name,
+            'vectors': self.num_vectors,
+            'dim': self.dim,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total else 0.0
+        }
+
+    def _append(self, keys: List[bytes], vectors: np.ndarray):
+        """Dopisuje wektory i klucze (pod blokadą procesu i pliku)"""
+        with self._lock, self._file_lock():
+            self._refresh()
+            if self.dim is None:
+                self.dim = int(vectors.shape[1])
+                self._write_meta()
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Niezgodny wymiar embeddingów: {vectors.shape[1]} != {self.dim}")
+
+            # Inny proces mógł w międzyczasie zapisać te same fragmenty
+            new = [i for i, key in enumerate(keys) if key not in self._rows]
+            if not new:
+                return
+            keys = [keys[i] for i in new]
+            vectors = vectors[new]
+
+            vectors_path = os.path.join(self.model_dir, VECTORS_FILE)
+            row_bytes = self.dim * np.dtype(np.float16).itemsize
+            with open(vectors_path, 'ab') as f:
+                # Obetnij resztki przerwanego zapisu (wektory bez kluczy)
+                f.truncate(self.num_vectors * row_bytes)
+                f.write(np.ascontiguousarray(vectors, dtype=np.float16).tobytes())
+            with open(os.path.join(self.model_dir, KEYS_FILE), 'ab') as f:
+                f.write(b''.join(keys))
+
+            self._refresh()
+
+    def _refresh(self):
+        """Doczytuje klucze dopisane od ostatniego odczytu (także przez inne procesy)"""
+        keys_path = os.path.join(self.model_dir, KEYS_FILE)
+        try:
+            keys_size = os.path.getsize(keys_path)
+        except OSError:
+            keys_size = 0
+        keys_size -= keys_size % DIGEST_SIZE
+        if keys_size == self._keys_size and (self._vectors is not None or keys_size == 0):
+            return
+
+        if self.dim is None:
+            self._read_meta()
+
+        with open(keys_path, 'rb') as f:
+            f.seek(self._keys_size)
+            data = f.read(keys_size - self._keys_size)
+        row = len(self._rows)
+        for offset in range(0, len(data), DIGEST_SIZE):
+            self._rows.setdefault(data[offset:offset + DIGEST_SIZE], row)
+            row += 1
+        self._keys_size = keys_size
+
+        self._vectors = np.memmap(os.path.join(self.model_dir, VECTORS_FILE), dtype=np.float16,
+                                  mode='r', shape=(row, self.dim))
+
+    def _read_meta(self):
+        try:
+            with open(os.path.join(self.model_dir, META_FILE), 'r', encoding='utf-8') as f:
+                self.dim = json.load(f).get('dim')
+        except FileNotFoundError:
+            pass
+
+    def _write_meta(self):
+        with open(os.path.join(self.model_dir, META_FILE), 'w', encoding='utf-8') as f:
+            json.dump({'model_name': self.model_name, 'dim': self.dim, 'dtype': 'float16'}, f)
+
+    def _file_lock(self):
+        return _FileLock(os.path.join(self.model_dir, LOCK_FILE))
+
+    @staticmethod
+    def _model_dir_name(model_name: str) -> str:
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]+', '_', model_name or 'default')[:64]
+        return f"{safe_name}-{hashlib.sha1((model_name or '').encode('utf-8')).hexdigest()[:8]}"
+
+
+class _FileLock:
+    """Wyłączna blokada pliku (no-op gdy fcntl niedostępny)"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = None
+
+    def __enter__(self):
+        if FILE_LOCK_AVAILABLE:
+            self._file = open(self.path, 'a')
+            fcntl.flock(self._file, fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+# ============================================================================
+# SHARED INSTANCES
+# ============================================================================
+
+_stores: Dict[tuple, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(store_dir: Optional[str], model_name: str) -> Optional[EmbeddingStore]:
+    """Wspólna instancja magazynu dla (katalog, model) - None gdy magazyn wyłączony"""
+    if not store_dir:
+        return None
+    key = (os.path.abspath(store_dir), model_name or '')
+    with _stores_lock:
+        store = _stores.get(key)
+        if store is None:
+            try:
+                store = EmbeddingStore(store_dir, model_name)
+            except Exception as e:
+                logger.warning(f"⚠️ Magazyn embeddingów niedostępny ({store_dir}): {e}")
+                return None
+            _stores[key] = store
+        return store
+
+
+def cached_encode(texts: Sequence[str], encoder: Callable[[List[str]], Any],
+                  store: Optional[EmbeddingStore] = None) -> np.ndarray:
+    """Kodowanie przez magazyn (gdy dostępny) albo bezpośrednio enkoderem"""
+    if store is None:
+        return np.asarray(encoder(list(texts)))
+    return store.encode(texts, encoder)
@@ -0,0 +1,174 @@
+"""
+Wykrywanie kodowania plików dokumentacji z jednego odczytu bajtów
+Kolejność: BOM, deklaracja (XML prolog, <meta charset>), poprawne UTF-8, zapamiętane kodowanie
+pliku, kodowanie wyuczone dla katalogu, chardet - pomoc Comarch to cp1250 albo UTF-8
+"""
+
+import re
+import codecs
+import logging
+import threading
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+try:
+    import chardet
+    CHARDET_AVAILABLE = True
+except ImportError:
+    CHARDET_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = 'windows-1250'
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16')
+)
+_XML_PROLOG = re.compile(rb'^\s*<\?xml[^>]*?encoding\s*=\s*["\']([\w.:-]+)', re.IGNORECASE)
+_META_CHARSET = re.compile(rb'<meta[^>]+?charset\s*=\s*["\']?([\w.:-]+)', re.IGNORECASE)
+# Bajty 0x80-0x9F to w ISO-8859-x znaki sterujące C1 - w polskim tekście oznaczają cp1250 (np. ś, ź)
+_C1_BYTES = re.compile(rb'[\x80-\x9f]')
+_DECLARATION_BYTES = 4096
+_CHARDET_SAMPLE = 8192
+
+def normalize_encoding(name) -> Optional[str]:
+    """Kanoniczna nazwa kodeka Pythona - None dla nieznanych nazw"""
+    if isinstance(name, bytes):
+        name = name.decode('ascii', errors='ignore')
+    try:
+        return codecs.lookup(name).name if name else None
+    except LookupError:
+        return None
+
+def declared_encoding(raw: bytes) -> Optional[str]:
+    """Kodowanie z BOM, prologu XML albo <meta charset> na początku pliku"""
+    for bom, encoding in _BOMS:
+        if raw.startswith(bom):
+            return encoding
+    head = raw[:_DECLARATION_BYTES]
+    match = _XML_PROLOG.match(head) or _META_CHARSET.search(head)
+    encoding = normalize_encoding(match.group(1)) if match else None
+    # Deklaracja UTF-16/32 w pliku 8-bitowym (bez BOM) nie może być prawdziwa - przeglądarki też ją pomijają
+    if encoding is not None and encoding.startswith(('utf-16', 'utf-32')):
+        return None
+    return encoding
+
+class EncodingDetector:
+    """Wykrywa kodowanie i dekoduje treść; uczy się domyślnego kodowania każdego katalogu
+
+    Kodowanie wyuczone dla katalogu zastępuje zgadywanie (chardet), gdy plik niczego nie deklaruje.
+    Bezpieczne dla wielu wątków.
+    """
+
+    # Pewne rozpoznania potrzebne, zanim katalog dostanie własne domyślne kodowanie
+    MIN_OBSERVATIONS = 3
+
+    def __init__(self, default_encoding: str = DEFAULT_ENCODING):
+        self.default_encoding = normalize_encoding(default_encoding) or DEFAULT_ENCODING
+        self._directories: Dict[str, Counter] = {}
+        self._lock = threading.Lock()
+        self.sources: Counter = Counter()
+
+    def decode(self, raw: bytes, directory: str = '', hint: Optional[str] = None,
+               errors: str = 'ignore') -> Tuple[str, str]:
+        """(tekst, kodowanie) - hint to kodowanie zapamiętane dla pliku przy poprzednim przetworzeniu
+
+        Końce wierszy jak przy open() w trybie tekstowym (\\r\\n i \\r zamieniane na \\n).
+        """
+        text, encoding = self._decode(raw, directory, hint, errors)
+        if '\r' in text:
+            text = text.replace('\r\n', '\n').replace('\r', '\n')
+        return text, encoding
+
+    def _decode(self, raw: bytes, directory: str, hint: Optional[str], errors: str) -> Tuple[str, str]:
+        declared = declared_encoding(raw)
+        hint = normalize_encoding(hint)
+
+        if declared == 'utf-8':
+            # Deklaracja UTF-8 bywa nieprawdziwa (plik zapisany w cp1250) - sprawdź
+            text = self._strict_utf8(raw)
+            if text is not None:
+                return self._result('declared', directory, declared, text)
+        elif declared is not None:
+            return self._result('declared', directory, declared, raw.decode(declared, errors=errors))
+
+        # Poprawne UTF-8 przed zapamiętanym kodowaniem - plik cp1250 mógł zostać zapisany ponownie jako UTF-8
+        text = self._strict_utf8(raw)
+        if text is not None:
+            if text.isascii():
+                # Czysty ASCII nic nie mówi o kodowaniu katalogu
+                if hint is not None:
+                    self._count('cached')
+                    return text, hint
+                self._count('ascii')
+                return text, self.directory_default(directory) or 'utf-8'
+            return self._result('utf8', directory, 'utf-8', text)
+
+        if hint is not None and hint != 'utf-8':
+            return self._result('cached', directory, hint, raw.decode(hint, errors=errors))
+
+        learned = self.directory_default(directory)
+        if learned is not None and learned != 'utf-8':
+            learned = self._single_byte(raw, learned)
+            self._count('directory')
+            return raw.decode(learned, errors=errors), learned
+
+        encoding = self._single_byte(raw, self._guess(raw))
+        return self._result('chardet' if CHARDET_AVAILABLE else 'default', directory, encoding,
+                            raw.decode(encoding, errors=errors))
+
+    def detect(self, raw: bytes, directory: str = '', hint: Optional[str] = None) -> str:
+        return self.decode(raw, directory, hint)[1]
+
+    def directory_default(self, directory: str) -> Optional[str]:
+        with self._lock:
+            counts = self._directories.get(directory)
+            if not counts or sum(counts.values()) < self.MIN_OBSERVATIONS:
+                return None
+            return counts.most_common(1)[0][0]
+
+    def get_stats(self) -> Dict[str, object]:
+        with self._lock:
+            sources = dict(self.sources)
+            learned = {
+                directory: counts.most_common(1)[0][0]
+                for directory, counts in self._directories.items()
+                if sum(counts.values()) >= self.MIN_OBSERVATIONS
+            }
+        return {'sources': sources, 'directory_defaults': learned}
+
+    def _count(self, source: str):
+        with self._lock:
+            self.sources[source] += 1
+
+    def _result(self, source: str, directory: str, encoding: str, text: str) -> Tuple[str, str]:
+        with self._lock:
+            self.sources[source] += 1
+            if source != 'cached':
+                self._directories.setdefault(directory, Counter())[encoding] += 1
+        return text, encoding
+
+    @staticmethod
+    def _strict_utf8(raw: bytes) -> Optional[str]:
+        try:
+            return raw.decode('utf-8')
+        except UnicodeDecodeError:
+            return None
+
+    def _single_byte(self, raw: bytes, encoding: str) -> str:
+        """Zgadnięte ISO-8859-x/Latin-1 z bajtami C1 zamieniane na kodowanie domyślne (cp1250)"""
+        if encoding.startswith(('iso8859', 'latin')) and _C1_BYTES.search(raw):
+            return self.default_encoding
+        return encoding
+
+    def _guess(self, raw: bytes) -> str:
+        if CHARDET_AVAILABLE:
+            detected = chardet.detect(raw[:_CHARDET_SAMPLE])
+            encoding = normalize_encoding(detected.get('encoding'))
+            if encoding is not None:
+                return encoding
+        return self.default_encoding
@@ -0,0 +1,210 @@
+"""
+Wyszukiwanie plików dokumentacji: jeden przebieg os.scandir na katalog główny
+Dane stat z DirEntry są przekazywane dalej (sprawdzenie cache'u nie robi ponownie stat),
+a opcjonalny watcher inotify pozwala pominąć ponowne skanowanie, gdy nic się nie zmieniło
+"""
+
+import os
+import ctypes
+import ctypes.util
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Iterable, NamedTuple
+
+logger = logging.getLogger(__name__)
+
+# inotify (Linux) przez libc - bez dodatkowych zależności; gdzie indziej każde skanowanie jest pełne
+try:
+    _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    _libc.inotify_init1.argtypes = [ctypes.c_int]
+    _libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    INOTIFY_AVAILABLE = True
+except (OSError, AttributeError):
+    INOTIFY_AVAILABLE = False
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_ONLYDIR = 0x01000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = os.O_CLOEXEC
+_WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE |
+               IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+
+class DiscoveredFile(NamedTuple):
+    """Plik znaleziony podczas skanowania wraz z wynikiem stat"""
+    path: str
+    stat: os.stat_result
+
+class DirectoryWatcher:
+    """Obserwacja katalogów przez inotify - informuje, czy od ostatniego sprawdzenia coś się zmieniło"""
+
+    def __init__(self):
+        self.fd = _libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 nie powiodło się")
+        self._watched: Dict[str, int] = {}
+        self._changed = True
+
+    def watch(self, directory: str):
+        if directory in self._watched:
+            return
+        wd = _libc.inotify_add_watch(self.fd, os.fsencode(directory), _WATCH_MASK)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch nie powiodło się: {directory}")
+        self._watched[directory] = wd
+
+    def has_changes(self) -> bool:
+        """Odczytuje zaległe zdarzenia - True gdy od ostatniego reset() cokolwiek się zmieniło"""
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+            if not data:
+                break
+            # Każde zdarzenie (także przepełnienie kolejki) oznacza konieczność ponownego skanowania
+            self._changed = True
+        return self._changed
+
+    def reset(self):
+        self._changed = False
+
+    @property
+    def num_watches(self) -> int:
+        return len(self._watched)
+
+    def close(self):
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+        self._watched.clear()
+
+class FileDiscovery:
+    """Jedno przejście os.scandir na katalog główny, katalogi główne skanowane równolegle
+
+    extensions dotyczą plików leżących bezpośrednio w katalogu głównym, recursive_extensions
+    plików na dowolnej głębokości. Rozszerzenia porównywane są bez względu na wielkość liter,
+    dowiązania do katalogów nie są odwiedzane. Ten sam plik osiągalny z kilku katalogów
+    głównych (st_dev, st_ino) występuje w wyniku raz.
+    """
+
+    def __init__(self, roots: Iterable, extensions: Iterable[str] = (),
+                 recursive_extensions: Iterable[str] = (), watch: bool = False,
+                 max_workers: Optional[int] = None):
+        self.roots = [os.fspath(root) for root in roots]
+        self.extensions = frozenset(ext.lower() for ext in extensions)
+        self.recursive_extensions = frozenset(ext.lower() for ext in recursive_extensions)
+        self._root_extensions = self.extensions | self.recursive_extensions
+        self.max_workers = max_workers
+
+        self.watcher: Optional[DirectoryWatcher] = None
+        if watch and INOTIFY_AVAILABLE:
+            try:
+                self.watcher = DirectoryWatcher()
+            except OSError as e:
+                logger.warning(f"⚠️ Obserwacja katalogów niedostępna: {e}")
+        self._last_result: Optional[List[DiscoveredFile]] = None
+        self._lock = threading.Lock()
+        self._watch_lock = threading.Lock()
+        self.scans = 0
+        self.skipped_scans = 0
+
+    def scan(self, force: bool = False) -> List[DiscoveredFile]:
+        """Pliki ze wszystkich katalogów głównych, posortowane według ścieżki"""
+        with self._lock:
+            if (not force and self._last_result is not None and self.watcher is not None
+                    and not self.watcher.has_changes()):
+                self.skipped_scans += 1
+                return list(self._last_result)
+
+            if self.watcher is not None:
+                # Zdarzenia sprzed skanowania są już uwzględnione w jego wyniku
+                self.watcher.has_changes()
+                self.watcher.reset()
+
+            roots = [root for root in self.roots if os.path.isdir(root)]
+            for root in self.roots:
+                if root not in roots:
+                    logger.warning(f"Folder dokumentacji nie istnieje: {root}")
+
+            if len(roots) > 1:
+                with ThreadPoolExecutor(max_workers=self.max_workers or len(roots),
+                                        thread_name_prefix='discovery') as executor:
+                    per_root = list(executor.map(self._scan_root, roots))
+            else:
+                per_root = [self._scan_root(root) for root in roots]
+
+            seen = set()
+            result = []
+            for files in per_root:
+                for discovered in files:
+                    identity = (discovered.stat.st_dev, discovered.stat.st_ino)
+                    if identity not in seen:
+                        seen.add(identity)
+                        result.append(discovered)
+
+            result.sort(key=lambda discovered: discovered.path.split(os.sep))
+            self._last_result = result
+            self.scans += 1
+            return list(result)
+
+    def _scan_root(self, root: str) -> List[DiscoveredFile]:
+        files: List[DiscoveredFile] = []
+        self._walk(root, 0, files)
+        return files
+
+    def _walk(self, directory: str, depth: int, files: List[DiscoveredFile]):
+        # Obserwacja przed odczytem - zmiana w trakcie skanowania wymusi kolejne skanowanie
+        self._watch(directory)
+        wanted = self._root_extensions if depth == 0 else self.recursive_extensions
+        subdirectories = []
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    try:
+                        if entry.is_dir(follow_symlinks=False):
+                            if self.recursive_extensions:
+                                subdirectories.append(entry.path)
+                        elif os.path.splitext(entry.name)[1].lower() in wanted and entry.is_file():
+                            files.append(DiscoveredFile(entry.path, entry.stat()))
+                    except OSError as e:
+                        logger.warning(f"Pominięto {entry.path}: {e}")
+        except OSError as e:
+            logger.warning(f"Nie można odczytać katalogu {directory}: {e}")
+            return
+
+        for subdirectory in subdirectories:
+            self._walk(subdirectory, depth + 1, files)
+
+    def _watch(self, directory: str):
+        """Dodaje katalog do obserwacji - inotify nie obserwuje podkatalogów rekurencyjnie"""
+        with self._watch_lock:
+            if self.watcher is None:
+                return
+            try:
+                self.watcher.watch(directory)
+            except OSError as e:
+                # Np. przekroczony fs.inotify.max_user_watches - wracamy do pełnego skanowania
+                logger.warning(f"⚠️ Obserwacja katalogów wyłączona: {e}")
+                self.watcher.close()
+                self.watcher = None
+
+    def get_stats(self) -> Dict[str, int]:
+        return {
+            'roots': len(self.roots),
+            'scans': self.scans,
+            'skipped_scans': self.skipped_scans,
+            'watched_directories': self.watcher.num_watches if self.watcher else 0
+        }
+
+    def close(self):
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher = None
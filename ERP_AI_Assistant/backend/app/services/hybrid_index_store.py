@@ -0,0 +1,172 @@
+"""
+Trwały indeks dla HybridSearchEngine
+Wersjonowany format na dysku: znormalizowane embeddingi (.npy, mmap), bitmapa tombstone, postings BM25 (CSR),
+słownik (pickle), struktura i kalibracja indeksu ANN oraz manifest
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import logging
+import numpy as np
+from typing import Dict, Any, Optional, List, Tuple
+from dataclasses import dataclass, asdict, field
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+# Zmiana formatu plików wymaga podbicia wersji - stary indeks zostanie przebudowany
+INDEX_FORMAT_VERSION = 5
+MANIFEST_FILE = "manifest.json"
+
+# ============================================================================
+# MANIFEST
+# ============================================================================
+
+@dataclass
+class IndexManifest:
+    """Manifest indeksu zapisanego na dysku"""
+    format_version: int
+    corpus_hash: str
+    model_name: str
+    num_documents: int
+    arrays: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    objects: List[str] = field(default_factory=list)
+    created_at: str = field(default_factory=lambda: datetime.now().isoformat())
+
+
+def compute_corpus_hash(documents: List[str], metadatas: Optional[List[Dict]] = None,
+                        model_name: str = "") -> str:
+    """Hash zawartości korpusu - klucz ważności indeksu"""
+    hasher = hashlib.sha1()
+    hasher.update(f"v{INDEX_FORMAT_VERSION}|{model_name}|{len(documents)}".encode('utf-8'))
+
+    for doc in documents:
+        data = doc.encode('utf-8', errors='ignore')
+        # Prefiks długości - ["ab", "c"] i ["a", "bc"] dają różne hashe
+        hasher.update(len(data).to_bytes(8, 'little'))
+        hasher.update(data)
+
+    if metadatas:
+        for metadata in metadatas:
+            hasher.update(json.dumps(metadata, sort_keys=True, default=str).encode('utf-8'))
+
+    return hasher.hexdigest()
+
+# ============================================================================
+# INDEX STORE
+# ============================================================================
+
+class HybridIndexStore:
+    """Zapis i odczyt indeksu hybrydowego z katalogu na dysku"""
+
+    def __init__(self, index_dir: str, embedding_dtype: str = "float16"):
+        if embedding_dtype not in ("float16", "float32"):
+            raise ValueError(f"Nieobsługiwany typ embeddingów: {embedding_dtype}")
+
+        self.index_dir = index_dir
+        self.embedding_dtype = embedding_dtype
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.index_dir, MANIFEST_FILE)
+
+    def read_manifest(self) -> Optional[IndexManifest]:
+        """Czyta manifest - None gdy brak indeksu lub jest uszkodzony"""
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            return IndexManifest(**data)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Nie można odczytać manifestu indeksu {self.manifest_path}: {e}")
+            return None
+
+    def is_valid_for(self, corpus_hash: str) -> bool:
+        """Sprawdza czy indeks na dysku odpowiada korpusowi"""
+        manifest = self.read_manifest()
+        return (manifest is not None
+                and manifest.format_version == INDEX_FORMAT_VERSION
+                and manifest.corpus_hash == corpus_hash)
+
+    def save(self, corpus_hash: str, model_name: str, num_documents: int,
+             arrays: Dict[str, np.ndarray], objects: Dict[str, Any]) -> IndexManifest:
+        """Zapisuje indeks - manifest zapisywany na końcu jako punkt zatwierdzenia"""
+        os.makedirs(self.index_dir, exist_ok=True)
+
+        # Usuń stary manifest - przerwany zapis nie zostawi "ważnego" indeksu
+        if os.path.exists(self.manifest_path):
+            os.remove(self.manifest_path)
+
+        manifest = IndexManifest(
+            format_version=INDEX_FORMAT_VERSION,
+            corpus_hash=corpus_hash,
+            model_name=model_name,
+            num_documents=num_documents
+        )
+
+        for name, array in arrays.items():
+            if name == 'embeddings':
+                array = np.ascontiguousarray(array, dtype=self.embedding_dtype)
+            self._atomic_write(f"{name}.npy", lambda f, a=array: np.save(f, a, allow_pickle=False))
+            manifest.arrays[name] = {'dtype': str(array.dtype), 'shape': list(array.shape)}
+
+        for name, obj in objects.items():
+            self._atomic_write(f"{name}.pkl",
+                               lambda f, o=obj: pickle.dump(o, f, protocol=pickle.HIGHEST_PROTOCOL))
+            manifest.objects.append(name)
+
+        manifest_bytes = json.dumps(asdict(manifest), indent=2, ensure_ascii=False).encode('utf-8')
+        self._atomic_write(MANIFEST_FILE, lambda f: f.write(manifest_bytes))
+
+        logger.info(f"💾 Indeks zapisany w {self.index_dir} ({num_documents} dokumentów)")
+        return manifest
+
+    def load(self, mmap: bool = True) -> Tuple[IndexManifest, Dict[str, np.ndarray], Dict[str, Any]]:
+        """Ładuje indeks - tablice jako memory-mapped (tylko do odczytu)"""
+        manifest = self.read_manifest()
+        if manifest is None:
+            raise FileNotFoundError(f"Brak indeksu w {self.index_dir}")
+        if manifest.format_version != INDEX_FORMAT_VERSION:
+            raise ValueError(f"Nieaktualna wersja formatu indeksu: {manifest.format_version}")
+
+        arrays = {}
+        for name, info in manifest.arrays.items():
+            array = np.load(os.path.join(self.index_dir, f"{name}.npy"),
+                            mmap_mode='r' if mmap else None, allow_pickle=False)
+            if list(array.shape) != info['shape']:
+                raise ValueError(f"Niezgodny kształt tablicy {name}: {array.shape} != {info['shape']}")
+            arrays[name] = array
+
+        objects = {}
+        for name in manifest.objects:
+            # Pliki pickle pochodzą wyłącznie z naszego własnego katalogu indeksu
+            with open(os.path.join(self.index_dir, f"{name}.pkl"), 'rb') as f:
+                objects[name] = pickle.load(f)
+
+        return manifest, arrays, objects
+
+    def clear(self):
+        """Usuwa indeks z dysku"""
+        if not os.path.isdir(self.index_dir):
+            return
+        for file_name in os.listdir(self.index_dir):
+            if file_name == MANIFEST_FILE or file_name.endswith(('.npy', '.pkl', '.tmp')):
+                os.remove(os.path.join(self.index_dir, file_name))
+        logger.info(f"🗑️ Indeks usunięty z {self.index_dir}")
+
+    def _atomic_write(self, file_name: str, writer):
+        """Zapis przez plik tymczasowy + os.replace"""
+        target_path = os.path.join(self.index_dir, file_name)
+        tmp_path = f"{target_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'wb') as f:
+                writer(f)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, target_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
@@ -0,0 +1,125 @@
+"""
+Cache wyników zapytań SQL: LRU z unieważnianiem po tagach (nazwach tabel)
+Klucz to znormalizowany tekst zapytania (sqlparse) z literałami wyniesionymi jako parametry
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Iterable, Optional, Set, Tuple
+
+from sqlparse import parse as sql_parse
+from sqlparse import tokens as T
+
+logger = logging.getLogger(__name__)
+
+SQLCacheKey = Tuple[str, Tuple[str, ...]]
+
+def normalize_sql(query: str) -> SQLCacheKey:
+    """(szablon, literały) - szablon to tokeny bez białych znaków i komentarzy połączone
+    pojedynczą spacją, ze słowami kluczowymi wielkimi literami i '?' w miejscu literałów
+
+    Literały zostają w kluczu, bo od nich zależy wynik: "WHERE id = 1" i "where id=1 -- x"
+    dają ten sam klucz, "WHERE id = 2" już inny. Nazwy kolumn i tabel nie są zmieniane.
+    """
+    parts = []
+    params = []
+    for statement in sql_parse(query):
+        for token in statement.flatten():
+            ttype = token.ttype
+            if ttype in T.Comment or ttype in T.Whitespace or ttype in T.Newline:
+                continue
+            if ttype in T.Number or ttype in T.String.Single:
+                parts.append('?')
+                params.append(token.value)
+            elif token.is_keyword:
+                parts.append(token.normalized)
+            else:
+                parts.append(token.value)
+
+    # Średnik na końcu nie zmienia wyniku
+    while parts and parts[-1] == ';':
+        parts.pop()
+    return ' '.join(parts), tuple(params)
+
+class TaggedLRUCache:
+    """LRU o stałej liczbie wpisów; wpis może mieć tagi (np. tabele), po których jest unieważniany
+
+    max_entries <= 0 wyłącza cache. Bezpieczne dla wielu wątków.
+    """
+
+    def __init__(self, max_entries: int = 128):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Hashable, Tuple[Any, frozenset]]" = OrderedDict()
+        self._by_tag: Dict[str, Set[Hashable]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def get(self, key: Hashable) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key: Hashable, value: Any, tags: Iterable[str] = ()):
+        if not self.enabled:
+            return
+        tags = frozenset(tag.lower() for tag in tags)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, tags)
+            for tag in tags:
+                self._by_tag.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, tags: Iterable[str]) -> int:
+        """Usuwa wpisy oznaczone którymkolwiek z tagów - zwraca liczbę usuniętych"""
+        removed = 0
+        with self._lock:
+            for tag in {tag.lower() for tag in tags}:
+                for key in list(self._by_tag.get(tag, ())):
+                    self._remove(key)
+                    removed += 1
+            self.invalidations += removed
+        return removed
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_tag.clear()
+
+    def _remove(self, key: Hashable):
+        _, tags = self._entries.pop(key)
+        for tag in tags:
+            keys = self._by_tag.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_tag[tag]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
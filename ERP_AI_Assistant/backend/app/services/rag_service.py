@@ -8,6 +8,7 @@ import os
 import re
 import json
 import logging
+import threading
 import numpy as np
 from typing import Dict, Any, Optional, List, Tuple
 from dataclasses import dataclass, field
@@ -18,9 +19,13 @@ import math
 # NLP & ML
 from sentence_transformers import SentenceTransformer, CrossEncoder
 import anthropic
-from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 
+from .hybrid_index_store import HybridIndexStore, compute_corpus_hash
+from .ann_index import VectorIndex, create_ann_index, normalize_rows, top_k_indices
+from .bm25_index import BM25Index
+from .embedding_store import EmbeddingStore, get_embedding_store, cached_encode
+
 # Dodatkowe biblioteki dla NLP
 try:
     import spacy
@@ -91,42 +96,342 @@ class AdvancedResponse:
 class HybridSearchEngine:
     """Silnik hybrydowego wyszukiwania (Semantic + BM25)"""
     
-    def __init__(self, sentence_model: SentenceTransformer):
+    def __init__(self, sentence_model: SentenceTransformer, index_dir: Optional[str] = None,
+                 model_name: str = "", embedding_dtype: str = "float16",
+                 compaction_threshold: float = 0.2, ann_backend: str = "exact",
+                 ann_recall_target: float = 0.95, ann_min_documents: int = 20000,
+                 ann_candidate_factor: int = 4, bm25_k1: float = 1.2, bm25_b: float = 0.75,
+                 embedding_store: Optional[EmbeddingStore] = None):
         self.sentence_model = sentence_model
-        self.tfidf_vectorizer = TfidfVectorizer(
-            max_features=10000,
-            stop_words=None,  # Zachowujemy polskie słowa kluczowe
-            ngram_range=(1, 2),
-            min_df=2
-        )
+        # Wspólny magazyn embeddingów - niezmienione fragmenty nie trafiają ponownie do enkodera
+        self.embedding_store = embedding_store
         self.document_embeddings = None
         self.documents = []
         self.metadatas = []
-        self.tfidf_matrix = None
+        self.doc_ids = []
         self.is_fitted = False
         
+        # Indeks leksykalny BM25 (indeks odwrócony). Usunięte dokumenty zostają
+        # w postings do kompaktowania - jak w Lucene, liczą się do df.
+        self.bm25_k1 = bm25_k1
+        self.bm25_b = bm25_b
+        self.bm25_index = BM25Index(bm25_k1, bm25_b)
+        
+        # Tombstone bitmap - usunięte wiersze są pomijane do czasu kompaktowania
+        self.deleted = np.zeros(0, dtype=bool)
+        self._id_to_row: Dict[str, int] = {}
+        self.compaction_threshold = compaction_threshold
+        self._lock = threading.RLock()
+        self._maintenance_thread: Optional[threading.Thread] = None
+        self._maintenance_pending = False
+        # Zwiększane przez fit() - kompaktowanie w tle porzuca wynik zbudowany dla starego korpusu
+        self._generation = 0
+        
+        # Warstwa ANN dla embeddingów (exact / hnsw / ivfpq / ivf / auto)
+        self.ann_backend = ann_backend
+        self.ann_recall_target = ann_recall_target
+        self.ann_min_documents = ann_min_documents
+        self.ann_candidate_factor = ann_candidate_factor
+        self.ann_index: Optional[VectorIndex] = None
+        
+        # Trwały indeks na dysku (opcjonalny)
+        self.model_name = model_name
+        self.index_store = HybridIndexStore(index_dir, embedding_dtype) if index_dir else None
+        self.loaded_from_disk = False
+        
         # Polskie stop words dla ERP
         self.erp_stop_words = {
             'system', 'moduł', 'funkcja', 'opcja', 'parametr', 'pole', 
             'wartość', 'dane', 'informacje', 'element', 'część'
         }
     
-    def fit(self, documents: List[str], metadatas: List[Dict]):
-        """Trenuje modele na korpusie dokumentów"""
-        logger.info(f"🔄 Trenowanie modeli wyszukiwania na {len(documents)} dokumentach...")
+    def fit(self, documents: List[str], metadatas: List[Dict], ids: Optional[List[str]] = None,
+            force_refit: bool = False):
+        """Trenuje modele na korpusie dokumentów (lub ładuje indeks z dysku gdy korpus się nie zmienił)"""
+        with self._lock:
+            self.documents = list(documents)
+            self.metadatas = list(metadatas)
+            self.doc_ids = self._resolve_ids(ids, metadatas, start=0)
+            self._id_to_row = {doc_id: row for row, doc_id in enumerate(self.doc_ids)}
+            self.deleted = np.zeros(len(documents), dtype=bool)
+            self.ann_index = None
+            self.loaded_from_disk = False
+            self._generation += 1
+            
+            corpus_hash = None
+            if self.index_store:
+                corpus_hash = compute_corpus_hash(documents, metadatas, self.model_name)
+                if not force_refit and self._load_index(corpus_hash):
+                    self.is_fitted = True
+                    self.loaded_from_disk = True
+                    logger.info(f"✅ Indeks wyszukiwania załadowany z dysku ({len(documents)} dokumentów)")
+                    return
+            
+            logger.info(f"🔄 Trenowanie modeli wyszukiwania na {len(documents)} dokumentach...")
+            
+            # Wygeneruj embeddingi semantyczne - normalizowane raz, zapisywane już znormalizowane
+            self.document_embeddings = normalize_rows(
+                cached_encode(documents, self.sentence_model.encode, self.embedding_store)
+            )
+            
+            # Zbuduj indeks odwrócony BM25
+            self.bm25_index = BM25Index(self.bm25_k1, self.bm25_b)
+            self.bm25_index.add([self._tokenize_for_bm25(doc) for doc in documents])
+            
+            self._build_ann_index()
+            self.is_fitted = True
+            logger.info("✅ Modele wyszukiwania wytrenowane")
+            
+            if self.index_store:
+                self._save_index(corpus_hash, self._snapshot())
+    
+    def add_documents(self, documents: List[str], metadatas: List[Dict],
+                      ids: Optional[List[str]] = None) -> List[str]:
+        """Dodaje dokumenty do indeksu bez pełnego trenowania (istniejące id są zastępowane)"""
+        if not self.is_fitted:
+            raise ValueError("Model nie został wytrenowany - wywołaj fit() najpierw")
+        if not documents:
+            return []
         
-        self.documents = documents
-        self.metadatas = metadatas
+        # Kodowanie poza blokadą - wyszukiwanie działa w tym czasie normalnie
+        new_embeddings = cached_encode(documents, self.sentence_model.encode, self.embedding_store)
+        tokenized_docs = [self._tokenize_for_bm25(doc) for doc in documents]
         
-        # Wygeneruj embeddingi semantyczne
-        self.document_embeddings = self.sentence_model.encode(documents)
+        with self._lock:
+            new_ids = self._resolve_ids(ids, metadatas, start=len(self.doc_ids))
+            self._tombstone([doc_id for doc_id in new_ids if doc_id in self._id_to_row])
+            
+            start_row = self.bm25_index.add(tokenized_docs)
+            
+            # Macierz embeddingów jest wspólna z indeksem ANN
+            self.ann_index.add(new_embeddings)
+            self.document_embeddings = self.ann_index.vectors
+            
+            self.documents.extend(documents)
+            self.metadatas.extend(metadatas)
+            self.doc_ids.extend(new_ids)
+            for offset, doc_id in enumerate(new_ids):
+                self._id_to_row[doc_id] = start_row + offset
+            self.deleted = np.concatenate([self.deleted, np.zeros(len(documents), dtype=bool)])
+            
+            logger.info(f"➕ Dodano {len(documents)} dokumentów do indeksu wyszukiwania")
+        
+        self._schedule_maintenance()
+        return new_ids
+    
+    def remove_documents(self, ids: List[str]) -> int:
+        """Oznacza dokumenty jako usunięte (tombstone) - fizyczne usunięcie przy kompaktowaniu"""
+        with self._lock:
+            removed = self._tombstone(ids)
+            if removed:
+                logger.info(f"➖ Usunięto {removed} dokumentów z indeksu wyszukiwania")
+        
+        if removed:
+            self._schedule_maintenance()
+        return removed
+    
+    def compact(self):
+        """Fizycznie usuwa wiersze oznaczone tombstone i przenumerowuje indeks
+        
+        Nowe embeddingi, BM25 i indeks ANN budowane są poza blokadą (wyszukiwanie działa dalej),
+        a podmieniane pod blokadą; wiersze dodane i usunięte w międzyczasie są przenoszone.
+        """
+        with self._lock:
+            if not self.deleted.any():
+                return
+            generation = self._generation
+            deleted = self.deleted.copy()
+            embeddings = self.document_embeddings
+            bm25_arrays = self.bm25_index.to_arrays()
+            bm25_terms = list(self.bm25_index.terms)
+        
+        live_rows = np.flatnonzero(~deleted)
+        live_embeddings = np.asarray(embeddings)[live_rows]
+        bm25_index = BM25Index.from_arrays(bm25_arrays, bm25_terms, self.bm25_k1, self.bm25_b).compacted(~deleted)
+        ann_index = self._create_ann_index(live_embeddings)
+        
+        with self._lock:
+            if generation != self._generation:
+                return
+            
+            # Wiersze dopisane po rozpoczęciu kompaktowania zostają na końcu
+            num_rows = len(self.deleted)
+            keep = np.concatenate([~deleted, np.ones(num_rows - len(deleted), dtype=bool)])
+            if num_rows > len(deleted):
+                bm25_index = self.bm25_index.compacted(keep)
+                ann_index.add(np.asarray(self.document_embeddings[len(deleted):]))
+            
+            removed = int((~keep).sum())
+            self.document_embeddings = ann_index.vectors
+            self.bm25_index = bm25_index
+            self.ann_index = ann_index
+            self.documents = [self.documents[row] for row in np.flatnonzero(keep)]
+            self.metadatas = [self.metadatas[row] for row in np.flatnonzero(keep)]
+            self.doc_ids = [self.doc_ids[row] for row in np.flatnonzero(keep)]
+            # Tombstone ustawione w trakcie kompaktowania zostają do następnego
+            self.deleted = self.deleted[keep]
+            self._id_to_row = {doc_id: row for row, doc_id in enumerate(self.doc_ids) if not self.deleted[row]}
+            
+            logger.info(f"🧹 Kompaktowanie indeksu: usunięto {removed} wierszy")
+    
+    def save_index(self):
+        """Zapisuje aktualny stan indeksu na dysk - razem z tombstone, bez kompaktowania"""
+        if not self.index_store or not self.is_fitted:
+            return
+        with self._lock:
+            snapshot = self._snapshot()
+        corpus_hash = compute_corpus_hash(snapshot['documents'], snapshot['metadatas'], self.model_name)
+        self._save_index(corpus_hash, snapshot)
+    
+    def wait_for_maintenance(self, timeout: Optional[float] = None):
+        """Czeka na zakończenie zadań w tle (kompaktowanie, zapis)"""
+        thread = self._maintenance_thread
+        if thread:
+            thread.join(timeout)
+    
+    def _schedule_maintenance(self):
+        """Uruchamia kompaktowanie i zapis indeksu w wątku w tle"""
+        with self._lock:
+            self._maintenance_pending = True
+            if self._maintenance_thread and self._maintenance_thread.is_alive():
+                return
+            self._maintenance_thread = threading.Thread(
+                target=self._maintenance_loop, name="hybrid-index-maintenance", daemon=True
+            )
+            self._maintenance_thread.start()
+    
+    def _maintenance_loop(self):
+        """Pętla zadań w tle - łączy kolejne aktualizacje w jeden zapis"""
+        while True:
+            with self._lock:
+                if not self._maintenance_pending:
+                    self._maintenance_thread = None
+                    return
+                self._maintenance_pending = False
+                needs_compaction = len(self.deleted) and self.deleted.mean() > self.compaction_threshold
+            
+            try:
+                if needs_compaction:
+                    self.compact()
+                if self.index_store:
+                    self.save_index()
+            except Exception as e:
+                logger.error(f"❌ Błąd zadania w tle indeksu wyszukiwania: {e}")
+    
+    def _resolve_ids(self, ids: Optional[List[str]], metadatas: List[Dict], start: int) -> List[str]:
+        """Identyfikatory dokumentów - jawne, z metadanych albo wygenerowane"""
+        if ids is not None:
+            if len(ids) != len(metadatas):
+                raise ValueError("Liczba identyfikatorów musi odpowiadać liczbie dokumentów")
+            return [str(doc_id) for doc_id in ids]
+        
+        resolved = []
+        for offset, metadata in enumerate(metadatas):
+            doc_id = metadata.get('id')
+            if doc_id is None:
+                doc_id = f"{metadata.get('source', 'doc')}_chunk_{metadata.get('chunk_id', start + offset)}"
+            resolved.append(str(doc_id))
+        return resolved
+    
+    def _tombstone(self, ids: List[str]) -> int:
+        """Oznacza wiersze jako usunięte"""
+        removed = 0
+        for doc_id in ids:
+            row = self._id_to_row.pop(str(doc_id), None)
+            if row is None or self.deleted[row]:
+                continue
+            self.deleted[row] = True
+            removed += 1
+        return removed
+    
+    def _build_ann_index(self):
+        self.ann_index = self._create_ann_index(self.document_embeddings)
+    
+    def _new_ann_index(self, num_documents: int) -> VectorIndex:
+        return create_ann_index(
+            self.ann_backend, self.ann_recall_target,
+            num_documents=num_documents, min_documents=self.ann_min_documents
+        )
+    
+    def _create_ann_index(self, embeddings: np.ndarray) -> VectorIndex:
+        """Buduje indeks ANN ze znormalizowanych embeddingów i kalibruje go do docelowego recall"""
+        ann_index = self._new_ann_index(len(embeddings))
+        ann_index.build(embeddings, normalized=True)
+        ann_index.calibrate()
+        return ann_index
+    
+    def _snapshot(self) -> Dict[str, Any]:
+        """Spójny stan indeksu do zapisu - wywoływać pod blokadą
         
-        # Wytrenuj TF-IDF
-        processed_docs = [self._preprocess_for_bm25(doc) for doc in documents]
-        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(processed_docs)
+        Embeddingi są podmieniane (nie modyfikowane w miejscu), więc wystarczy referencja;
+        bitmapa tombstone i postings BM25 zmieniają się w miejscu - są kopiowane.
+        """
+        live_rows = np.flatnonzero(~self.deleted)
+        return {
+            'documents': [self.documents[row] for row in live_rows],
+            'metadatas': [self.metadatas[row] for row in live_rows],
+            'doc_ids': list(self.doc_ids),
+            'deleted': self.deleted.copy(),
+            'embeddings': self.document_embeddings,
+            'bm25_arrays': self.bm25_index.to_arrays(),
+            'bm25_terms': list(self.bm25_index.terms),
+            'ann_state': self.ann_index.get_state()
+        }
+    
+    def _load_index(self, corpus_hash: str) -> bool:
+        """Ładuje indeks z dysku jeśli odpowiada korpusowi"""
+        if not self.index_store.is_valid_for(corpus_hash):
+            return False
         
-        self.is_fitted = True
-        logger.info("✅ Modele wyszukiwania wytrenowane")
+        try:
+            manifest, arrays, objects = self.index_store.load(mmap=True)
+            
+            # Indeks zapisany z tombstone: wiersze usunięte są na dysku, korpus zawiera tylko żywe
+            deleted = np.array(arrays['deleted'], dtype=bool)
+            live_rows = np.flatnonzero(~deleted)
+            if manifest.num_documents != len(self.documents) or len(live_rows) != len(self.documents):
+                logger.warning("Liczba dokumentów w indeksie nie zgadza się z korpusem - przebudowa")
+                return False
+            
+            documents = [""] * len(deleted)
+            metadatas: List[Dict] = [{} for _ in range(len(deleted))]
+            for position, row in enumerate(live_rows):
+                documents[row] = self.documents[position]
+                metadatas[row] = self.metadatas[position]
+            
+            self.documents = documents
+            self.metadatas = metadatas
+            self.deleted = deleted
+            self.document_embeddings = arrays['embeddings']
+            self.bm25_index = BM25Index.from_arrays(arrays, objects['bm25_terms'], self.bm25_k1, self.bm25_b)
+            self.doc_ids = list(objects['doc_ids'])
+            self._id_to_row = {self.doc_ids[row]: row for row in live_rows}
+            
+            # Struktura ANN i kalibracja z dysku; przebudowa tylko po zmianie backendu lub celu recall
+            self.ann_index = self._new_ann_index(len(deleted))
+            if not self.ann_index.restore(self.document_embeddings, objects.get('ann_state'), arrays):
+                self._build_ann_index()
+            return True
+            
+        except Exception as e:
+            logger.warning(f"Nie można załadować indeksu z dysku - przebudowa: {e}")
+            return False
+    
+    def _save_index(self, corpus_hash: str, snapshot: Dict[str, Any]):
+        """Zapisuje stan indeksu na dysk"""
+        try:
+            ann_meta, ann_arrays = snapshot['ann_state']
+            self.index_store.save(
+                corpus_hash=corpus_hash,
+                model_name=self.model_name,
+                num_documents=len(snapshot['documents']),
+                arrays={'embeddings': snapshot['embeddings'], 'deleted': snapshot['deleted'],
+                        **snapshot['bm25_arrays'], **ann_arrays},
+                objects={'bm25_terms': snapshot['bm25_terms'], 'doc_ids': snapshot['doc_ids'],
+                         'ann_state': ann_meta}
+            )
+        except Exception as e:
+            logger.error(f"❌ Błąd zapisu indeksu wyszukiwania: {e}")
     
     def _preprocess_for_bm25(self, text: str) -> str:
         """Przetwarzanie tekstu dla BM25"""
@@ -140,37 +445,64 @@ class HybridSearchEngine:
         
         return ' '.join(filtered_words)
     
+    def _tokenize_for_bm25(self, text: str) -> List[str]:
+        return self._preprocess_for_bm25(text).split()
+    
     def search(self, query: str, top_k: int = 10, alpha: float = 0.7) -> List[SearchResult]:
         """Hybrydowe wyszukiwanie (alpha * semantic + (1-alpha) * BM25)"""
         if not self.is_fitted:
             raise ValueError("Model nie został wytrenowany - wywołaj fit() najpierw")
         
-        # Semantic search
-        query_embedding = self.sentence_model.encode([query])
-        semantic_scores = cosine_similarity(query_embedding, self.document_embeddings)[0]
-        
-        # BM25 search
-        processed_query = self._preprocess_for_bm25(query)
-        query_vector = self.tfidf_vectorizer.transform([processed_query])
-        bm25_scores = cosine_similarity(query_vector, self.tfidf_matrix)[0]
-        
-        # Kombinuj wyniki
-        combined_scores = alpha * semantic_scores + (1 - alpha) * bm25_scores
-        
-        # Sortuj i zwróć top-k
-        top_indices = np.argsort(combined_scores)[::-1][:top_k]
-        
-        results = []
-        for idx in top_indices:
-            results.append(SearchResult(
-                content=self.documents[idx],
-                metadata=self.metadatas[idx],
-                semantic_score=float(semantic_scores[idx]),
-                bm25_score=float(bm25_scores[idx]),
-                combined_score=float(combined_scores[idx]),
-                source=self.metadatas[idx].get('source', 'unknown'),
-                chunk_id=self.metadatas[idx].get('chunk_id', str(idx))
-            ))
+        query_embedding = self.sentence_model.encode([query])[0]
+        query_tokens = self._tokenize_for_bm25(query)
+        
+        with self._lock:
+            live_count = len(self.deleted) - int(self.deleted.sum())
+            top_k = min(top_k, live_count)
+            
+            if self.ann_index.exact:
+                # Semantic search - pełny wektor wyników
+                rows = np.arange(len(self.deleted))
+                semantic_scores = self.ann_index.score_all(query_embedding)
+                
+                # BM25 search - punktowane tylko dokumenty z postings termów zapytania
+                lexical_rows, lexical_scores = self.bm25_index.score(query_tokens, exclude=self.deleted)
+                bm25_scores = np.zeros(len(rows))
+                bm25_scores[lexical_rows] = lexical_scores
+            else:
+                # Kandydaci: sąsiedzi ANN (z zapasem na tombstone) + top-k BM25 (MaxScore)
+                fetch = int(top_k * self.ann_candidate_factor * len(self.deleted) / max(live_count, 1))
+                ann_rows, _ = self.ann_index.search(query_embedding, fetch)
+                lexical_rows, lexical_scores = self.bm25_index.top_k(
+                    query_tokens, top_k * self.ann_candidate_factor, exclude=self.deleted
+                )
+                rows = np.union1d(ann_rows, lexical_rows)
+                semantic_scores = self.ann_index.score_rows(query_embedding, rows)
+                bm25_scores = self.bm25_index.score_rows(query_tokens, rows)
+            
+            # Wyniki BM25 są nieograniczone - normalizacja do [0, 1] najlepszym wynikiem zapytania
+            if len(lexical_scores):
+                bm25_scores = bm25_scores / lexical_scores.max()
+            
+            # Kombinuj wyniki
+            combined_scores = alpha * semantic_scores + (1 - alpha) * bm25_scores
+            combined_scores[self.deleted[rows]] = -np.inf
+            
+            # Top-k przez argpartition
+            top_positions = top_k_indices(combined_scores, top_k)
+            
+            results = []
+            for position in top_positions:
+                idx = rows[position]
+                results.append(SearchResult(
+                    content=self.documents[idx],
+                    metadata=self.metadatas[idx],
+                    semantic_score=float(semantic_scores[position]),
+                    bm25_score=float(bm25_scores[position]),
+                    combined_score=float(combined_scores[position]),
+                    source=self.metadatas[idx].get('source', 'unknown'),
+                    chunk_id=self.metadatas[idx].get('chunk_id', str(idx))
+                ))
         
         return results
 
@@ -941,7 +1273,18 @@ class AdvancedRAGService:
         self.vector_service = vector_service
         
         # Inicjalizuj komponenty
-        self.hybrid_search = HybridSearchEngine(ai_service.sentence_model)
+        self.hybrid_search = HybridSearchEngine(
+            ai_service.sentence_model,
+            index_dir=self._config_value('HYBRID_INDEX_DIR'),
+            model_name=self._config_value('EMBEDDING_MODEL', ''),
+            embedding_dtype=self._config_value('HYBRID_INDEX_DTYPE', 'float16'),
+            ann_backend=self._config_value('ANN_BACKEND', 'exact'),
+            ann_recall_target=float(self._config_value('ANN_RECALL_TARGET', 0.95)),
+            bm25_k1=float(self._config_value('BM25_K1', 1.2)),
+            bm25_b=float(self._config_value('BM25_B', 0.75)),
+            embedding_store=get_embedding_store(self._config_value('EMBEDDING_STORE_DIR'),
+                                                self._config_value('EMBEDDING_MODEL', ''))
+        )
         self.query_processor = AdvancedQueryProcessor(ai_service.claude_client, ai_service.sentence_model)
         self.reranker = ReRankingService(ai_service.claude_client)
         self.context_compressor = ContextCompressor(ai_service.claude_client)
@@ -949,6 +1292,12 @@ class AdvancedRAGService:
         
         self.is_initialized = False
     
+    def _config_value(self, name: str, default: Any = None) -> Any:
+        """Wartość konfiguracji - obsługuje zarówno obiekt Config, jak i słownik"""
+        if isinstance(self.config, dict):
+            return self.config.get(name, default)
+        return getattr(self.config, name, default)
+    
     def initialize_with_documents(self, documents: List[str], metadatas: List[Dict]):
         """Inicjalizuje system z dokumentami"""
         logger.info("🚀 Inicjalizacja zaawansowanego RAG...")
@@ -1013,6 +1362,8 @@ class AdvancedRAGService:
         return {
             "initialized": self.is_initialized,
             "hybrid_search_ready": self.hybrid_search.is_fitted,
+            "hybrid_index_from_disk": self.hybrid_search.loaded_from_disk,
+            "ann_backend": self.hybrid_search.ann_index.backend if self.hybrid_search.ann_index else None,
             "components": {
                 "query_processor": bool(self.query_processor),
                 "reranker": bool(self.reranker),
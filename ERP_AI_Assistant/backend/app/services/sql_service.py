@@ -12,8 +12,8 @@ import sqlite3
 import logging
 import subprocess
 import tempfile
-from typing import Dict, Any, List, Optional, Union
-from dataclasses import dataclass
+from typing import Dict, Any, List, Optional, Union, Tuple
+from dataclasses import dataclass, replace
 from datetime import datetime
 
 # AI & ML
@@ -21,6 +21,9 @@ import anthropic
 from sqlparse import parse as sql_parse
 from sqlparse import format as sql_format
 
+from .sqlite_pool import ReadOnlyConnectionPool
+from .query_cache import TaggedLRUCache, normalize_sql
+
 logger = logging.getLogger(__name__)
 
 @dataclass
@@ -34,6 +37,7 @@ class SQLQueryResult:
     execution_result: Optional[Any] = None
     error_message: Optional[str] = None
     suggestions: List[str] = None
+    truncated: bool = False
     
 @dataclass
 class CodeAnalysisResult:
@@ -57,6 +61,19 @@ class SQLCodeService:
         self.demo_db_path = "demo_erp.db"
         self._setup_demo_database()
         
+        # Zapytania użytkowników na puli połączeń tylko do odczytu; wynik ograniczony do max_rows
+        self.max_rows = int(self._config_value('SQL_MAX_ROWS', 1000))
+        self.fetch_size = int(self._config_value('SQL_FETCH_SIZE', 200))
+        self.pool = ReadOnlyConnectionPool(
+            self.demo_db_path,
+            max_size=int(self._config_value('SQL_POOL_SIZE', 4)),
+            mmap_size=int(self._config_value('SQL_MMAP_SIZE', 64 * 1024 * 1024))
+        )
+        
+        # Cache wyników (unieważniany po tabelach) i osobno wyjaśnień Claude (zależą tylko od tekstu)
+        self.result_cache = TaggedLRUCache(int(self._config_value('SQL_RESULT_CACHE_SIZE', 128)))
+        self.explanation_cache = TaggedLRUCache(int(self._config_value('SQL_EXPLANATION_CACHE_SIZE', 512)))
+        
         # Dozwolone komendy SQL (tylko SELECT dla bezpieczeństwa)
         self.allowed_sql_keywords = {
             'SELECT', 'FROM', 'WHERE', 'GROUP BY', 'ORDER BY', 
@@ -200,9 +217,20 @@ class SQLCodeService:
             INSERT OR REPLACE INTO faktury VALUES (?,?,?,?,?,?,?,?,?)
         ''', faktury_data)
     
+    def _config_value(self, name: str, default: Any = None) -> Any:
+        """Wartość konfiguracji - obsługuje zarówno obiekt Config, jak i słownik"""
+        if isinstance(self.config, dict):
+            return self.config.get(name, default)
+        return getattr(self.config, name, default)
+    
     def analyze_sql_query(self, query: str) -> SQLQueryResult:
         """Analizuje zapytanie SQL"""
         try:
+            cache_key = normalize_sql(query)
+            cached = self.result_cache.get(cache_key)
+            if cached is not None:
+                return self._copy_result(cached, query)
+            
             # Formatowanie SQL
             formatted_query = sql_format(query, reindent=True, keyword_case='upper')
             
@@ -213,23 +241,26 @@ class SQLCodeService:
             is_valid = self._validate_sql_syntax(query)
             
             # Generowanie wyjaśnienia przez AI
-            explanation = self._generate_sql_explanation(query)
+            explanation, explained = self._generate_sql_explanation(query, cache_key)
             
             # Wykonanie zapytania jeśli bezpieczne
             execution_result = None
             error_message = None
+            truncated = False
             
             if is_safe and is_valid:
                 try:
-                    execution_result = self._execute_sql_query(query)
+                    execution_result, truncated = self._fetch_rows(query)
                 except Exception as e:
                     error_message = str(e)
                     is_valid = False
             
             # Generowanie sugestii
             suggestions = self._generate_sql_suggestions(query, execution_result)
+            if truncated:
+                suggestions.insert(0, f"⚠️ Wynik obcięty do {self.max_rows} rekordów - dodaj LIMIT lub warunki WHERE")
             
-            return SQLQueryResult(
+            result = SQLQueryResult(
                 query=query,
                 formatted_query=formatted_query,
                 explanation=explanation,
@@ -237,9 +268,17 @@ class SQLCodeService:
                 is_safe=is_safe,
                 execution_result=execution_result,
                 error_message=error_message,
-                suggestions=suggestions
+                suggestions=suggestions,
+                truncated=truncated
             )
             
+            # Błędy wykonania (np. brak tabeli, zajęta pula) i zastępcze wyjaśnienie po błędzie Claude
+            # mogą być przejściowe - nie zapamiętujemy
+            if error_message is None and explained:
+                self.result_cache.put(cache_key, result, tags=self._extract_tables(query))
+                result = self._copy_result(result, query)
+            return result
+            
         except Exception as e:
             logger.error(f"❌ Błąd analizy SQL: {e}")
             return SQLQueryResult(
@@ -251,6 +290,47 @@ class SQLCodeService:
                 error_message=str(e)
             )
     
+    @staticmethod
+    def _copy_result(result: SQLQueryResult, query: str) -> SQLQueryResult:
+        """Kopia wpisu z cache'u z tekstem zapytania wywołującego - listy i wiersze nie są współdzielone"""
+        return replace(
+            result,
+            query=query,
+            execution_result=[dict(row) for row in result.execution_result] if result.execution_result is not None else None,
+            suggestions=list(result.suggestions) if result.suggestions is not None else None
+        )
+    
+    def _extract_tables(self, query: str) -> List[str]:
+        """Wyciąga nazwy tabel z zapytania"""
+        query_lower = query.lower()
+        tables = []
+        
+        # Proste wyrażenie regularne dla tabel
+        from_pattern = r'from\s+(\w+)'
+        join_pattern = r'join\s+(\w+)'
+        
+        tables.extend(re.findall(from_pattern, query_lower))
+        tables.extend(re.findall(join_pattern, query_lower))
+        
+        return list(set(tables))
+    
+    def invalidate_tables(self, *tables: str) -> int:
+        """Usuwa z cache'u wyniki zapytań czytających podane tabele - wywołać po zmianie danych"""
+        removed = self.result_cache.invalidate(tables)
+        if removed:
+            logger.info(f"🧹 Unieważniono {removed} wyników SQL z cache'u ({', '.join(tables)})")
+        return removed
+    
+    def clear_query_cache(self):
+        self.result_cache.clear()
+        self.explanation_cache.clear()
+    
+    def get_cache_stats(self) -> Dict[str, Any]:
+        return {
+            'results': self.result_cache.get_stats(),
+            'explanations': self.explanation_cache.get_stats()
+        }
+    
     def _is_sql_safe(self, query: str) -> bool:
         """Sprawdza bezpieczeństwo zapytania SQL"""
         query_upper = query.upper()
@@ -281,26 +361,32 @@ class SQLCodeService:
     
     def _execute_sql_query(self, query: str) -> List[Dict]:
         """Wykonuje zapytanie SQL na demo bazie"""
-        conn = sqlite3.connect(self.demo_db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-        
-        try:
-            cursor.execute(query)
-            rows = cursor.fetchall()
-            
-            # Konwertuj do listy słowników
-            result = []
-            for row in rows:
-                result.append(dict(row))
-            
-            return result
-            
-        finally:
-            conn.close()
+        return self._fetch_rows(query)[0]
+    
+    def _fetch_rows(self, query: str) -> Tuple[List[Dict], bool]:
+        """(wiersze, czy_obcięte) - fetchmany partiami, najwyżej max_rows wierszy w pamięci"""
+        with self.pool.connection() as conn:
+            cursor = conn.execute(query)
+            try:
+                result = []
+                while len(result) < self.max_rows:
+                    rows = cursor.fetchmany(min(self.fetch_size, self.max_rows - len(result)))
+                    if not rows:
+                        return result, False
+                    result.extend(dict(row) for row in rows)
+                # Limit osiągnięty - sprawdź, czy zostało coś jeszcze
+                return result, cursor.fetchone() is not None
+            finally:
+                cursor.close()
     
-    def _generate_sql_explanation(self, query: str) -> str:
-        """Generuje wyjaśnienie zapytania SQL przez AI"""
+    def _generate_sql_explanation(self, query: str, cache_key=None) -> Tuple[str, bool]:
+        """Generuje wyjaśnienie zapytania SQL przez AI - (wyjaśnienie, False gdy tekst zastępczy po błędzie)"""
+        if cache_key is None:
+            cache_key = normalize_sql(query)
+        cached = self.explanation_cache.get(cache_key)
+        if cached is not None:
+            return cached, True
+        
         try:
             system_prompt = """Jesteś ekspertem SQL. Wyjaśnij dokładnie co robi to zapytanie SQL.
             
@@ -314,17 +400,19 @@ Skupi się na:
 Odpowiadaj po polsku w sposób zrozumiały."""
 
             message = self.ai_service.claude_client.messages.create(
-                model=self.config.CLAUDE_HAIKU_MODEL,
+                model=self._config_value('CLAUDE_HAIKU_MODEL'),
                 max_tokens=500,
                 system=system_prompt,
                 messages=[{"role": "user", "content": f"Wyjaśnij to zapytanie SQL:\n\n{query}"}]
             )
             
-            return message.content[0].text.strip()
+            explanation = message.content[0].text.strip()
+            self.explanation_cache.put(cache_key, explanation)
+            return explanation, True
             
         except Exception as e:
             logger.error(f"Błąd generowania wyjaśnienia SQL: {e}")
-            return "Nie można wygenerować wyjaśnienia zapytania."
+            return "Nie można wygenerować wyjaśnienia zapytania.", False
     
     def _generate_sql_suggestions(self, query: str, result: List[Dict]) -> List[str]:
         """Generuje sugestie dla zapytania SQL"""
@@ -525,7 +613,7 @@ Odpowiadaj po polsku w sposób zrozumiały."""
 Odpowiadaj po polsku w sposób zrozumiały dla programistów."""
 
             message = self.ai_service.claude_client.messages.create(
-                model=self.config.CLAUDE_MODEL,
+                model=self._config_value('CLAUDE_MODEL'),
                 max_tokens=800,
                 system=system_prompt,
                 messages=[{"role": "user", "content": f"Przeanalizuj ten kod {language}:\n\n```{language}\n{code}\n```"}]
@@ -768,9 +856,16 @@ Odpowiadaj po polsku w sposób zrozumiały dla programistów."""
     def get_database_schema(self) -> Dict[str, Any]:
         """Zwraca schemat demo bazy danych"""
         try:
-            conn = sqlite3.connect(self.demo_db_path)
-            cursor = conn.cursor()
+            with self.pool.connection() as conn:
+                return self._read_schema(conn.cursor())
             
+        except Exception as e:
+            logger.error(f"❌ Błąd pobierania schematu: {e}")
+            return {}
+    
+    def _read_schema(self, cursor: sqlite3.Cursor) -> Dict[str, Any]:
+        """Kolumny i przykładowe dane wszystkich tabel"""
+        try:
             # Pobierz listę tabel
             cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
             tables = [row[0] for row in cursor.fetchall()]
@@ -799,12 +894,9 @@ Odpowiadaj po polsku w sposób zrozumiały dla programistów."""
                     'sample_data': sample_data
                 }
             
-            conn.close()
             return schema
-            
-        except Exception as e:
-            logger.error(f"❌ Błąd pobierania schematu: {e}")
-            return {}
+        finally:
+            cursor.close()
     
     def generate_sql_query(self, description: str) -> str:
         """Generuje zapytanie SQL na podstawie opisu"""
@@ -826,7 +918,7 @@ Zasady:
 Zwróć tylko kod SQL bez dodatkowych komentarzy."""
 
             message = self.ai_service.claude_client.messages.create(
-                model=self.config.CLAUDE_MODEL,
+                model=self._config_value('CLAUDE_MODEL'),
                 max_tokens=400,
                 system=system_prompt,
                 messages=[{"role": "user", "content": f"Wygeneruj zapytanie SQL dla: {description}"}]
@@ -854,7 +946,7 @@ Zasady:
 Zwróć tylko kod bez dodatkowych wyjaśnień."""
 
             message = self.ai_service.claude_client.messages.create(
-                model=self.config.CLAUDE_MODEL,
+                model=self._config_value('CLAUDE_MODEL'),
                 max_tokens=600,
                 system=system_prompt,
                 messages=[{"role": "user", "content": f"Wygeneruj kod {language} dla: {description}"}]
@@ -0,0 +1,125 @@
+"""
+Ograniczona pula połączeń SQLite tylko do odczytu
+Połączenie otwarte raz zachowuje sparsowany schemat i skompilowane instrukcje (cache sqlite3)
+"""
+
+import os
+import queue
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator
+
+logger = logging.getLogger(__name__)
+
+class PoolTimeout(Exception):
+    """Wszystkie połączenia puli zajęte dłużej niż limit oczekiwania"""
+
+class ReadOnlyConnectionPool:
+    """Najwyżej max_size połączeń (mode=ro, query_only), tworzonych przy pierwszym użyciu
+
+    Połączenie wraca do puli po zakończeniu bloku connection(); jeśli po błędzie sqlite3
+    nie odpowiada na SELECT 1 (zamknięte, uszkodzona baza), jest zamykane i zastępowane nowym.
+    """
+
+    def __init__(self, db_path: str, max_size: int = 4, mmap_size: int = 64 * 1024 * 1024,
+                 cached_statements: int = 128, acquire_timeout: float = 10.0):
+        if max_size <= 0:
+            raise ValueError("max_size musi być dodatnie")
+        self.db_path = os.path.abspath(db_path)
+        self.max_size = max_size
+        self.mmap_size = mmap_size
+        self.cached_statements = cached_statements
+        self.acquire_timeout = acquire_timeout
+
+        self._idle: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(max_size)
+        self._lock = threading.Lock()
+        self._created = 0
+        self._closed = False
+        self.acquisitions = 0
+        self.waits = 0
+
+    def _connect(self) -> sqlite3.Connection:
+        # URI mode=ro - baza nie zostanie utworzona ani zmieniona przez to połączenie
+        uri = f"{Path(self.db_path).as_uri()}?mode=ro"
+        conn = sqlite3.connect(uri, uri=True, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        conn.execute("PRAGMA query_only = ON")
+        conn.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        conn.row_factory = sqlite3.Row
+        with self._lock:
+            self._created += 1
+        return conn
+
+    @contextmanager
+    def connection(self) -> Iterator[sqlite3.Connection]:
+        """Połączenie z puli na czas bloku with"""
+        if self._closed:
+            raise RuntimeError("Pula połączeń została zamknięta")
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self.waits += 1
+            if not self._slots.acquire(timeout=self.acquire_timeout):
+                raise PoolTimeout(f"Brak wolnego połączenia do {self.db_path} po {self.acquire_timeout}s")
+
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            with self._lock:
+                self.acquisitions += 1
+            yield conn
+        except sqlite3.Error:
+            # Błędy samego zapytania (składnia, brak tabeli) nie psują połączenia
+            if conn is not None and not self._is_healthy(conn):
+                self._discard(conn)
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                if self._closed:
+                    self._discard(conn)
+                else:
+                    self._idle.put(conn)
+            self._slots.release()
+
+    @staticmethod
+    def _is_healthy(conn: sqlite3.Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def _discard(self, conn: sqlite3.Connection):
+        try:
+            conn.close()
+        except sqlite3.Error:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                'max_size': self.max_size,
+                'open_connections': self._created,
+                'idle_connections': self._idle.qsize(),
+                'acquisitions': self.acquisitions,
+                'waits': self.waits
+            }
+
+    def close(self):
+        """Zamyka bezczynne połączenia; zajęte zostaną zamknięte przy zwrocie"""
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._discard(conn)
@@ -0,0 +1,187 @@
+"""
+Podział dokumentów na fragmenty liczone w tokenach, z nakładką i granicami semantycznymi
+Fragment to zakres (start, end) w tekście źródłowym - bez sklejania i kopiowania napisów
+"""
+
+import re
+import logging
+from functools import lru_cache
+from typing import List, NamedTuple, Callable, Optional
+
+# Tokenizer BPE (jak w enhanced_rag_service_v3) - bez niego przybliżenie słowa + interpunkcja
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENCODING = "cl100k_base"
+
+# Siła granicy za segmentem: akapit/sekcja > wiersz (kolumna tabeli) > zdanie > słowo > znak
+BOUNDARY_PARAGRAPH, BOUNDARY_LINE, BOUNDARY_SENTENCE, BOUNDARY_WORD, BOUNDARY_CHARACTER = range(5)
+
+# Segmenty dopasowywane bezpośrednio jako zakresy bez białych znaków na brzegach
+_LINE = r'\S(?:[^\n]*\S)?'
+_PARAGRAPH = re.compile(_LINE + r'(?:[^\S\n]*\n[^\S\n]*' + _LINE + r')*')
+_LINE_PATTERN = re.compile(_LINE)
+_SENTENCE = re.compile(r'\S(?:[^\n]*?[.!?;:](?=\s)|[^\n]*\S)?')
+_WORD = re.compile(r'\S+')
+_APPROX_TOKEN = re.compile(r'\w+|[^\w\s]')
+
+class ChunkSpan(NamedTuple):
+    """Fragment dokumentu jako zakres znaków w treści źródłowej"""
+    doc_id: str
+    start: int
+    end: int
+    tokens: int
+
+    def text(self, source: str) -> str:
+        return source[self.start:self.end]
+
+class _Segment(NamedTuple):
+    start: int
+    end: int
+    tokens: int
+    boundary: int
+
+@lru_cache(maxsize=4)
+def _get_encoding(encoding_name: str):
+    """Słownik BPE wczytywany raz na proces - None gdy tiktoken niedostępny"""
+    if TIKTOKEN_AVAILABLE:
+        try:
+            return tiktoken.get_encoding(encoding_name)
+        except Exception as e:
+            logger.warning(f"⚠️ Tokenizer {encoding_name} niedostępny, liczenie przybliżone: {e}")
+    return None
+
+def get_token_counter(encoding_name: str = DEFAULT_ENCODING) -> Callable[[str], int]:
+    """Licznik tokenów: BPE (tiktoken) albo przybliżenie słowa + interpunkcja"""
+    encoding = _get_encoding(encoding_name)
+    if encoding is not None:
+        return lambda text: len(encoding.encode_ordinary(text))
+    return lambda text: len(_APPROX_TOKEN.findall(text))
+
+class TextChunker:
+    """Dzieli tekst na fragmenty do chunk_tokens tokenów z nakładką chunk_overlap tokenów
+
+    Tekst jest rozbijany hierarchicznie (akapity, wiersze, zdania, słowa, okna znaków) tylko tam,
+    gdzie segment nie mieści się we fragmencie. Fragment kończy się na najsilniejszej granicy z jego
+    drugiej połowy, więc sekcje HTML i wiersze kolumn tabel XML nie są przecinane.
+    """
+
+    _LEVELS = (
+        (_PARAGRAPH, BOUNDARY_PARAGRAPH),
+        (_LINE_PATTERN, BOUNDARY_LINE),
+        (_SENTENCE, BOUNDARY_SENTENCE),
+        (_WORD, BOUNDARY_WORD)
+    )
+
+    def __init__(self, chunk_tokens: int = 256, chunk_overlap: int = 32,
+                 encoding_name: str = DEFAULT_ENCODING,
+                 token_counter: Optional[Callable[[str], int]] = None):
+        if chunk_tokens <= 0:
+            raise ValueError("chunk_tokens musi być dodatnie")
+        self.chunk_tokens = chunk_tokens
+        self.chunk_overlap = max(0, min(chunk_overlap, chunk_tokens // 2))
+        self.count_tokens = token_counter or get_token_counter(encoding_name)
+        # Przybliżone liczenie bezpośrednio w tekście źródłowym, bez wycinania segmentów
+        self._count_in_place = token_counter is None and _get_encoding(encoding_name) is None
+
+    def split(self, text: str, doc_id: str = "") -> List[ChunkSpan]:
+        """Fragmenty tekstu jako zakresy (doc_id, start, end, tokens)"""
+        segments = self._segments(text)
+        chunks = []
+        first = 0
+        while first < len(segments):
+            last = self._chunk_end(segments, first)
+            tokens = sum(segment.tokens for segment in segments[first:last + 1])
+            chunks.append(ChunkSpan(doc_id, segments[first].start, segments[last].end, tokens))
+            if last + 1 >= len(segments):
+                break
+            first = self._next_start(segments, first, last)
+        return chunks
+
+    def _segments(self, text: str) -> List[_Segment]:
+        segments: List[_Segment] = []
+        self._split_range(text, 0, len(text), 0, BOUNDARY_PARAGRAPH, segments)
+        return segments
+
+    def _split_range(self, text: str, start: int, end: int, level: int, boundary: int,
+                     segments: List[_Segment]):
+        """Dzieli zakres na poziomie level; zbyt długie części schodzą poziom niżej
+
+        Część nie dłuższa (w znakach) niż limit tokenów jest liczona od razu i zwykle się mieści;
+        znak może jednak dać kilka tokenów, więc po przekroczeniu limitu schodzi poziom niżej.
+        Dłuższa część jest liczona jako suma podczęści i scalana z powrotem, gdy jednak się mieści.
+        Słowo ponad limit (np. długa lista wartości bez spacji) dzielone jest na okna znaków.
+        """
+        pattern, part_boundary = self._LEVELS[level]
+        last_level = level + 1 == len(self._LEVELS)
+        parts = [match.span() for match in pattern.finditer(text, start, end)]
+        for index, (part_start, part_end) in enumerate(parts):
+            # Ostatnia część dziedziczy granicę zakresu nadrzędnego
+            after = boundary if index == len(parts) - 1 else part_boundary
+            if part_end - part_start <= self.chunk_tokens or last_level:
+                tokens = self._count(text, part_start, part_end)
+                if tokens <= self.chunk_tokens:
+                    segments.append(_Segment(part_start, part_end, tokens, after))
+                    continue
+                if last_level:
+                    self._split_characters(text, part_start, part_end, after, segments)
+                    continue
+
+            first = len(segments)
+            self._split_range(text, part_start, part_end, level + 1, after, segments)
+            tokens = sum(segment.tokens for segment in segments[first:])
+            if tokens <= self.chunk_tokens:
+                del segments[first:]
+                segments.append(_Segment(part_start, part_end, tokens, after))
+
+    def _split_characters(self, text: str, start: int, end: int, boundary: int,
+                          segments: List[_Segment]):
+        """Twardy podział słowa na okna znaków mieszczące się w limicie tokenów"""
+        position = start
+        while position < end:
+            stop = min(position + self.chunk_tokens, end)
+            tokens = self._count(text, position, stop)
+            while tokens > self.chunk_tokens and stop - position > 1:
+                stop = position + (stop - position) // 2
+                tokens = self._count(text, position, stop)
+            segments.append(_Segment(position, stop, tokens, boundary if stop == end else BOUNDARY_CHARACTER))
+            position = stop
+
+    def _count(self, text: str, start: int, end: int) -> int:
+        if self._count_in_place:
+            return len(_APPROX_TOKEN.findall(text, start, end))
+        return self.count_tokens(text[start:end])
+
+    def _chunk_end(self, segments: List[_Segment], first: int) -> int:
+        """Indeks ostatniego segmentu fragmentu: najsilniejsza granica w drugiej połowie limitu"""
+        tokens = segments[first].tokens
+        last = first
+        for index in range(first + 1, len(segments)):
+            if tokens + segments[index].tokens > self.chunk_tokens:
+                break
+            tokens += segments[index].tokens
+            last = index
+        if last + 1 >= len(segments):
+            return last
+
+        best = None
+        tokens = 0
+        for index in range(first, last + 1):
+            tokens += segments[index].tokens
+            if tokens >= self.chunk_tokens // 2 and (best is None or segments[index].boundary <= segments[best].boundary):
+                best = index
+        return last if best is None else best
+
+    def _next_start(self, segments: List[_Segment], first: int, last: int) -> int:
+        """Początek kolejnego fragmentu - cofnięcie o segmenty mieszczące się w nakładce"""
+        start = last + 1
+        overlap = 0
+        while start - 1 > first and overlap + segments[start - 1].tokens <= self.chunk_overlap:
+            start -= 1
+            overlap += segments[start].tokens
+        return start
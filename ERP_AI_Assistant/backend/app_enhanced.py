@@ -15,7 +15,7 @@ import time
 import traceback
 from datetime import datetime, timedelta
 from typing import Dict, Any, List, Optional
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, send_from_directory, Response, stream_with_context
 from flask_cors import CORS
 from dotenv import load_dotenv
 import psutil
@@ -115,8 +115,16 @@ class EnhancedERPApplication:
             'CLAUDE_HAIKU_MODEL': os.getenv('CLAUDE_HAIKU_MODEL', "claude-3-haiku-20240307"),
             'MAX_TOKENS': int(os.getenv('MAX_TOKENS', '4096')),
             'EMBEDDING_MODEL': os.getenv('EMBEDDING_MODEL', "paraphrase-multilingual-MiniLM-L12-v2"),
+            'EMBEDDING_STORE_DIR': os.getenv('EMBEDDING_STORE_DIR', 'embedding_store'),
             'VECTOR_DB_PATH': os.getenv('VECTOR_DB_PATH', "chroma_db"),
             'MAX_CONTEXT_LENGTH': int(os.getenv('MAX_CONTEXT_LENGTH', '3000')),
+            'RESPONSE_CACHE_MAX_ENTRIES': int(os.getenv('RESPONSE_CACHE_MAX_ENTRIES', '500')),
+            'RESPONSE_CACHE_MAX_MB': float(os.getenv('RESPONSE_CACHE_MAX_MB', '64')),
+            'RESPONSE_CACHE_TTL_SECONDS': float(os.getenv('RESPONSE_CACHE_TTL_SECONDS', '3600')),
+            'SEMANTIC_CACHE_THRESHOLD': float(os.getenv('SEMANTIC_CACHE_THRESHOLD', '0')),
+            'RESPONSE_CACHE_BACKEND': os.getenv('RESPONSE_CACHE_BACKEND', 'memory'),
+            'RESPONSE_CACHE_PATH': os.getenv('RESPONSE_CACHE_PATH', 'response_cache.db'),
+            'RAG_EXECUTOR_WORKERS': int(os.getenv('RAG_EXECUTOR_WORKERS', '4')),
             'HOST': os.getenv('HOST', '127.0.0.1'),
             'PORT': int(os.getenv('PORT', '5000')),
             'DEBUG': os.getenv('DEBUG', 'False').lower() == 'true'
@@ -267,6 +275,11 @@ class EnhancedERPApplication:
             """Enhanced RAG v3.0 chat endpoint"""
             return self._handle_enhanced_chat()
 
+        @self.app.route('/api/enhanced/chat/stream', methods=['GET', 'POST'])
+        def enhanced_chat_stream():
+            """Enhanced RAG v3.0 chat - strumień Server-Sent Events"""
+            return self._handle_enhanced_chat_stream()
+
         @self.app.route('/api/enhanced/metrics', methods=['GET'])
         def enhanced_metrics():
             """Enhanced RAG metrics"""
@@ -326,6 +339,11 @@ class EnhancedERPApplication:
             """Wyczyść cache"""
             return self._clear_cache()
 
+        @self.app.route('/api/enhanced/cache/clear', methods=['POST'])
+        def clear_enhanced_cache():
+            """Wyczyść cache odpowiedzi (także współdzielony SQLite)"""
+            return self._clear_cache()
+
         # ===== ERROR HANDLERS =====
         @self.app.errorhandler(404)
         def not_found(error):
@@ -480,40 +498,7 @@ class EnhancedERPApplication:
             self.total_processing_time += processing_time
             
             # Konwertuj Enhanced Response na JSON
-            response_data = {
-                'answer': enhanced_response.answer,
-                'confidence': enhanced_response.confidence,
-                'confidence_level': enhanced_response.confidence_level.value,
-                'sources': enhanced_response.sources,
-                'reasoning_chain': enhanced_response.reasoning_chain,
-                'validation_score': enhanced_response.validation_score,
-                'query_type': enhanced_response.query_type.value,
-                'response_type': enhanced_response.response_type,
-                
-                # Enhanced features
-                'citations': enhanced_response.citations,
-                'fact_check_score': enhanced_response.fact_check_score,
-                'relevance_score': enhanced_response.relevance_score,
-                'completeness_score': enhanced_response.completeness_score,
-                'clarity_score': enhanced_response.clarity_score,
-                
-                # Technical metadata
-                'models_used': enhanced_response.models_used,
-                'processing_steps': enhanced_response.processing_steps,
-                'context_chunks_used': enhanced_response.context_chunks_used,
-                'total_tokens': enhanced_response.total_tokens,
-                'processing_time_ms': enhanced_response.processing_time_ms,
-                
-                # Suggestions
-                'suggested_followups': enhanced_response.suggested_followups,
-                
-                # Session info
-                'session_id': enhanced_response.session_id,
-                'timestamp': enhanced_response.timestamp.isoformat(),
-                
-                # Legacy compatibility
-                'claude_model': enhanced_response.models_used[0] if enhanced_response.models_used else 'enhanced-rag-v3'
-            }
+            response_data = self._serialize_enhanced_response(enhanced_response)
             
             logger.info(f"✅ Enhanced chat processed: confidence={enhanced_response.confidence:.2f}, type={enhanced_response.query_type.value}")
             
@@ -532,6 +517,92 @@ class EnhancedERPApplication:
                 f"Błąd przetwarzania: {str(e)}"
             )
 
+    def _serialize_enhanced_response(self, enhanced_response) -> Dict[str, Any]:
+        """Enhanced Response -> JSON (wspólne dla odpowiedzi zwykłej i strumieniowej)"""
+        return {
+            'answer': enhanced_response.answer,
+            'confidence': enhanced_response.confidence,
+            'confidence_level': enhanced_response.confidence_level.value,
+            'sources': enhanced_response.sources,
+            'reasoning_chain': enhanced_response.reasoning_chain,
+            'validation_score': enhanced_response.validation_score,
+            'query_type': enhanced_response.query_type.value,
+            'response_type': enhanced_response.response_type,
+            
+            # Enhanced features
+            'citations': enhanced_response.citations,
+            'fact_check_score': enhanced_response.fact_check_score,
+            'relevance_score': enhanced_response.relevance_score,
+            'completeness_score': enhanced_response.completeness_score,
+            'clarity_score': enhanced_response.clarity_score,
+            
+            # Technical metadata
+            'models_used': enhanced_response.models_used,
+            'processing_steps': enhanced_response.processing_steps,
+            'context_chunks_used': enhanced_response.context_chunks_used,
+            'total_tokens': enhanced_response.total_tokens,
+            'processing_time_ms': enhanced_response.processing_time_ms,
+            'stage_timings_ms': enhanced_response.stage_timings_ms,
+            
+            # Suggestions
+            'suggested_followups': enhanced_response.suggested_followups,
+            
+            # Session info
+            'session_id': enhanced_response.session_id,
+            'timestamp': enhanced_response.timestamp.isoformat(),
+            
+            # Legacy compatibility
+            'claude_model': enhanced_response.models_used[0] if enhanced_response.models_used else 'enhanced-rag-v3'
+        }
+
+    def _handle_enhanced_chat_stream(self):
+        """Handler strumieniowy (SSE): źródła, tokeny odpowiedzi, na końcu pełna odpowiedź"""
+        self.request_count += 1
+        
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or {}
+        else:
+            data = request.args
+        
+        message = data.get('message', '')
+        session_id = data.get('session_id', 'default')
+        
+        if not message:
+            return jsonify({
+                'error': 'Brak wiadomości'
+            }), 400
+        
+        if not self.enhanced_rag_service:
+            return self._fallback_response(message, "Enhanced RAG Service niedostępny")
+        
+        def sse(event: str, payload: Dict[str, Any]) -> str:
+            return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+        
+        def generate():
+            start_time = time.time()
+            try:
+                for event, payload in self.enhanced_rag_service.stream_query(message, session_id):
+                    if event in ('done', 'error'):
+                        if event == 'error':
+                            self.error_count += 1
+                        payload = self._serialize_enhanced_response(payload)
+                    yield sse(event, payload)
+            except Exception as e:
+                self.error_count += 1
+                logger.error(f"❌ Enhanced chat stream error: {e}")
+                yield sse('error', {'error': f"Błąd przetwarzania: {str(e)}"})
+            finally:
+                self.total_processing_time += (time.time() - start_time) * 1000
+        
+        return Response(
+            stream_with_context(generate()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'
+            }
+        )
+
     def _fallback_response(self, message: str, error_msg: str):
         """Fallback response gdy Enhanced RAG nie działa"""
         fallback_data = {
@@ -700,6 +771,7 @@ class EnhancedERPApplication:
             if force_reload and doc_count > 0:
                 # Clear existing collection
                 self.vector_service.collection.delete()
+                self.enhanced_rag_service.notify_collection_changed()
                 logger.info("🗑️ Cleared existing documents for reload")
             
             # Load enhanced sample documents
@@ -1070,8 +1142,7 @@ Faza 5 - Go-live i wsparcie (1-2 tygodnie):
             # Clear Enhanced RAG cache
             if self.enhanced_rag_service:
                 if hasattr(self.enhanced_rag_service, 'response_cache'):
-                    cache_size = len(self.enhanced_rag_service.response_cache)
-                    self.enhanced_rag_service.response_cache.clear()
+                    cache_size = self.enhanced_rag_service.response_cache.clear()
                     cache_cleared.append(f'Enhanced RAG response cache: {cache_size} entries')
                 
                 if hasattr(self.enhanced_rag_service, 'query_cache'):
@@ -1113,6 +1184,7 @@ Faza 5 - Go-live i wsparcie (1-2 tygodnie):
         logger.info("   [HEALTH] Health check: http://localhost:5000/api/health")
         logger.info("   [ENHANCED] Enhanced health: http://localhost:5000/api/enhanced/health")
         logger.info("   [CHAT] Enhanced chat: http://localhost:5000/api/enhanced/chat")
+        logger.info("   [STREAM] Enhanced chat (SSE): http://localhost:5000/api/enhanced/chat/stream")
         logger.info("   [METRICS] Enhanced metrics: http://localhost:5000/api/enhanced/metrics")
         logger.info("   [INIT] Enhanced init: http://localhost:5000/api/enhanced/initialize")
         logger.info("[INFO] Legacy endpoints (kompatybilność):")
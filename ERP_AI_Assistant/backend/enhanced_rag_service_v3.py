@@ -14,10 +14,13 @@ import asyncio
 import hashlib
 import pickle
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Tuple, Union
-from dataclasses import dataclass, asdict, field
+from typing import Dict, Any, List, Optional, Tuple, Union, Iterator
+from dataclasses import dataclass, asdict, field, replace
 from enum import Enum
 from collections import defaultdict, deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 
 import numpy as np
 import anthropic
@@ -26,6 +29,9 @@ import chromadb
 from chromadb.config import Settings
 import tiktoken
 
+from response_cache import ResponseCache, create_cache_backend, content_cache_key
+from app.services.embedding_store import get_embedding_store, cached_encode
+
 logger = logging.getLogger(__name__)
 
 # ============================================================================
@@ -86,6 +92,9 @@ class EnhancedResponse:
     total_tokens: int
     processing_time_ms: float
     
+    # Czas poszczególnych etapów przetwarzania (ms)
+    stage_timings_ms: Dict[str, float] = field(default_factory=dict)
+    
     # Adaptacyjne uczenie
     user_feedback: Optional[Dict[str, Any]] = None
     suggested_followups: List[str] = field(default_factory=list)
@@ -105,6 +114,23 @@ class RetrievalContext:
     diversity_scores: Optional[List[float]] = None
     query_similarity: Optional[List[float]] = None
 
+@dataclass
+class QueryPipelineState:
+    """Stan zapytania między etapami - wspólny dla odpowiedzi zwykłej i strumieniowej"""
+    query: str
+    session_id: str
+    start_time: float
+    cache_key: str = ""
+    cache_scope: Optional[str] = None
+    processing_steps: List[str] = field(default_factory=list)
+    stage_timings: Dict[str, float] = field(default_factory=dict)
+    query_embedding: Optional[np.ndarray] = None
+    cached_response: Optional[EnhancedResponse] = None
+    query_analysis: Optional[Dict[str, Any]] = None
+    conversation_context: Optional[ConversationContext] = None
+    context: Optional[RetrievalContext] = None
+    reasoning_chain: List[str] = field(default_factory=list)
+
 # ============================================================================
 # ENHANCED RAG SERVICE v3.0
 # ============================================================================
@@ -117,21 +143,39 @@ class EnhancedRAGService:
         self.ai_service = ai_service
         self.vector_service = vector_service
         self.claude_client = ai_service.claude_client
+        self.async_claude_client = getattr(ai_service, 'async_claude_client', None) or self._create_async_client()
         self.embeddings_model = ai_service.sentence_model
         self.collection = vector_service.collection
+        self.embedding_store = get_embedding_store(self._config_value('EMBEDDING_STORE_DIR'),
+                                                   self._config_value('EMBEDDING_MODEL', ''))
         
         # Zaawansowane ustawienia
-        self.max_context_length = getattr(config, 'MAX_CONTEXT_LENGTH', 3000)
+        self.max_context_length = self._config_value('MAX_CONTEXT_LENGTH', 3000)
         self.top_k = 8  # Zwiększone dla lepszego wyszukiwania
         self.rerank_threshold = 0.75
         self.confidence_threshold = 0.65
         self.diversity_penalty = 0.7
+        # Embeddingi z bazy wektorowej pobierane tylko gdy różnorodność liczona jest semantycznie
+        self.diversity_use_embeddings = self._config_value('DIVERSITY_USE_EMBEDDINGS', False)
         
         # Cache i optymalizacje
-        self.response_cache = {}
+        self.response_cache = ResponseCache(
+            max_entries=int(self._config_value('RESPONSE_CACHE_MAX_ENTRIES', 500)),
+            max_bytes=int(float(self._config_value('RESPONSE_CACHE_MAX_MB', 64)) * 1024 * 1024),
+            ttl_seconds=float(self._config_value('RESPONSE_CACHE_TTL_SECONDS', 3600)),
+            semantic_threshold=float(self._config_value('SEMANTIC_CACHE_THRESHOLD', 0) or 0),
+            backend=create_cache_backend(self._config_value('RESPONSE_CACHE_BACKEND', 'memory'),
+                                         self._config_value('RESPONSE_CACHE_PATH'))
+        )
         self.query_cache = {}
         self.performance_metrics = defaultdict(list)
         
+        # Ograniczona pula wątków dla etapów CPU (embeddingi, re-ranking) i blokującego I/O w trybie async
+        self.executor = ThreadPoolExecutor(
+            max_workers=int(self._config_value('RAG_EXECUTOR_WORKERS', 4)),
+            thread_name_prefix='enhanced-rag'
+        )
+        
         # Konteksty konwersacji
         self.conversation_contexts: Dict[str, ConversationContext] = {}
         
@@ -156,6 +200,37 @@ class EnhancedRAGService:
             except:
                 logger.warning("Nie można załadować tokenizera")
 
+    def _create_async_client(self):
+        """Asynchroniczny klient Claude z tym samym kluczem API co klient synchroniczny"""
+        api_key = getattr(self.claude_client, 'api_key', None)
+        if not api_key:
+            return None
+        try:
+            return anthropic.AsyncAnthropic(api_key=api_key)
+        except Exception as e:
+            logger.warning(f"⚠️ Async Claude client unavailable: {e}")
+            return None
+
+    async def _run_blocking(self, func, *args, **kwargs):
+        """Uruchamia funkcję blokującą w ograniczonej puli wątków serwisu"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(func, *args, **kwargs))
+
+    def _config_value(self, name: str, default: Any = None) -> Any:
+        """Wartość konfiguracji - obsługuje zarówno obiekt Config, jak i słownik"""
+        if isinstance(self.config, dict):
+            return self.config.get(name, default)
+        return getattr(self.config, name, default)
+
+    @contextmanager
+    def _stage(self, timings: Dict[str, float], name: str):
+        """Mierzy czas etapu przetwarzania (ms)"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            timings[name] = (time.perf_counter() - start) * 1000
+
     def _count_tokens(self, text: str) -> int:
         """Liczy tokeny w tekście"""
         if self.tokenizer:
@@ -163,142 +238,288 @@ class EnhancedRAGService:
         return len(text.split()) * 1.3  # Przybliżenie
 
     async def process_query_async(self, query: str, session_id: str = "default") -> EnhancedResponse:
-        """Asynchroniczne przetwarzanie zapytania"""
-        return self.process_query(query, session_id)
+        """Asynchroniczne przetwarzanie zapytania
 
-    def process_query(self, query: str, session_id: str = "default") -> EnhancedResponse:
-        """Główna metoda przetwarzania zapytania z zaawansowanymi technikami AI"""
-        start_time = time.time()
-        processing_steps = []
+        Etapy CPU i zapytania do bazy wektorowej działają w puli wątków, wywołanie Claude
+        przez klienta async, a niezależne etapy końcowe (walidacja, cytaty, fact-checking,
+        sugestie) równolegle - pętla zdarzeń obsługuje w tym czasie inne zapytania.
+        """
+        state = QueryPipelineState(query=query, session_id=session_id, start_time=time.time())
         
         try:
-            logger.info(f"🧠 Processing enhanced query: {query[:100]}...")
-            processing_steps.append("Query received and preprocessing started")
-            
-            # Sprawdź cache
-            cache_key = hashlib.md5(f"{query}_{session_id}".encode()).hexdigest()
-            if cache_key in self.response_cache:
-                cached_response = self.response_cache[cache_key]
-                cached_response.processing_time_ms = (time.time() - start_time) * 1000
-                processing_steps.append("Response retrieved from cache")
-                logger.info("📦 Response served from cache")
-                return cached_response
-            
-            # 1. Analiza zapytania i klasyfikacja
-            query_analysis = self._analyze_query_intent(query)
-            processing_steps.append(f"Query analyzed - type: {query_analysis['type']}, intent: {query_analysis['intent']}, confidence: {query_analysis.get('confidence', 0.5):.2f}")
-            
-            # 2. Kontekst konwersacji
-            conversation_context = self._get_or_create_conversation_context(session_id)
-            self._update_conversation_context(conversation_context, query, query_analysis)
-            processing_steps.append("Conversation context updated")
-            
-            # 3. Ekspansja zapytania z kontekstem
-            expanded_queries = self._advanced_query_expansion(query, query_analysis, conversation_context)
-            processing_steps.append(f"Query expanded to {len(expanded_queries)} variants")
-            
-            # 4. Multi-stage retrieval
-            retrieval_context = self._multi_stage_retrieval(expanded_queries, query_analysis)
-            processing_steps.append(f"Retrieved {len(retrieval_context.documents)} documents")
-            
-            # 5. Advanced re-ranking z diverse scoring
-            reranked_context = self._advanced_reranking(query, retrieval_context, query_analysis)
-            processing_steps.append("Documents re-ranked with diversity scoring")
-            
-            # 6. Adaptive context compression
-            compressed_context = self._adaptive_context_compression(reranked_context, query_analysis)
-            processing_steps.append(f"Context compressed to {len(compressed_context.documents)} chunks")
-            
-            # 7. Multi-model reasoning
-            reasoning_chain = self._multi_model_reasoning(query, compressed_context, query_analysis, conversation_context)
-            processing_steps.append("Multi-model reasoning completed")
+            await self._run_blocking(self._prepare_query, state)
+            if state.cached_response is not None:
+                return state.cached_response
             
             # 8. Enhanced answer generation
-            answer, model_confidence = self._enhanced_answer_generation(query, compressed_context, reasoning_chain, query_analysis, conversation_context)
-            processing_steps.append("Enhanced answer generated")
-            
-            # 9. Multi-dimensional validation
-            validation_results = self._multi_dimensional_validation(query, answer, compressed_context, query_analysis)
-            processing_steps.append("Multi-dimensional validation completed")
-            
-            # 10. Citation and fact checking
-            citations = self._generate_citations(answer, compressed_context)
-            fact_check_score = self._fact_check_answer(answer, compressed_context)
-            processing_steps.append("Citations generated and fact-checking completed")
-            
-            # 11. Follow-up suggestions
-            suggested_followups = self._generate_followup_suggestions(query, answer, query_analysis, conversation_context)
-            processing_steps.append("Follow-up suggestions generated")
-            
-            # Przygotuj sources z dodatkowymi informacjami
-            enhanced_sources = self._prepare_enhanced_sources(compressed_context)
-            
-            # Określ poziom pewności
-            confidence_level = self._determine_confidence_level(model_confidence, validation_results)
-            
-            processing_time = (time.time() - start_time) * 1000
-            
-            response = EnhancedResponse(
-                answer=answer,
-                confidence=model_confidence,
-                confidence_level=confidence_level,
-                sources=enhanced_sources,
-                reasoning_chain=reasoning_chain,
-                validation_score=validation_results['overall_score'],
-                query_type=QueryType(query_analysis['type']),
-                response_type=query_analysis.get('response_type', 'synthesized'),
-                
-                citations=citations,
-                fact_check_score=fact_check_score,
-                relevance_score=validation_results['relevance_score'],
-                completeness_score=validation_results['completeness_score'],
-                clarity_score=validation_results['clarity_score'],
-                
-                models_used=[self.config.CLAUDE_MODEL, "sentence-transformers", "custom-reranker"],
-                processing_steps=processing_steps,
-                context_chunks_used=len(compressed_context.documents),
-                total_tokens=self._count_tokens(answer + " ".join(compressed_context.documents)),
-                processing_time_ms=processing_time,
-                
-                suggested_followups=suggested_followups,
-                session_id=session_id
+            with self._stage(state.stage_timings, 'generation'):
+                answer, model_confidence = await self._enhanced_answer_generation_async(state)
+            state.processing_steps.append("Enhanced answer generated")
+            
+            # 9-11. Walidacja, cytaty, fact-checking i sugestie - równolegle
+            validation_results, citations, fact_check_score, suggested_followups = await asyncio.gather(
+                self._run_blocking(self._timed_stage, state, 'validation', self._multi_dimensional_validation,
+                                   query, answer, state.context, state.query_analysis),
+                self._run_blocking(self._timed_stage, state, 'citations', self._generate_citations,
+                                   answer, state.context),
+                self._run_blocking(self._timed_stage, state, 'fact_check', self._fact_check_answer,
+                                   answer, state.context),
+                self._run_blocking(self._timed_stage, state, 'followups', self._generate_followup_suggestions,
+                                   query, answer, state.query_analysis, state.conversation_context)
             )
+            state.processing_steps.append("Validation, citations, fact-checking and follow-ups completed concurrently")
             
-            # Cache response
-            self.response_cache[cache_key] = response
+            return await self._run_blocking(self._build_response, state, answer, model_confidence,
+                                            validation_results, citations, fact_check_score, suggested_followups)
             
-            # Update performance metrics
-            self._update_performance_metrics(query, response, processing_time)
+        except Exception as e:
+            logger.error(f"❌ Error in async enhanced processing: {e}")
+            return self._error_response(state, e)
+
+    def _timed_stage(self, state: "QueryPipelineState", name: str, func, *args):
+        """Wywołanie etapu z pomiarem czasu (dla etapów uruchamianych równolegle)"""
+        with self._stage(state.stage_timings, name):
+            return func(*args)
+
+    def process_query(self, query: str, session_id: str = "default") -> EnhancedResponse:
+        """Główna metoda przetwarzania zapytania z zaawansowanymi technikami AI"""
+        state = QueryPipelineState(query=query, session_id=session_id, start_time=time.time())
+        
+        try:
+            self._prepare_query(state)
+            if state.cached_response is not None:
+                return state.cached_response
+            
+            # 8. Enhanced answer generation
+            with self._stage(state.stage_timings, 'generation'):
+                answer, model_confidence = self._enhanced_answer_generation(
+                    query, state.context, state.reasoning_chain, state.query_analysis, state.conversation_context
+                )
+            state.processing_steps.append("Enhanced answer generated")
             
-            logger.info(f"✅ Enhanced query processed: confidence={model_confidence:.2f}, validation={validation_results['overall_score']:.2f}")
-            return response
+            return self._finalize_response(state, answer, model_confidence)
             
         except Exception as e:
             logger.error(f"❌ Error in enhanced processing: {e}")
             import traceback
             traceback.print_exc()
+            return self._error_response(state, e)
+
+    def stream_query(self, query: str, session_id: str = "default") -> Iterator[Tuple[str, Any]]:
+        """Przetwarzanie strumieniowe - zdarzenia (nazwa, dane): sources, token..., done lub error
+
+        Źródła wysyłane są zaraz po wyszukiwaniu, tokeny odpowiedzi w miarę generowania,
+        a walidacja, cytaty i sugestie jako pełna odpowiedź w zdarzeniu "done".
+        """
+        state = QueryPipelineState(query=query, session_id=session_id, start_time=time.time())
+        
+        try:
+            self._prepare_query(state)
+            
+            if state.cached_response is not None:
+                cached = state.cached_response
+                yield 'sources', {'sources': cached.sources, 'query_type': cached.query_type.value,
+                                  'reasoning_chain': cached.reasoning_chain, 'cached': True}
+                yield 'token', {'text': cached.answer}
+                yield 'done', cached
+                return
             
-            return EnhancedResponse(
-                answer=f"Przepraszam, wystąpił błąd podczas zaawansowanego przetwarzania: {str(e)}",
-                confidence=0.1,
-                confidence_level=ConfidenceLevel.VERY_LOW,
-                sources=[],
-                reasoning_chain=["Error occurred during processing"],
-                validation_score=0.0,
-                query_type=QueryType.UNKNOWN,
-                response_type="error",
-                citations=[],
-                fact_check_score=0.0,
-                relevance_score=0.0,
-                completeness_score=0.0,
-                clarity_score=0.0,
-                models_used=["error_handler"],
-                processing_steps=processing_steps + [f"Error: {str(e)}"],
-                context_chunks_used=0,
-                total_tokens=0,
-                processing_time_ms=(time.time() - start_time) * 1000,
-                session_id=session_id
+            yield 'sources', {
+                'sources': self._prepare_enhanced_sources(state.context),
+                'query_type': state.query_analysis['type'],
+                'reasoning_chain': state.reasoning_chain,
+                'cached': False
+            }
+            
+            # 8. Enhanced answer generation - tokeny przekazywane na bieżąco
+            chunks = []
+            with self._stage(state.stage_timings, 'generation'):
+                for text in self._stream_answer_tokens(state):
+                    chunks.append(text)
+                    yield 'token', {'text': text}
+            answer = "".join(chunks)
+            model_confidence = self._calculate_answer_confidence(query, answer, state.context, state.query_analysis)
+            state.processing_steps.append("Enhanced answer streamed")
+            
+            yield 'done', self._finalize_response(state, answer, model_confidence)
+            
+        except Exception as e:
+            logger.error(f"❌ Error in enhanced streaming: {e}")
+            yield 'error', self._error_response(state, e)
+
+    def _prepare_query(self, state: "QueryPipelineState"):
+        """Etapy przed generowaniem odpowiedzi: cache, analiza, wyszukiwanie, re-ranking, kompresja"""
+        query, session_id = state.query, state.session_id
+        processing_steps, stage_timings = state.processing_steps, state.stage_timings
+        
+        logger.info(f"🧠 Processing enhanced query: {query[:100]}...")
+        processing_steps.append("Query received and preprocessing started")
+        
+        # Sprawdź cache (dokładny klucz, a przy włączonej warstwie semantycznej - podobne zapytania)
+        state.cache_scope = self._cache_scope(session_id)
+        state.cache_key = content_cache_key('enhanced_rag_v3', self._config_value('CLAUDE_MODEL'), query,
+                                            state.cache_scope)
+        if self.response_cache.semantic_threshold:
+            with self._stage(stage_timings, 'cache_encode'):
+                state.query_embedding = np.asarray(self.embeddings_model.encode([query]))[0]
+        
+        cached_response = self.response_cache.get(state.cache_key, embedding=state.query_embedding,
+                                                  scope=state.cache_scope)
+        if cached_response is not None:
+            logger.info("📦 Response served from cache")
+            # Pytanie trafia do historii sesji także przy trafieniu - kolejne pytanie dostanie kontekst
+            self._update_conversation_context(self._get_or_create_conversation_context(session_id),
+                                              query, self._analyze_query_intent(query))
+            state.cached_response = replace(
+                cached_response,
+                session_id=session_id,
+                processing_time_ms=(time.time() - state.start_time) * 1000,
+                processing_steps=cached_response.processing_steps + ["Response retrieved from cache"],
+                stage_timings_ms=stage_timings
             )
+            return
+        
+        # 1. Analiza zapytania i klasyfikacja
+        with self._stage(stage_timings, 'query_analysis'):
+            query_analysis = self._analyze_query_intent(query)
+        processing_steps.append(f"Query analyzed - type: {query_analysis['type']}, intent: {query_analysis['intent']}, confidence: {query_analysis.get('confidence', 0.5):.2f}")
+        
+        # 2. Kontekst konwersacji
+        conversation_context = self._get_or_create_conversation_context(session_id)
+        self._update_conversation_context(conversation_context, query, query_analysis)
+        processing_steps.append("Conversation context updated")
+        
+        # 3. Ekspansja zapytania z kontekstem
+        expanded_queries = self._advanced_query_expansion(query, query_analysis, conversation_context)
+        processing_steps.append(f"Query expanded to {len(expanded_queries)} variants")
+        
+        # 4. Multi-stage retrieval
+        with self._stage(stage_timings, 'retrieval'):
+            retrieval_context = self._multi_stage_retrieval(expanded_queries, query_analysis, stage_timings,
+                                                            query_embedding=state.query_embedding)
+        processing_steps.append(f"Retrieved {len(retrieval_context.documents)} documents")
+        
+        # 5. Advanced re-ranking z diverse scoring
+        with self._stage(stage_timings, 'reranking'):
+            reranked_context = self._advanced_reranking(query, retrieval_context, query_analysis)
+        processing_steps.append("Documents re-ranked with diversity scoring")
+        
+        # 6. Adaptive context compression
+        with self._stage(stage_timings, 'compression'):
+            compressed_context = self._adaptive_context_compression(reranked_context, query_analysis)
+        processing_steps.append(f"Context compressed to {len(compressed_context.documents)} chunks")
+        
+        # 7. Multi-model reasoning
+        with self._stage(stage_timings, 'reasoning'):
+            reasoning_chain = self._multi_model_reasoning(query, compressed_context, query_analysis, conversation_context)
+        processing_steps.append("Multi-model reasoning completed")
+        
+        state.query_analysis = query_analysis
+        state.conversation_context = conversation_context
+        state.context = compressed_context
+        state.reasoning_chain = reasoning_chain
+
+    def _finalize_response(self, state: "QueryPipelineState", answer: str, model_confidence: float) -> EnhancedResponse:
+        """Etapy po wygenerowaniu odpowiedzi: walidacja, cytaty, sugestie, cache i metryki"""
+        query, session_id = state.query, state.session_id
+        processing_steps, stage_timings = state.processing_steps, state.stage_timings
+        query_analysis, compressed_context = state.query_analysis, state.context
+        
+        # 9. Multi-dimensional validation
+        with self._stage(stage_timings, 'validation'):
+            validation_results = self._multi_dimensional_validation(query, answer, compressed_context, query_analysis)
+        processing_steps.append("Multi-dimensional validation completed")
+        
+        # 10. Citation and fact checking
+        with self._stage(stage_timings, 'citations'):
+            citations = self._generate_citations(answer, compressed_context)
+        with self._stage(stage_timings, 'fact_check'):
+            fact_check_score = self._fact_check_answer(answer, compressed_context)
+        processing_steps.append("Citations generated and fact-checking completed")
+        
+        # 11. Follow-up suggestions
+        with self._stage(stage_timings, 'followups'):
+            suggested_followups = self._generate_followup_suggestions(query, answer, query_analysis, state.conversation_context)
+        processing_steps.append("Follow-up suggestions generated")
+        
+        return self._build_response(state, answer, model_confidence, validation_results,
+                                    citations, fact_check_score, suggested_followups)
+
+    def _build_response(self, state: "QueryPipelineState", answer: str, model_confidence: float,
+                        validation_results: Dict[str, float], citations: List[Dict[str, Any]],
+                        fact_check_score: float, suggested_followups: List[str]) -> EnhancedResponse:
+        """Składa EnhancedResponse, zapisuje w cache i aktualizuje metryki"""
+        query, session_id = state.query, state.session_id
+        query_analysis, compressed_context = state.query_analysis, state.context
+        
+        # Przygotuj sources z dodatkowymi informacjami
+        enhanced_sources = self._prepare_enhanced_sources(compressed_context)
+        
+        # Określ poziom pewności
+        confidence_level = self._determine_confidence_level(model_confidence, validation_results)
+        
+        processing_time = (time.time() - state.start_time) * 1000
+        
+        response = EnhancedResponse(
+            answer=answer,
+            confidence=model_confidence,
+            confidence_level=confidence_level,
+            sources=enhanced_sources,
+            reasoning_chain=state.reasoning_chain,
+            validation_score=validation_results['overall_score'],
+            query_type=QueryType(query_analysis['type']),
+            response_type=query_analysis.get('response_type', 'synthesized'),
+            
+            citations=citations,
+            fact_check_score=fact_check_score,
+            relevance_score=validation_results['relevance_score'],
+            completeness_score=validation_results['completeness_score'],
+            clarity_score=validation_results['clarity_score'],
+            
+            models_used=[self._config_value('CLAUDE_MODEL', 'claude'), "sentence-transformers", "custom-reranker"],
+            processing_steps=state.processing_steps,
+            context_chunks_used=len(compressed_context.documents),
+            total_tokens=self._count_tokens(answer + " ".join(compressed_context.documents)),
+            processing_time_ms=processing_time,
+            stage_timings_ms=state.stage_timings,
+            
+            suggested_followups=suggested_followups,
+            session_id=session_id
+        )
+        
+        # Cache response
+        self.response_cache.put(state.cache_key, response, embedding=state.query_embedding, scope=state.cache_scope)
+        
+        # Update performance metrics
+        self._update_performance_metrics(query, response, processing_time)
+        
+        logger.info(f"✅ Enhanced query processed: confidence={model_confidence:.2f}, validation={validation_results['overall_score']:.2f}")
+        return response
+
+    def _error_response(self, state: "QueryPipelineState", error: Exception) -> EnhancedResponse:
+        """Odpowiedź zastępcza przy błędzie przetwarzania"""
+        return EnhancedResponse(
+            answer=f"Przepraszam, wystąpił błąd podczas zaawansowanego przetwarzania: {str(error)}",
+            confidence=0.1,
+            confidence_level=ConfidenceLevel.VERY_LOW,
+            sources=[],
+            reasoning_chain=["Error occurred during processing"],
+            validation_score=0.0,
+            query_type=QueryType.UNKNOWN,
+            response_type="error",
+            citations=[],
+            fact_check_score=0.0,
+            relevance_score=0.0,
+            completeness_score=0.0,
+            clarity_score=0.0,
+            models_used=["error_handler"],
+            processing_steps=state.processing_steps + [f"Error: {str(error)}"],
+            context_chunks_used=0,
+            total_tokens=0,
+            processing_time_ms=(time.time() - state.start_time) * 1000,
+            stage_timings_ms=state.stage_timings,
+            session_id=state.session_id
+        )
 
     def _analyze_query_intent(self, query: str) -> Dict[str, Any]:
         """Zaawansowana analiza intencji zapytania - ulepszona wersja"""
@@ -417,6 +638,15 @@ class EnhancedRAGService:
             'response_type': 'synthesized' if complexity in ['medium', 'complex'] else 'direct'
         }
 
+    def _cache_scope(self, session_id: str) -> Optional[str]:
+        """Zakres cache: wspólny dla wszystkich użytkowników, dopóki sesja nie ma historii
+        
+        Historia konwersacji trafia do promptu i ekspansji zapytania - od drugiego pytania
+        odpowiedź zależy od sesji, więc klucz i trafienia semantyczne są ograniczone do niej.
+        """
+        context = self.conversation_contexts.get(session_id)
+        return session_id if context is not None and context.history else None
+
     def _get_or_create_conversation_context(self, session_id: str) -> ConversationContext:
         """Pobiera lub tworzy kontekst konwersacji"""
         if session_id not in self.conversation_contexts:
@@ -474,66 +704,68 @@ class EnhancedRAGService:
         
         return expanded[:5]  # Maksymalnie 5 wariantów
 
-    def _multi_stage_retrieval(self, queries: List[str], analysis: Dict[str, Any]) -> RetrievalContext:
-        """Wieloetapowe wyszukiwanie z różnymi strategiami"""
+    def _multi_stage_retrieval(self, queries: List[str], analysis: Dict[str, Any],
+                               timings: Optional[Dict[str, float]] = None,
+                               query_embedding: Optional[np.ndarray] = None) -> RetrievalContext:
+        """Wieloetapowe wyszukiwanie - wszystkie warianty zapytania w jednym batchu"""
+        timings = timings if timings is not None else {}
         try:
             all_documents = []
             all_metadatas = []
             all_distances = []
             all_embeddings = []
             
-            for query in queries:
-                # Semantic search
-                query_embedding = self.embeddings_model.encode([query])
-                
-                # Dostosuj liczbę wyników do typu zapytania
-                n_results = self.top_k
-                if analysis['complexity'] == 'complex':
-                    n_results = min(12, self.top_k + 4)
-                
+            if not queries:
+                return RetrievalContext([], [], [], [])
+            
+            # Jedno przejście enkodera dla wszystkich wariantów
+            with self._stage(timings, 'retrieval_encode'):
+                if query_embedding is not None:
+                    # Oryginalne zapytanie zakodowane już przy sprawdzaniu cache
+                    query_embeddings = [query_embedding]
+                    if len(queries) > 1:
+                        query_embeddings.extend(self.embeddings_model.encode(queries[1:]))
+                    query_embeddings = np.vstack(query_embeddings)
+                else:
+                    query_embeddings = self.embeddings_model.encode(queries)
+            
+            # Dostosuj liczbę wyników do typu zapytania
+            n_results = self.top_k
+            if analysis['complexity'] == 'complex':
+                n_results = min(12, self.top_k + 4)
+            
+            include = ['documents', 'metadatas', 'distances']
+            if self.diversity_use_embeddings:
+                include.append('embeddings')
+            
+            # Jedno zapytanie wielowektorowe do bazy zamiast osobnego na każdy wariant
+            with self._stage(timings, 'retrieval_vector_query'):
                 results = self.collection.query(
-                    query_embeddings=query_embedding.tolist(),
+                    query_embeddings=np.asarray(query_embeddings).tolist(),
                     n_results=n_results,
-                    include=['documents', 'metadatas', 'distances', 'embeddings']
+                    include=include
                 )
+            
+            documents_per_query = results.get('documents') or []
+            metadatas_per_query = results.get('metadatas') or []
+            distances_per_query = results.get('distances') or []
+            embeddings_per_query = results.get('embeddings')
+            if embeddings_per_query is None:
+                embeddings_per_query = []
+            
+            for query_idx, documents_batch in enumerate(documents_per_query):
+                if not documents_batch:
+                    continue
+                all_documents.extend(documents_batch)
                 
-                # Naprawiony warunek - sprawdź czy listy nie są puste
-                if (results.get('documents') and 
-                    isinstance(results['documents'], list) and 
-                    len(results['documents']) > 0 and 
-                    isinstance(results['documents'][0], list) and
-                    len(results['documents'][0]) > 0):
-                    
-                    documents_batch = results['documents'][0]
-                    all_documents.extend(documents_batch)
-                    
-                    # Sprawdź metadane
-                    if (results.get('metadatas') and 
-                        isinstance(results['metadatas'], list) and
-                        len(results['metadatas']) > 0 and
-                        results['metadatas'][0] is not None and
-                        isinstance(results['metadatas'][0], list)):
-                        all_metadatas.extend(results['metadatas'][0])
-                    else:
-                        all_metadatas.extend([{}] * len(documents_batch))
-                    
-                    # Sprawdź distances  
-                    if (results.get('distances') and 
-                        isinstance(results['distances'], list) and
-                        len(results['distances']) > 0 and
-                        results['distances'][0] is not None and
-                        isinstance(results['distances'][0], list)):
-                        all_distances.extend(results['distances'][0])
-                    else:
-                        all_distances.extend([1.0] * len(documents_batch))
-                    
-                    # Sprawdź embeddings
-                    if (results.get('embeddings') and 
-                        isinstance(results['embeddings'], list) and
-                        len(results['embeddings']) > 0 and
-                        results['embeddings'][0] is not None and
-                        isinstance(results['embeddings'][0], list)):
-                        all_embeddings.extend(results['embeddings'][0])
+                metadatas_batch = metadatas_per_query[query_idx] if query_idx < len(metadatas_per_query) else None
+                all_metadatas.extend(metadatas_batch if metadatas_batch is not None else [{}] * len(documents_batch))
+                
+                distances_batch = distances_per_query[query_idx] if query_idx < len(distances_per_query) else None
+                all_distances.extend(distances_batch if distances_batch is not None else [1.0] * len(documents_batch))
+                
+                embeddings_batch = embeddings_per_query[query_idx] if query_idx < len(embeddings_per_query) else None
+                all_embeddings.extend(list(embeddings_batch) if embeddings_batch is not None else [None] * len(documents_batch))
             
             # Remove duplicates and score
             unique_docs = {}
@@ -556,7 +788,7 @@ class EnhancedRAGService:
                 metadatas=[item['metadata'] for item in sorted_docs[:self.top_k]],
                 distances=[item['distance'] for item in sorted_docs[:self.top_k]],
                 scores=[item['score'] for item in sorted_docs[:self.top_k]],
-                embeddings=[item['embedding'] for item in sorted_docs[:self.top_k] if item['embedding']]
+                embeddings=[item['embedding'] for item in sorted_docs[:self.top_k]] if self.diversity_use_embeddings else None
             )
             
         except Exception as e:
@@ -570,7 +802,6 @@ class EnhancedRAGService:
                 return retrieval_context
             
             reranked_items = []
-            query_embedding = self.embeddings_model.encode([query])
             
             for i, doc in enumerate(retrieval_context.documents):
                 # 1. Semantic similarity score
@@ -617,6 +848,7 @@ class EnhancedRAGService:
                     'index': i,
                     'document': doc,
                     'metadata': metadata,
+                    'embedding': retrieval_context.embeddings[i] if retrieval_context.embeddings else None,
                     'combined_score': combined_score,
                     'scores': {
                         'semantic': semantic_score,
@@ -638,6 +870,7 @@ class EnhancedRAGService:
                 metadatas=[item['metadata'] for item in diverse_items],
                 distances=[retrieval_context.distances[item['index']] if item['index'] < len(retrieval_context.distances) else 1.0 for item in diverse_items],
                 scores=[retrieval_context.scores[item['index']] if item['index'] < len(retrieval_context.scores) else 0.5 for item in diverse_items],
+                embeddings=[item['embedding'] for item in diverse_items] if retrieval_context.embeddings else None,
                 rerank_scores=[item['combined_score'] for item in diverse_items],
                 diversity_scores=[item.get('diversity_score', 1.0) for item in diverse_items]
             )
@@ -657,11 +890,18 @@ class EnhancedRAGService:
             # Sprawdź podobieństwo do już wybranych
             is_diverse = True
             for selected in diverse_items:
-                # Proste sprawdzenie podobieństwa na podstawie słów kluczowych
-                item_words = set(item['document'].lower().split()[:20])  # Pierwsze 20 słów
-                selected_words = set(selected['document'].lower().split()[:20])
+                if item.get('embedding') is not None and selected.get('embedding') is not None:
+                    # Podobieństwo semantyczne (embeddingi z bazy wektorowej)
+                    item_vec = np.asarray(item['embedding'], dtype=np.float32)
+                    selected_vec = np.asarray(selected['embedding'], dtype=np.float32)
+                    overlap = float(item_vec @ selected_vec /
+                                    max(np.linalg.norm(item_vec) * np.linalg.norm(selected_vec), 1e-12))
+                else:
+                    # Proste sprawdzenie podobieństwa na podstawie słów kluczowych
+                    item_words = set(item['document'].lower().split()[:20])  # Pierwsze 20 słów
+                    selected_words = set(selected['document'].lower().split()[:20])
+                    overlap = len(item_words.intersection(selected_words)) / max(len(item_words.union(selected_words)), 1)
                 
-                overlap = len(item_words.intersection(selected_words)) / max(len(item_words.union(selected_words)), 1)
                 if overlap > self.diversity_penalty:
                     is_diverse = False
                     break
@@ -759,25 +999,75 @@ class EnhancedRAGService:
             if not self.claude_client:
                 return self._generate_fallback_answer(query, context, analysis), 0.6
             
-            # Przygotuj kontekst z metadanymi
-            context_text = ""
-            for i, doc in enumerate(context.documents):
-                metadata = context.metadatas[i] if i < len(context.metadatas) else {}
-                source = metadata.get('source', f'Dokument {i+1}')
-                context_text += f"\n[Źródło: {source}]\n{doc}\n"
+            model, prompt = self._build_answer_prompt(query, context, analysis, conversation_context)
+            
+            message = self.claude_client.messages.create(
+                model=model,
+                max_tokens=2048,
+                temperature=0.2,  # Niższa temperatura dla większej precyzji
+                messages=[{"role": "user", "content": prompt}]
+            )
+            
+            answer = message.content[0].text
+            
+            # Oblicz confidence na podstawie różnych czynników
+            confidence = self._calculate_answer_confidence(query, answer, context, analysis)
+            
+            return answer, confidence
+            
+        except Exception as e:
+            logger.error(f"Enhanced answer generation failed: {e}")
+            return self._generate_fallback_answer(query, context, analysis), 0.5
+
+    async def _enhanced_answer_generation_async(self, state: "QueryPipelineState") -> Tuple[str, float]:
+        """Generowanie odpowiedzi klientem async - bez blokowania pętli zdarzeń na czas wywołania HTTP"""
+        query, context, analysis = state.query, state.context, state.query_analysis
+        if not self.async_claude_client:
+            # Brak klienta async - klient synchroniczny (lub odpowiedź zastępcza) w puli wątków
+            return await self._run_blocking(self._enhanced_answer_generation, query, context, state.reasoning_chain,
+                                            analysis, state.conversation_context)
+        
+        try:
+            model, prompt = self._build_answer_prompt(query, context, analysis, state.conversation_context)
             
-            # Przygotuj historię konwersacji
-            conversation_history = ""
-            if len(conversation_context.history) > 1:
-                recent_queries = list(conversation_context.history)[-3:]
-                conversation_history = "\nKONTEKST KONWERSACJI:\n"
-                for h in recent_queries:
-                    conversation_history += f"- {h['query']}\n"
+            message = await self.async_claude_client.messages.create(
+                model=model,
+                max_tokens=2048,
+                temperature=0.2,
+                messages=[{"role": "user", "content": prompt}]
+            )
             
-            # Dostosuj prompt do typu zapytania
-            type_specific_instructions = self._get_type_specific_instructions(analysis['type'])
+            answer = message.content[0].text
+            confidence = self._calculate_answer_confidence(query, answer, context, analysis)
             
-            prompt = f"""Jesteś ekspertem systemów ERP Comarch XL z wieloletnim doświadczeniem. 
+            return answer, confidence
+            
+        except Exception as e:
+            logger.error(f"Async answer generation failed: {e}")
+            return self._generate_fallback_answer(query, context, analysis), 0.5
+
+    def _build_answer_prompt(self, query: str, context: RetrievalContext, analysis: Dict[str, Any],
+                             conversation_context: ConversationContext) -> Tuple[str, str]:
+        """Buduje prompt odpowiedzi i wybiera model (wspólne dla trybu zwykłego i strumieniowego)"""
+        # Przygotuj kontekst z metadanymi
+        context_text = ""
+        for i, doc in enumerate(context.documents):
+            metadata = context.metadatas[i] if i < len(context.metadatas) else {}
+            source = metadata.get('source', f'Dokument {i+1}')
+            context_text += f"\n[Źródło: {source}]\n{doc}\n"
+
+        # Przygotuj historię konwersacji
+        conversation_history = ""
+        if len(conversation_context.history) > 1:
+            recent_queries = list(conversation_context.history)[-3:]
+            conversation_history = "\nKONTEKST KONWERSACJI:\n"
+            for h in recent_queries:
+                conversation_history += f"- {h['query']}\n"
+
+        # Dostosuj prompt do typu zapytania
+        type_specific_instructions = self._get_type_specific_instructions(analysis['type'])
+
+        prompt = f"""Jesteś ekspertem systemów ERP Comarch XL z wieloletnim doświadczeniem. 
 
 {conversation_history}
 
@@ -801,26 +1091,38 @@ INSTRUKCJE OGÓLNE:
 
 ODPOWIEDŹ:"""
 
-            # Wybierz odpowiedni model na podstawie złożoności
-            model = self.config.CLAUDE_MODEL if analysis['complexity'] in ['medium', 'complex'] else self.config.CLAUDE_HAIKU_MODEL
-            
-            message = self.claude_client.messages.create(
+        # Wybierz odpowiedni model na podstawie złożoności
+        model = self._config_value('CLAUDE_MODEL') if analysis['complexity'] in ['medium', 'complex'] else self._config_value('CLAUDE_HAIKU_MODEL', self._config_value('CLAUDE_MODEL'))
+        
+        return model, prompt
+
+    def _stream_answer_tokens(self, state: QueryPipelineState) -> Iterator[str]:
+        """Fragmenty odpowiedzi ze strumieniowego Messages API (lub odpowiedź zastępcza w całości)"""
+        if not self.claude_client:
+            yield self._generate_fallback_answer(state.query, state.context, state.query_analysis)
+            return
+        
+        model, prompt = self._build_answer_prompt(state.query, state.context, state.query_analysis,
+                                                  state.conversation_context)
+        streamed_any = False
+        try:
+            stream = self.claude_client.messages.create(
                 model=model,
                 max_tokens=2048,
-                temperature=0.2,  # Niższa temperatura dla większej precyzji
-                messages=[{"role": "user", "content": prompt}]
+                temperature=0.2,
+                messages=[{"role": "user", "content": prompt}],
+                stream=True
             )
-            
-            answer = message.content[0].text
-            
-            # Oblicz confidence na podstawie różnych czynników
-            confidence = self._calculate_answer_confidence(query, answer, context, analysis)
-            
-            return answer, confidence
-            
+            for event in stream:
+                if getattr(event, 'type', None) == 'content_block_delta':
+                    text = getattr(event.delta, 'text', None)
+                    if text:
+                        streamed_any = True
+                        yield text
         except Exception as e:
-            logger.error(f"Enhanced answer generation failed: {e}")
-            return self._generate_fallback_answer(query, context, analysis), 0.5
+            logger.error(f"Streaming answer generation failed: {e}")
+            if not streamed_any:
+                yield self._generate_fallback_answer(state.query, state.context, state.query_analysis)
 
     def _get_type_specific_instructions(self, query_type: str) -> str:
         """Pobiera instrukcje specificzne dla typu zapytania"""
@@ -1135,6 +1437,8 @@ SPECJALNE INSTRUKCJE DLA RAPORTOWANIA:
             self.performance_metrics['processing_times'].append(processing_time)
             self.performance_metrics['confidence_scores'].append(response.confidence)
             self.performance_metrics['validation_scores'].append(response.validation_score)
+            for stage, duration in response.stage_timings_ms.items():
+                self.performance_metrics[f'stage_{stage}'].append(duration)
             self.query_patterns[response.query_type.value] += 1
             
             # Keep only last 100 metrics
@@ -1186,12 +1490,18 @@ SPECJALNE INSTRUKCJE DLA RAPORTOWANIA:
                 base_metrics['avg_processing_time'] = np.mean(self.performance_metrics['processing_times'])
                 base_metrics['avg_confidence'] = np.mean(self.performance_metrics['confidence_scores'])
                 base_metrics['avg_validation'] = np.mean(self.performance_metrics['validation_scores'])
+                base_metrics['avg_stage_latency_ms'] = {
+                    metric[len('stage_'):]: round(float(np.mean(values)), 2)
+                    for metric, values in self.performance_metrics.items()
+                    if metric.startswith('stage_') and values
+                }
             
             # Query patterns
             base_metrics['query_patterns'] = dict(self.query_patterns)
             
             # Cache stats
             base_metrics['cache_size'] = len(self.response_cache)
+            base_metrics['response_cache'] = self.response_cache.get_stats()
             base_metrics['feedback_count'] = len(self.feedback_history)
             
             # Enhanced features status
@@ -1217,6 +1527,10 @@ SPECJALNE INSTRUKCJE DLA RAPORTOWANIA:
                 'last_update': datetime.now().isoformat()
             }
 
+    def notify_collection_changed(self):
+        """Wywoływać po każdym zapisie do kolekcji (add/upsert/update/delete) - nowa epoka cache"""
+        self.response_cache.invalidate()
+
     def initialize_with_documents(self, documents: List[str], metadatas: List[Dict[str, Any]]):
         """Inicjalizacja z dokumentami - rozszerzona wersja"""
         try:
@@ -1232,7 +1546,7 @@ SPECJALNE INSTRUKCJE DLA RAPORTOWANIA:
             
             for i in range(0, len(documents), batch_size):
                 batch = documents[i:i+batch_size]
-                embeddings = self.embeddings_model.encode(batch).tolist()
+                embeddings = cached_encode(batch, self.embeddings_model.encode, self.embedding_store).tolist()
                 all_embeddings.extend(embeddings)
                 logger.info(f"📊 Processed {min(i+batch_size, len(documents))}/{len(documents)} documents")
             
@@ -1251,12 +1565,16 @@ SPECJALNE INSTRUKCJE DLA RAPORTOWANIA:
                 })
                 enhanced_metadatas.append(enhanced_meta)
             
-            self.collection.add(
-                documents=documents,
-                metadatas=enhanced_metadatas,
-                ids=ids,
-                embeddings=all_embeddings
-            )
+            try:
+                self.collection.add(
+                    documents=documents,
+                    metadatas=enhanced_metadatas,
+                    ids=ids,
+                    embeddings=all_embeddings
+                )
+            finally:
+                # Kolekcja mogła się zmienić (także częściowo) - odpowiedzi z cache mogą być nieaktualne
+                self.notify_collection_changed()
             
             logger.info(f"✅ Enhanced RAG v3.0 initialized with {len(documents)} documents")
             logger.info("🎯 Available features: Multi-model reasoning, Adaptive compression, Fact-checking, Citations")
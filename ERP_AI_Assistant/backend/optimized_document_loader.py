@@ -14,12 +14,15 @@ import hashlib
 import time
 import multiprocessing
 from datetime import datetime, timedelta
-from typing import Dict, Any, List, Optional, Callable
+from typing import Dict, Any, List, Optional, Callable, Tuple
 from dataclasses import dataclass, asdict
-from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, wait, FIRST_COMPLETED
 from pathlib import Path
 import threading
 
+from app.services.file_discovery import FileDiscovery
+from app.services.encoding_detection import EncodingDetector
+
 # HTML/XML parsing
 try:
     from bs4 import BeautifulSoup
@@ -56,6 +59,7 @@ class DocumentMetadata:
     document_type: str
     processing_time_ms: float
     word_count: int
+    encoding: str = ''
 
 @dataclass
 class LoaderStats:
@@ -67,23 +71,87 @@ class LoaderStats:
     average_processing_time: float
     errors_count: int
     last_run: datetime
+    bytes_processed: int = 0
+    files_per_second: float = 0.0
+    bytes_per_second: float = 0.0
 
 # ============================================================================
 # DOCUMENT CACHE
 # ============================================================================
 
 class DocumentCache:
-    """Cache dla dokumentów z SQLite"""
+    """Cache dla dokumentów z SQLite
+    
+    Jedno połączenie (WAL) na wątek, stałe teksty zapytań - sqlite3 trzyma je skompilowane
+    w cache'u instrukcji połączenia. last_accessed zapisywany partiami w tle.
+    """
+    
+    _SELECT_SQL = """
+        SELECT content, metadata, created_at FROM document_cache 
+        WHERE file_path = ? AND content_hash = ? AND created_at > ?
+    """
+    # Lista ścieżek jako jeden parametr JSON - ten sam tekst zapytania dla każdej partii
+    _SELECT_MANY_SQL = """
+        SELECT file_path, content_hash, content, metadata, created_at FROM document_cache 
+        WHERE file_path IN (SELECT value FROM json_each(?)) AND created_at > ?
+    """
+    _INSERT_SQL = """
+        INSERT OR REPLACE INTO document_cache 
+        (file_path, content_hash, content, metadata, created_at, last_accessed)
+        VALUES (?, ?, ?, ?, ?, ?)
+    """
+    _SELECT_ENCODINGS_SQL = """
+        SELECT file_path, json_extract(metadata, '$.encoding') FROM document_cache 
+        WHERE file_path IN (SELECT value FROM json_each(?))
+    """
+    _TOUCH_SQL = "UPDATE document_cache SET last_accessed = ? WHERE file_path = ?"
     
-    def __init__(self, cache_file: str = "document_cache.db", ttl_hours: int = 24):
+    def __init__(self, cache_file: str = "document_cache.db", ttl_hours: int = 24,
+                 touch_interval: float = 1.0, busy_timeout_ms: int = 5000):
         self.cache_file = cache_file
         self.ttl_hours = ttl_hours
-        self._init_cache()
+        self.touch_interval = touch_interval
+        self.busy_timeout_ms = busy_timeout_ms
+        
+        # Pula połączeń: wątek -> połączenie; połączenia zakończonych wątków są przejmowane
+        self._local = threading.local()
+        self._connections: Dict[threading.Thread, sqlite3.Connection] = {}
+        self._pool_lock = threading.Lock()
+        
+        # Odczyty z cache'u oczekujące na zapis last_accessed
+        self._pending_touches: Dict[str, datetime] = {}
+        self._touch_lock = threading.Lock()
+        self._touch_event = threading.Event()
+        self._touch_thread: Optional[threading.Thread] = None
+        self._closed = False
         
+        self._init_cache()
+    
+    def _connection(self) -> sqlite3.Connection:
+        """Połączenie bieżącego wątku (sqlite3 nie współdzieli połączeń między wątkami)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            return conn
+        
+        current = threading.current_thread()
+        with self._pool_lock:
+            finished = next((thread for thread in self._connections if not thread.is_alive()), None)
+            if finished is not None:
+                conn = self._connections.pop(finished)
+            else:
+                conn = sqlite3.connect(self.cache_file, timeout=self.busy_timeout_ms / 1000,
+                                       check_same_thread=False, cached_statements=32)
+                conn.execute("PRAGMA journal_mode=WAL")
+                conn.execute("PRAGMA synchronous=NORMAL")
+                conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._connections[current] = conn
+        self._local.conn = conn
+        return conn
+    
     def _init_cache(self):
         """Inicjalizuje cache bazę danych"""
         try:
-            conn = sqlite3.connect(self.cache_file)
+            conn = self._connection()
             cursor = conn.cursor()
             
             cursor.execute("""
@@ -106,7 +174,6 @@ class DocumentCache:
             """)
             
             conn.commit()
-            conn.close()
             
         except Exception as e:
             logger.error(f"Cache initialization failed: {e}")
@@ -114,77 +181,153 @@ class DocumentCache:
     def get(self, file_path: str, file_hash: str) -> Optional[Dict[str, Any]]:
         """Pobiera dokument z cache"""
         try:
-            conn = sqlite3.connect(self.cache_file)
-            cursor = conn.cursor()
-            
             # Sprawdź czy dokument istnieje i nie jest wygasły
             cutoff_time = datetime.now() - timedelta(hours=self.ttl_hours)
-            
-            cursor.execute("""
-                SELECT content, metadata, created_at FROM document_cache 
-                WHERE file_path = ? AND content_hash = ? AND created_at > ?
-            """, (file_path, file_hash, cutoff_time))
-            
-            result = cursor.fetchone()
+            result = self._connection().execute(self._SELECT_SQL, (file_path, file_hash, cutoff_time)).fetchone()
             
             if result:
-                # Update last accessed
-                cursor.execute("""
-                    UPDATE document_cache SET last_accessed = ? WHERE file_path = ?
-                """, (datetime.now(), file_path))
-                conn.commit()
-                
+                self._touch([file_path])
                 return {
                     'content': result[0],
-                    'metadata': json.loads(result[1]),
+                    'metadata': self._load_metadata(result[1]),
                     'cached_at': result[2]
                 }
             
-            conn.close()
             return None
             
         except Exception as e:
             logger.error(f"Cache get failed: {e}")
             return None
 
+    def get_many(self, paths_hashes: List[Tuple[str, str]]) -> Dict[str, Dict[str, Any]]:
+        """Pobiera partię dokumentów jednym zapytaniem - {file_path: dokument} dla trafień"""
+        if not paths_hashes:
+            return {}
+        try:
+            expected = dict(paths_hashes)
+            cutoff_time = datetime.now() - timedelta(hours=self.ttl_hours)
+            rows = self._connection().execute(
+                self._SELECT_MANY_SQL, (json.dumps(list(expected)), cutoff_time)
+            ).fetchall()
+            
+            documents = {}
+            for file_path, content_hash, content, metadata, created_at in rows:
+                if expected.get(file_path) == content_hash:
+                    documents[file_path] = {
+                        'content': content,
+                        'metadata': self._load_metadata(metadata),
+                        'cached_at': created_at
+                    }
+            
+            self._touch(list(documents))
+            return documents
+            
+        except Exception as e:
+            logger.error(f"Cache get_many failed: {e}")
+            return {}
+
+    def get_encodings(self, file_paths: List[str]) -> Dict[str, str]:
+        """Kodowania zapisane przy poprzednim przetworzeniu plików (także zmienionych od tamtej pory)"""
+        if not file_paths:
+            return {}
+        try:
+            rows = self._connection().execute(self._SELECT_ENCODINGS_SQL, (json.dumps(file_paths),)).fetchall()
+            return {file_path: encoding for file_path, encoding in rows if encoding}
+        except Exception as e:
+            logger.error(f"Cache get_encodings failed: {e}")
+            return {}
+
     def put(self, file_path: str, file_hash: str, content: str, metadata: Dict[str, Any]):
         """Zapisuje dokument do cache"""
         try:
-            conn = sqlite3.connect(self.cache_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT OR REPLACE INTO document_cache 
-                (file_path, content_hash, content, metadata, created_at, last_accessed)
-                VALUES (?, ?, ?, ?, ?, ?)
-            """, (
-                file_path, 
-                file_hash, 
-                content, 
-                json.dumps(metadata),
-                datetime.now(),
-                datetime.now()
-            ))
-            
+            conn = self._connection()
+            now = datetime.now()
+            conn.execute(self._INSERT_SQL, (file_path, file_hash, content, self._dump_metadata(metadata), now, now))
             conn.commit()
-            conn.close()
             
         except Exception as e:
             logger.error(f"Cache put failed: {e}")
 
+    @staticmethod
+    def _dump_metadata(metadata: Dict[str, Any]) -> str:
+        """Metadane jako JSON - last_modified (datetime) zapisywane w ISO 8601"""
+        return json.dumps(metadata, default=lambda value: value.isoformat() if isinstance(value, datetime) else str(value))
+
+    @staticmethod
+    def _load_metadata(text: str) -> Dict[str, Any]:
+        """Odwrotność _dump_metadata - trafienie w cache'u zwraca last_modified jako datetime, jak przetworzenie pliku"""
+        metadata = json.loads(text)
+        if isinstance(metadata.get('last_modified'), str):
+            metadata['last_modified'] = datetime.fromisoformat(metadata['last_modified'])
+        return metadata
+
+    def _touch(self, file_paths: List[str]):
+        """Odkłada aktualizację last_accessed - zapis partiami w wątku w tle"""
+        if not file_paths:
+            return
+        now = datetime.now()
+        with self._touch_lock:
+            for file_path in file_paths:
+                self._pending_touches[file_path] = now
+            if self._touch_thread is None and not self._closed:
+                self._touch_thread = threading.Thread(target=self._touch_loop, name="document-cache-touch",
+                                                      daemon=True)
+                self._touch_thread.start()
+
+    def _touch_loop(self):
+        while not self._touch_event.wait(self.touch_interval):
+            self.flush_touches()
+
+    def flush_touches(self) -> int:
+        """Zapisuje oczekujące last_accessed jedną transakcją"""
+        with self._touch_lock:
+            pending, self._pending_touches = self._pending_touches, {}
+        if not pending:
+            return 0
+        try:
+            conn = self._connection()
+            with conn:
+                conn.executemany(self._TOUCH_SQL, [(accessed, file_path) for file_path, accessed in pending.items()])
+            return len(pending)
+        except Exception as e:
+            logger.error(f"Cache touch flush failed: {e}")
+            return 0
+
+    def close(self):
+        """Zapisuje oczekujące last_accessed i zamyka wszystkie połączenia puli"""
+        with self._touch_lock:
+            self._closed = True
+            touch_thread, self._touch_thread = self._touch_thread, None
+        if touch_thread is not None:
+            self._touch_event.set()
+            touch_thread.join()
+        self.flush_touches()
+        
+        with self._pool_lock:
+            connections = list(self._connections.values())
+            self._connections.clear()
+            self._local = threading.local()
+        for conn in connections:
+            try:
+                conn.close()
+            except Exception as e:
+                logger.warning(f"Cache connection close failed: {e}")
+
+    def reopen(self):
+        """Ponowne otwarcie po close() (np. po usunięciu pliku bazy)"""
+        self.close()
+        self._touch_event.clear()
+        self._closed = False
+        self._init_cache()
+
     def cleanup_expired(self):
         """Usuwa wygasłe wpisy z cache"""
         try:
-            conn = sqlite3.connect(self.cache_file)
-            cursor = conn.cursor()
-            
+            conn = self._connection()
             cutoff_time = datetime.now() - timedelta(hours=self.ttl_hours)
             
-            cursor.execute("DELETE FROM document_cache WHERE created_at < ?", (cutoff_time,))
-            deleted = cursor.rowcount
-            
-            conn.commit()
-            conn.close()
+            with conn:
+                deleted = conn.execute("DELETE FROM document_cache WHERE created_at < ?", (cutoff_time,)).rowcount
             
             if deleted > 0:
                 logger.info(f"🧹 Cleaned up {deleted} expired cache entries")
@@ -195,8 +338,7 @@ class DocumentCache:
     def get_cache_stats(self) -> Dict[str, Any]:
         """Pobiera statystyki cache"""
         try:
-            conn = sqlite3.connect(self.cache_file)
-            cursor = conn.cursor()
+            cursor = self._connection().cursor()
             
             cursor.execute("SELECT COUNT(*) FROM document_cache")
             total_entries = cursor.fetchone()[0]
@@ -208,8 +350,6 @@ class DocumentCache:
             cursor.execute("SELECT COUNT(*) FROM document_cache WHERE created_at > ?", (cutoff_time,))
             valid_entries = cursor.fetchone()[0]
             
-            conn.close()
-            
             return {
                 'total_entries': total_entries,
                 'valid_entries': valid_entries,
@@ -231,10 +371,25 @@ class DocumentCache:
 class OptimizedComarchDocumentLoader:
     """Zoptymalizowany loader dokumentów Comarch"""
     
-    def __init__(self, cache_enabled: bool = True, max_workers: int = 4, batch_size: int = 50):
+    SUPPORTED_EXTENSIONS = frozenset({'.html', '.xml', '.txt', '.md', '.json'})
+    # Limit czasu przetwarzania jednego pliku (liczony od startu w wątku roboczym)
+    FILE_TIMEOUT = 30
+    
+    def __init__(self, cache_enabled: bool = True, max_workers: int = 4, batch_size: int = 50,
+                 window_size: Optional[int] = None):
         self.cache_enabled = cache_enabled
         self.max_workers = max_workers
         self.batch_size = batch_size
+        # Przesuwne okno plików w toku - nowy plik startuje, gdy dowolny się zakończy
+        self.window_size = window_size or max_workers * 2
+        
+        # Pula wątków tworzona raz i używana przez kolejne ładowania
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Osobny wątek sprawdzania cache'u partii - zawieszone pliki nie blokują kolejnych partii
+        self._lookup_executor: Optional[ThreadPoolExecutor] = None
+        
+        # BOM / deklaracja / kodowanie wyuczone dla katalogu zamiast prób kolejnych kodowań
+        self.encoding_detector = EncodingDetector()
         
         # Cache
         self.cache = DocumentCache() if cache_enabled else None
@@ -285,22 +440,7 @@ class OptimizedComarchDocumentLoader:
         if self.cache:
             self.cache.cleanup_expired()
         
-        # Process in batches
-        all_documents = []
-        
-        for i in range(0, len(all_files), self.batch_size):
-            batch = all_files[i:i + self.batch_size]
-            
-            # Process batch with threading
-            batch_docs = self._process_batch(batch, progress, progress_callback)
-            all_documents.extend(batch_docs)
-            
-            # Update progress
-            progress.processed_files = min(i + self.batch_size, len(all_files))
-            progress.percentage = (progress.processed_files / progress.total_files) * 100
-            
-            if progress_callback:
-                progress_callback(progress)
+        all_documents = self._process_files(all_files, progress, progress_callback)
         
         # Update stats
         processing_time = time.time() - start_time
@@ -308,8 +448,13 @@ class OptimizedComarchDocumentLoader:
         self.stats.processing_time_total = processing_time
         self.stats.average_processing_time = processing_time / max(len(all_documents), 1)
         self.stats.last_run = datetime.now()
+        self.stats.bytes_processed = sum(doc.get('file_size', 0) for doc in all_documents)
+        self.stats.files_per_second = len(all_files) / max(processing_time, 1e-9)
+        self.stats.bytes_per_second = self.stats.bytes_processed / max(processing_time, 1e-9)
         
         logger.info(f"✅ Loaded {len(all_documents)} documents in {processing_time:.2f}s")
+        logger.info(f"   Throughput: {self.stats.files_per_second:.1f} files/s, "
+                    f"{self.stats.bytes_per_second / (1024 * 1024):.2f} MB/s")
         logger.info(f"   Cache hits: {self.stats.cache_hits}")
         logger.info(f"   Cache misses: {self.stats.cache_misses}")
         logger.info(f"   Errors: {self.stats.errors_count}")
@@ -318,8 +463,6 @@ class OptimizedComarchDocumentLoader:
 
     def _discover_files(self) -> List[str]:
         """Znajduje wszystkie pliki do przetworzenia"""
-        files = []
-        
         # Sprawdź główne katalogi z dokumentacją
         search_paths = [
             "BazaWiedzy",
@@ -329,70 +472,163 @@ class OptimizedComarchDocumentLoader:
             "docs"
         ]
         
-        for search_path in search_paths:
-            if os.path.exists(search_path):
-                files.extend(self._scan_directory(search_path))
-        
-        return files
+        # Katalogi skanowane równolegle; plik osiągalny z kilku z nich (np. dowiązanie) występuje raz
+        existing = [search_path for search_path in search_paths if os.path.exists(search_path)]
+        discovery = FileDiscovery(existing, recursive_extensions=self.SUPPORTED_EXTENSIONS)
+        return [item.path for item in discovery.scan()]
 
     def _scan_directory(self, directory: str) -> List[str]:
         """Skanuje katalog rekurencyjnie"""
-        files = []
-        
-        try:
-            for root, dirs, filenames in os.walk(directory):
-                for filename in filenames:
-                    if self._is_supported_file(filename):
-                        file_path = os.path.join(root, filename)
-                        files.append(file_path)
-        
-        except Exception as e:
-            logger.error(f"Directory scan failed for {directory}: {e}")
-        
-        return files
+        discovery = FileDiscovery([directory], recursive_extensions=self.SUPPORTED_EXTENSIONS)
+        return [item.path for item in discovery.scan()]
 
     def _is_supported_file(self, filename: str) -> bool:
         """Sprawdza czy plik jest obsługiwany"""
-        supported_extensions = {'.html', '.xml', '.txt', '.md', '.json'}
-        return any(filename.lower().endswith(ext) for ext in supported_extensions)
-
-    def _process_batch(self, file_batch: List[str], progress: ProcessingProgress, 
-                      progress_callback: Optional[Callable[[ProcessingProgress], None]]) -> List[Dict[str, Any]]:
-        """Przetwarza batch plików z threading"""
-        documents = []
-        
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all files in batch
-            futures = {
-                executor.submit(self._process_single_file, file_path): file_path 
-                for file_path in file_batch
-            }
-            
-            # Collect results
-            for future in futures:
-                file_path = futures[future]
+        return os.path.splitext(filename)[1].lower() in self.SUPPORTED_EXTENSIONS
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Trwała pula wątków (połączenia cache'u per wątek też przetrwają między partiami)"""
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix="document-loader")
+        return self._executor
+
+    def _get_lookup_executor(self) -> ThreadPoolExecutor:
+        """Jednowątkowa pula dla _lookup_batch, niezależna od wątków przetwarzających pliki"""
+        if self._lookup_executor is None:
+            self._lookup_executor = ThreadPoolExecutor(max_workers=1,
+                                                       thread_name_prefix="document-loader-lookup")
+        return self._lookup_executor
+
+    def _lookup_batch(self, batch: List[str]) -> Tuple[Dict[str, str], Dict[str, Dict[str, Any]], Dict[str, tuple]]:
+        """Hashe plików partii i trafienia w cache'u - jedno zapytanie zamiast połączenia na plik
+        
+        Dla plików spoza cache'u zwraca (bajty, zapamiętane kodowanie) - plik czytany jest raz.
+        """
+        if not self.cache:
+            return {}, {}, {}
+        contents = {file_path: self._read_file_bytes(file_path) for file_path in batch}
+        file_hashes = {file_path: self._calculate_file_hash(file_path, raw) for file_path, raw in contents.items()}
+        cached_docs = self.cache.get_many(list(file_hashes.items()))
+        with self._lock:
+            self.stats.cache_hits += len(cached_docs)
+        
+        misses = [file_path for file_path in batch if file_path not in cached_docs]
+        encodings = self.cache.get_encodings(misses)
+        pending = {file_path: (contents[file_path], encodings.get(file_path)) for file_path in misses}
+        return file_hashes, cached_docs, pending
+
+    def _process_files(self, files: List[str], progress: Optional[ProcessingProgress] = None,
+                       progress_callback: Optional[Callable[[ProcessingProgress], None]] = None) -> List[Dict[str, Any]]:
+        """Przetwarza pliki w przesuwnym oknie - bez czekania na najwolniejszy plik partii
+        
+        Partie batch_size służą tylko do zbiorczego sprawdzenia cache'u (get_many, z wyprzedzeniem
+        o jedną partię, we własnym wątku); pliki spoza cache'u trafiają do okna window_size i są odbierane
+        w kolejności ukończenia.
+        Wynik zachowuje kolejność plików wejściowych.
+        """
+        executor = self._get_executor()
+        lookup_executor = self._get_lookup_executor()
+        results: Dict[int, Dict[str, Any]] = {}
+        in_flight: Dict[Future, Tuple[int, str]] = {}
+        arguments: Dict[str, tuple] = {}
+        started: Dict[str, float] = {}
+        # Pliki usunięte z okna po przekroczeniu limitu czasu, których wątki nadal pracują
+        hung: List[Future] = []
+        
+        def run(file_path: str, file_hash: Optional[str], raw: Optional[bytes], encoding_hint: Optional[str]):
+            started[file_path] = time.monotonic()
+            return self._process_single_file(file_path, file_hash, raw, encoding_hint)
+        
+        def submit(index: int, file_path: str, *args):
+            arguments[file_path] = args
+            in_flight[executor.submit(run, file_path, *args)] = (index, file_path)
+        
+        def replace_executor():
+            """Wszystkie wątki zajęte przez zawieszone pliki - nowa pula, nierozpoczęte pliki od nowa"""
+            nonlocal executor
+            logger.warning(f"{len(hung)} hung files occupy all {self.max_workers} workers - restarting the pool")
+            executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            executor = self._get_executor()
+            hung.clear()
+            for future, (index, file_path) in list(in_flight.items()):
+                if future.cancelled():
+                    del in_flight[future]
+                    submit(index, file_path, *arguments[file_path])
+        
+        def finished(index: int, file_path: str, result: Optional[Dict[str, Any]] = None,
+                     error: Optional[str] = None):
+            if result:
+                results[index] = result
+            if error:
+                with self._lock:
+                    self.stats.errors_count += 1
+                if progress:
+                    progress.errors.append(f"{file_path}: {error}")
+                logger.warning(f"Failed to process {file_path}: {error}")
+            if progress:
+                progress.processed_files += 1
+                progress.current_file = os.path.basename(file_path)
+                progress.percentage = (progress.processed_files / max(progress.total_files, 1)) * 100
+                if progress_callback:
+                    progress_callback(progress)
+        
+        def collect(limit: int):
+            """Odbiera ukończone pliki, aż w oknie zostanie najwyżej limit plików"""
+            while len(in_flight) > limit:
+                done, _ = wait(in_flight, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    index, file_path = in_flight.pop(future)
+                    arguments.pop(file_path, None)
+                    try:
+                        finished(index, file_path, future.result())
+                    except Exception as e:
+                        finished(index, file_path, error=str(e))
                 
-                try:
-                    progress.current_file = os.path.basename(file_path)
-                    if progress_callback:
-                        progress_callback(progress)
-                    
-                    result = future.result(timeout=30)  # 30s timeout per file
-                    
-                    if result:
-                        documents.append(result)
-                    
-                except Exception as e:
-                    with self._lock:
-                        self.stats.errors_count += 1
-                        progress.errors.append(f"{file_path}: {str(e)}")
-                    
-                    logger.warning(f"Failed to process {file_path}: {e}")
+                # Plik przekraczający limit czasu nie blokuje okna (wątku nie da się przerwać)
+                now = time.monotonic()
+                for future, (index, file_path) in list(in_flight.items()):
+                    if file_path in started and now - started[file_path] > self.FILE_TIMEOUT:
+                        del in_flight[future]
+                        arguments.pop(file_path, None)
+                        hung.append(future)
+                        finished(index, file_path, error=f"timeout after {self.FILE_TIMEOUT}s")
+                
+                # Zawieszone wątki nie wracają do puli - pliki w kolejce nigdy by nie wystartowały
+                hung[:] = [future for future in hung if not future.done()]
+                if len(hung) >= self.max_workers and in_flight:
+                    replace_executor()
+        
+        offsets = range(0, len(files), self.batch_size)
+        lookup = lookup_executor.submit(self._lookup_batch, files[:self.batch_size]) if files else None
+        for offset in offsets:
+            batch = files[offset:offset + self.batch_size]
+            file_hashes, cached_docs, pending = lookup.result()
+            # Sprawdzenie cache'u następnej partii w tle, razem z plikami bieżącej
+            if offset + self.batch_size < len(files):
+                lookup = lookup_executor.submit(self._lookup_batch,
+                                                files[offset + self.batch_size:offset + 2 * self.batch_size])
+            
+            for index, file_path in enumerate(batch, offset):
+                if file_path in cached_docs:
+                    cached_doc = cached_docs[file_path]
+                    finished(index, file_path,
+                             self._create_document_dict(file_path, cached_doc['content'], cached_doc['metadata']))
+                    continue
+                collect(self.window_size - 1)
+                raw, encoding_hint = pending.pop(file_path, (None, None))
+                submit(index, file_path, file_hashes.get(file_path), raw, encoding_hint)
         
-        return documents
+        collect(0)
+        return [results[index] for index in sorted(results)]
 
-    def _process_single_file(self, file_path: str) -> Optional[Dict[str, Any]]:
-        """Przetwarza pojedynczy plik"""
+    def _process_single_file(self, file_path: str, file_hash: Optional[str] = None, raw: Optional[bytes] = None,
+                             encoding_hint: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """Przetwarza pojedynczy plik (podany file_hash - cache sprawdzony już dla całej partii)
+        
+        raw to bajty pliku przeczytane przy sprawdzaniu cache'u - plik nie jest czytany ponownie.
+        """
         start_time = time.time()
         
         try:
@@ -404,11 +640,16 @@ class OptimizedComarchDocumentLoader:
             file_size = file_stat.st_size
             last_modified = datetime.fromtimestamp(file_stat.st_mtime)
             
+            if raw is None:
+                raw = self._read_file_bytes(file_path)
+            
             # Generate content hash
-            file_hash = self._calculate_file_hash(file_path)
+            checked_in_batch = file_hash is not None
+            if not checked_in_batch:
+                file_hash = self._calculate_file_hash(file_path, raw)
             
             # Try cache first
-            if self.cache:
+            if self.cache and not checked_in_batch:
                 cached_doc = self.cache.get(file_path, file_hash)
                 if cached_doc:
                     with self._lock:
@@ -420,9 +661,10 @@ class OptimizedComarchDocumentLoader:
                 self.stats.cache_misses += 1
             
             # Read and process content
-            content = self._read_file_content(file_path)
-            if not content:
+            decoded = self._read_file_content(file_path, raw, encoding_hint)
+            if not decoded or not decoded[0]:
                 return None
+            content, encoding = decoded
             
             # Extract text from content
             text_content = self._extract_text_content(content, file_path)
@@ -437,7 +679,8 @@ class OptimizedComarchDocumentLoader:
                 category=self._determine_category(file_path),
                 document_type=self._determine_document_type(file_path),
                 processing_time_ms=(time.time() - start_time) * 1000,
-                word_count=len(text_content.split())
+                word_count=len(text_content.split()),
+                encoding=encoding
             )
             
             # Cache the result
@@ -450,37 +693,32 @@ class OptimizedComarchDocumentLoader:
             logger.error(f"Error processing {file_path}: {e}")
             return None
 
-    def _calculate_file_hash(self, file_path: str) -> str:
-        """Oblicza hash pliku"""
+    def _read_file_bytes(self, file_path: str) -> Optional[bytes]:
+        """Jeden odczyt pliku - bajty służą do hasha i dekodowania"""
         try:
-            hasher = hashlib.md5()
             with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hasher.update(chunk)
-            return hasher.hexdigest()
-        except:
-            return ""
+                return f.read()
+        except OSError as e:
+            logger.error(f"Failed to read {file_path}: {e}")
+            return None
 
-    def _read_file_content(self, file_path: str) -> Optional[str]:
-        """Czyta zawartość pliku"""
+    def _calculate_file_hash(self, file_path: str, raw: Optional[bytes] = None) -> str:
+        """Oblicza hash pliku"""
+        if raw is None:
+            raw = self._read_file_bytes(file_path)
+        return hashlib.md5(raw).hexdigest() if raw is not None else ""
+
+    def _read_file_content(self, file_path: str, raw: Optional[bytes] = None,
+                           encoding_hint: Optional[str] = None) -> Optional[Tuple[str, str]]:
+        """Dekoduje zawartość pliku - (tekst, kodowanie)"""
+        if raw is None:
+            raw = self._read_file_bytes(file_path)
+            if raw is None:
+                return None
         try:
-            # Try different encodings
-            encodings = ['utf-8', 'utf-8-sig', 'cp1250', 'iso-8859-2', 'latin1']
-            
-            for encoding in encodings:
-                try:
-                    with open(file_path, 'r', encoding=encoding) as f:
-                        return f.read()
-                except UnicodeDecodeError:
-                    continue
-            
-            # If all encodings fail, try binary mode
-            with open(file_path, 'rb') as f:
-                raw_content = f.read()
-                return raw_content.decode('utf-8', errors='ignore')
-                
+            return self.encoding_detector.decode(raw, os.path.dirname(file_path), encoding_hint)
         except Exception as e:
-            logger.error(f"Failed to read {file_path}: {e}")
+            logger.error(f"Failed to decode {file_path}: {e}")
             return None
 
     def _extract_text_content(self, content: str, file_path: str) -> str:
@@ -603,16 +841,22 @@ class OptimizedComarchDocumentLoader:
             return 0
         
         files = self._scan_directory(directory)
-        documents = []
-        
-        for file_path in files:
-            doc = self._process_single_file(file_path)
-            if doc:
-                documents.append(doc)
+        documents = self._process_files(files)
         
         logger.info(f"Loaded {len(documents)} documents from {directory}")
         return len(documents)
 
+    def close(self):
+        """Zamyka pulę wątków i połączenia cache'u"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+        if self._lookup_executor is not None:
+            self._lookup_executor.shutdown(wait=True)
+            self._lookup_executor = None
+        if self.cache:
+            self.cache.close()
+
     def get_loader_stats(self) -> Dict[str, Any]:
         """Pobiera statystyki loadera"""
         stats_dict = asdict(self.stats)
@@ -626,8 +870,11 @@ class OptimizedComarchDocumentLoader:
         """Czyści cache"""
         if self.cache:
             try:
-                os.remove(self.cache.cache_file)
-                self.cache._init_cache()
+                self.cache.close()
+                for suffix in ("", "-wal", "-shm"):
+                    if os.path.exists(self.cache.cache_file + suffix):
+                        os.remove(self.cache.cache_file + suffix)
+                self.cache.reopen()
                 logger.info("✅ Cache cleared")
             except Exception as e:
                 logger.error(f"Failed to clear cache: {e}")
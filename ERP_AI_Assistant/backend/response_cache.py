@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+=================================================================================
+RESPONSE CACHE - ograniczony cache odpowiedzi RAG
+LRU + TTL + limit rozmiaru, epoki wersji dokumentów i semantyczne trafienia
+Backendy: pamięć procesu lub współdzielony plik SQLite (WAL) dla wielu workerów
+=================================================================================
+"""
+
+import os
+import time
+import json
+import pickle
+import sqlite3
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+from typing import Dict, Any, Optional, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# DATA STRUCTURES
+# ============================================================================
+
+@dataclass
+class CacheEntry:
+    """Wpis cache z metadanymi wygasania i wersji"""
+    value: Any
+    size_bytes: int
+    epoch: int
+    created_at: float
+    scope: Optional[str] = None
+    embedding: Optional[np.ndarray] = None
+    # Wartość zserializowana raz w ResponseCache.put - backend dyskowy zapisuje te bajty
+    payload: Optional[bytes] = None
+
+@dataclass
+class CacheStats:
+    """Liczniki cache (per proces)"""
+    hits: int = 0
+    semantic_hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    expirations: int = 0
+    invalidations: int = 0
+
+
+def content_cache_key(*parts: Any) -> str:
+    """Klucz adresowany treścią - identyczny we wszystkich procesach"""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+# ============================================================================
+# BACKENDS
+# ============================================================================
+
+class CacheBackend:
+    """Magazyn wpisów cache - polityka (TTL, epoki, semantyka) jest w ResponseCache"""
+
+    name = "base"
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        raise NotImplementedError
+
+    def put(self, key: str, entry: CacheEntry):
+        raise NotImplementedError
+
+    def touch(self, key: str):
+        """Oznacza wpis jako ostatnio użyty (LRU)"""
+        raise NotImplementedError
+
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    def semantic_candidates(self, scope: Optional[str], epoch: int) -> List[Tuple[str, float, np.ndarray]]:
+        """(klucz, created_at, embedding) wpisów z embeddingiem w danym zakresie i epoce"""
+        raise NotImplementedError
+
+    def evict(self, max_entries: int, max_bytes: int) -> int:
+        """Usuwa najdawniej używane wpisy ponad limity - zwraca liczbę usuniętych"""
+        raise NotImplementedError
+
+    def get_epoch(self) -> int:
+        raise NotImplementedError
+
+    def bump_epoch(self) -> Tuple[int, int]:
+        """Atomowo zwiększa epokę o 1 i czyści wpisy - (nowa epoka, liczba usuniętych)"""
+        raise NotImplementedError
+
+    def clear(self) -> int:
+        raise NotImplementedError
+
+    def size(self) -> Tuple[int, int]:
+        """(liczba wpisów, bajty)"""
+        raise NotImplementedError
+
+
+class MemoryCacheBackend(CacheBackend):
+    """Wpisy w pamięci procesu (OrderedDict w kolejności LRU)"""
+
+    name = "memory"
+
+    def __init__(self):
+        self._entries: "OrderedDict[str, CacheEntry]" = OrderedDict()
+        self._epoch = 0
+        self._total_bytes = 0
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        return self._entries.get(key)
+
+    def put(self, key: str, entry: CacheEntry):
+        self.delete(key)
+        # W pamięci trzymany jest obiekt - bajty posłużyły tylko do oszacowania rozmiaru
+        entry.payload = None
+        self._entries[key] = entry
+        self._total_bytes += entry.size_bytes
+
+    def touch(self, key: str):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+
+    def delete(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._total_bytes -= entry.size_bytes
+
+    def semantic_candidates(self, scope: Optional[str], epoch: int) -> List[Tuple[str, float, np.ndarray]]:
+        return [(key, entry.created_at, entry.embedding) for key, entry in self._entries.items()
+                if entry.embedding is not None and entry.scope == scope and entry.epoch == epoch]
+
+    def evict(self, max_entries: int, max_bytes: int) -> int:
+        evicted = 0
+        while self._entries and (len(self._entries) > max_entries or self._total_bytes > max_bytes):
+            self.delete(next(iter(self._entries)))
+            evicted += 1
+        return evicted
+
+    def get_epoch(self) -> int:
+        return self._epoch
+
+    def bump_epoch(self) -> Tuple[int, int]:
+        self._epoch += 1
+        return self._epoch, self.clear()
+
+    def clear(self) -> int:
+        removed = len(self._entries)
+        self._entries.clear()
+        self._total_bytes = 0
+        return removed
+
+    def size(self) -> Tuple[int, int]:
+        return len(self._entries), self._total_bytes
+
+
+class SQLiteCacheBackend(CacheBackend):
+    """Wpisy w pliku SQLite (WAL) - współdzielone przez wszystkie workery na hoście"""
+
+    name = "sqlite"
+
+    def __init__(self, db_path: str, busy_timeout_ms: int = 5000):
+        self.db_path = db_path
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+        self._init_database()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Jedno połączenie na wątek (sqlite3 nie współdzieli połączeń między wątkami)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        return conn
+
+    def _init_database(self):
+        conn = self._connection()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS response_cache (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size_bytes INTEGER NOT NULL,
+                epoch INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL,
+                scope TEXT,
+                embedding BLOB
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_access ON response_cache(last_access)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_response_cache_scope ON response_cache(scope, epoch)')
+        conn.execute('CREATE TABLE IF NOT EXISTS cache_meta (name TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        conn.execute("INSERT OR IGNORE INTO cache_meta(name, value) VALUES ('epoch', '0')")
+
+    def get(self, key: str) -> Optional[CacheEntry]:
+        row = self._connection().execute(
+            'SELECT value, size_bytes, epoch, created_at, scope, embedding FROM response_cache WHERE key = ?',
+            (key,)
+        ).fetchone()
+        if row is None:
+            return None
+
+        try:
+            value = pickle.loads(row[0])
+        except Exception as e:
+            # Wpis zapisany przez niezgodną wersję kodu - traktuj jak brak
+            logger.warning(f"Nie można odczytać wpisu cache {key[:12]}: {e}")
+            self.delete(key)
+            return None
+
+        return CacheEntry(value=value, size_bytes=row[1], epoch=row[2], created_at=row[3],
+                          scope=row[4], embedding=self._decode_embedding(row[5]))
+
+    def put(self, key: str, entry: CacheEntry):
+        embedding = None
+        if entry.embedding is not None:
+            embedding = np.asarray(entry.embedding, dtype=np.float32).tobytes()
+        payload = entry.payload
+        if payload is None:
+            payload = pickle.dumps(entry.value, protocol=pickle.HIGHEST_PROTOCOL)
+        self._connection().execute(
+            'INSERT OR REPLACE INTO response_cache '
+            '(key, value, size_bytes, epoch, created_at, last_access, scope, embedding) '
+            'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+            (key, payload, entry.size_bytes, entry.epoch, entry.created_at, time.time(), entry.scope, embedding)
+        )
+
+    def touch(self, key: str):
+        self._connection().execute('UPDATE response_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+
+    def delete(self, key: str):
+        self._connection().execute('DELETE FROM response_cache WHERE key = ?', (key,))
+
+    def semantic_candidates(self, scope: Optional[str], epoch: int) -> List[Tuple[str, float, np.ndarray]]:
+        rows = self._connection().execute(
+            'SELECT key, created_at, embedding FROM response_cache '
+            'WHERE scope IS ? AND epoch = ? AND embedding IS NOT NULL',
+            (scope, epoch)
+        ).fetchall()
+        return [(key, created_at, self._decode_embedding(embedding)) for key, created_at, embedding in rows]
+
+    def evict(self, max_entries: int, max_bytes: int) -> int:
+        conn = self._connection()
+        count, total_bytes = self.size()
+        evicted = 0
+
+        while count > max_entries or total_bytes > max_bytes:
+            # Usuwanie partiami od najdawniej używanych
+            batch = max(count - max_entries, 1) if total_bytes <= max_bytes else max(count // 10, 1)
+            rows = conn.execute(
+                'SELECT key, size_bytes FROM response_cache ORDER BY last_access LIMIT ?', (batch,)
+            ).fetchall()
+            if not rows:
+                break
+            conn.executemany('DELETE FROM response_cache WHERE key = ?', [(key,) for key, _ in rows])
+            evicted += len(rows)
+            count -= len(rows)
+            total_bytes -= sum(size for _, size in rows)
+
+        return evicted
+
+    def get_epoch(self) -> int:
+        row = self._connection().execute("SELECT value FROM cache_meta WHERE name = 'epoch'").fetchone()
+        return int(row[0]) if row else 0
+
+    def bump_epoch(self) -> Tuple[int, int]:
+        # Odczyt i zapis epoki w jednej transakcji - dwa workery nie nadadzą tej samej wersji
+        conn = self._connection()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            conn.execute("UPDATE cache_meta SET value = CAST(value AS INTEGER) + 1 WHERE name = 'epoch'")
+            epoch = int(conn.execute("SELECT value FROM cache_meta WHERE name = 'epoch'").fetchone()[0])
+            removed = conn.execute('DELETE FROM response_cache').rowcount
+            conn.execute('COMMIT')
+        except Exception:
+            conn.execute('ROLLBACK')
+            raise
+        return epoch, removed
+
+    def clear(self) -> int:
+        return self._connection().execute('DELETE FROM response_cache').rowcount
+
+    def size(self) -> Tuple[int, int]:
+        row = self._connection().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size_bytes), 0) FROM response_cache'
+        ).fetchone()
+        return int(row[0]), int(row[1])
+
+    @staticmethod
+    def _decode_embedding(data: Optional[bytes]) -> Optional[np.ndarray]:
+        return np.frombuffer(data, dtype=np.float32) if data else None
+
+
+def create_cache_backend(backend: str = "memory", path: Optional[str] = None) -> CacheBackend:
+    """Tworzy backend cache wg konfiguracji (RESPONSE_CACHE_BACKEND)"""
+    backend = (backend or "memory").lower()
+    if backend == "sqlite":
+        return SQLiteCacheBackend(path or "response_cache.db")
+    if backend != "memory":
+        raise ValueError(f"Nieznany backend cache: {backend} (dostępne: memory, sqlite)")
+    return MemoryCacheBackend()
+
+# ============================================================================
+# RESPONSE CACHE
+# ============================================================================
+
+class ResponseCache:
+    """Cache odpowiedzi: LRU z limitem wpisów/bajtów, TTL i unieważnianiem po zmianie kolekcji"""
+
+    def __init__(self, max_entries: int = 500, max_bytes: int = 64 * 1024 * 1024,
+                 ttl_seconds: float = 3600, semantic_threshold: Optional[float] = None,
+                 backend: Optional[CacheBackend] = None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        # None/0 wyłącza warstwę semantyczną
+        self.semantic_threshold = semantic_threshold or None
+
+        self.backend = backend or MemoryCacheBackend()
+        self.stats = CacheStats()
+        self._lock = threading.RLock()
+
+    @property
+    def epoch(self) -> int:
+        return self.backend.get_epoch()
+
+    def __len__(self) -> int:
+        return self.backend.size()[0]
+
+    def get(self, key: str, embedding: Optional[np.ndarray] = None, scope: Optional[str] = None,
+            count: bool = True) -> Optional[Any]:
+        """Trafienie dokładne po kluczu, a gdy brak - semantyczne (podobne zapytanie w tym samym zakresie)"""
+        with self._lock:
+            epoch = self.epoch
+            entry = self.backend.get(key)
+            if entry is not None and self._is_live(key, entry, epoch):
+                self.backend.touch(key)
+                if count:
+                    self.stats.hits += 1
+                return entry.value
+
+            if embedding is not None and self.semantic_threshold:
+                match = self._semantic_lookup(embedding, scope, epoch)
+                if match is not None:
+                    if count:
+                        self.stats.semantic_hits += 1
+                    return match
+
+            if count:
+                self.stats.misses += 1
+            return None
+
+    def put(self, key: str, value: Any, embedding: Optional[np.ndarray] = None,
+            scope: Optional[str] = None):
+        """Zapisuje wartość i usuwa najdawniej używane wpisy ponad limity"""
+        payload = self._serialize(value)
+        size_bytes = len(payload) if payload is not None else len(str(value).encode('utf-8', errors='ignore'))
+        if size_bytes > self.max_bytes:
+            logger.debug(f"Wpis cache {key} przekracza limit rozmiaru ({size_bytes} B) - pomijam")
+            return
+
+        normalized = None
+        if embedding is not None and self.semantic_threshold:
+            normalized = np.asarray(embedding, dtype=np.float32).ravel()
+            normalized = normalized / max(float(np.linalg.norm(normalized)), 1e-12)
+
+        with self._lock:
+            self.backend.put(key, CacheEntry(
+                value=value,
+                size_bytes=size_bytes,
+                epoch=self.epoch,
+                created_at=time.time(),
+                scope=scope,
+                embedding=normalized,
+                payload=payload
+            ))
+            self.stats.evictions += self.backend.evict(self.max_entries, self.max_bytes)
+
+    def invalidate(self) -> int:
+        """Unieważnia cache po zmianie kolekcji dokumentów - nowa epoka we wszystkich workerach"""
+        with self._lock:
+            epoch, removed = self.backend.bump_epoch()
+            self.stats.invalidations += removed
+            logger.info(f"🔄 Cache odpowiedzi unieważniony (epoka dokumentów {epoch})")
+            return epoch
+
+    def clear(self) -> int:
+        with self._lock:
+            return self.backend.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = asdict(self.stats)
+            lookups = self.stats.hits + self.stats.semantic_hits + self.stats.misses
+            size, total_bytes = self.backend.size()
+            stats.update({
+                'backend': self.backend.name,
+                'size': size,
+                'bytes': total_bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl_seconds,
+                'semantic_threshold': self.semantic_threshold,
+                'epoch': self.epoch,
+                'hit_rate': round((self.stats.hits + self.stats.semantic_hits) / lookups, 3) if lookups else 0.0
+            })
+            return stats
+
+    def _is_live(self, key: str, entry: CacheEntry, epoch: int) -> bool:
+        """Sprawdza TTL i epokę - wygasły wpis jest od razu usuwany"""
+        if entry.epoch != epoch:
+            self.backend.delete(key)
+            return False
+        if self._is_expired(entry.created_at):
+            self.backend.delete(key)
+            self.stats.expirations += 1
+            return False
+        return True
+
+    def _is_expired(self, created_at: float) -> bool:
+        return bool(self.ttl_seconds) and time.time() - created_at > self.ttl_seconds
+
+    def _semantic_lookup(self, embedding: np.ndarray, scope: Optional[str], epoch: int) -> Optional[Any]:
+        """Najbliższy wpis (cosinus) powyżej progu w tej samej epoce i zakresie"""
+        candidates = [(key, vector) for key, created_at, vector in self.backend.semantic_candidates(scope, epoch)
+                      if not self._is_expired(created_at)]
+        if not candidates:
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32).ravel()
+        query = query / max(float(np.linalg.norm(query)), 1e-12)
+        similarities = np.stack([vector for _, vector in candidates]) @ query
+
+        best = int(np.argmax(similarities))
+        if similarities[best] < self.semantic_threshold:
+            return None
+
+        key = candidates[best][0]
+        entry = self.backend.get(key)
+        if entry is None:
+            return None
+        self.backend.touch(key)
+        return entry.value
+
+    @staticmethod
+    def _serialize(value: Any) -> Optional[bytes]:
+        """Pickle wartości (jedyna serializacja przy zapisie) - None gdy wartość się nie serializuje"""
+        try:
+            return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return None